@@ -84,7 +84,8 @@ const Englishshell = ({ SelectedConversation}) => {
 
       const reader = res.body.getReader();
       const decoder = new TextDecoder("utf-8");
-      let jsonBuffer = "";
+      // 串流中逐字累積的欄位內容
+      const liveFields = { ai_response: "", hint: "", translation: "" };
       let hasAddedLive = false;
       const aiMessageId = `msg-${Date.now()}-ai`;
       let structuredData = null;
@@ -112,19 +113,25 @@ const Englishshell = ({ SelectedConversation}) => {
               throw new Error(parsed.message);
             }
             
-            if (parsed.type === 'delta') {
-              // 累積 JSON 片段
-              jsonBuffer += parsed.content;
-              
-              // 嘗試解析部分 JSON 來顯示進度（可選）
+            if (typeof parsed.type === 'string' && parsed.type.endsWith('.delta')) {
+              // 逐字累積 ai_response / hint / translation，並即時顯示
+              const field = parsed.type.slice(0, -'.delta'.length);
+              if (field in liveFields) {
+                liveFields[field] += parsed.content;
+              }
+              const liveEntry = {
+                speaker: "ai",
+                text: liveFields.ai_response || "正在生成回應...",
+                hint: liveFields.hint,
+                translation: liveFields.translation,
+                id: aiMessageId,
+                status: 'sending'
+              };
               if (!hasAddedLive) {
-                setTranscript(prev => [...prev, { 
-                  speaker: "ai", 
-                  text: "正在生成回應...",
-                  id: aiMessageId,
-                  status: 'sending'
-                }]);
+                setTranscript(prev => [...prev, liveEntry]);
                 hasAddedLive = true;
+              } else {
+                setTranscript(prev => prev.map(msg => msg.id === aiMessageId ? liveEntry : msg));
               }
             }
             
@@ -157,26 +164,21 @@ const Englishshell = ({ SelectedConversation}) => {
         }
       }
 
-      // 如果沒有收到 complete 事件，嘗試解析累積的 JSON
-      if (!structuredData && jsonBuffer) {
-        try {
-          structuredData = JSON.parse(jsonBuffer);
-          setTranscript(prev => {
-            const filtered = prev.filter(msg => msg.id !== aiMessageId);
-            return [...filtered, { 
-              speaker: "ai", 
-              text: structuredData.ai_response,
-              hint: structuredData.hint,
-              translation: structuredData.translation,
-              id: aiMessageId,
-              status: 'success',
-              structured: true
-            }];
-          });
-        } catch (e) {
-          console.error("無法解析完整 JSON:", e);
-          throw new Error("無法解析伺服器回應");
-        }
+      // 如果沒有收到 complete 事件，使用串流中累積的欄位內容
+      if (!structuredData && liveFields.ai_response) {
+        structuredData = { ...liveFields };
+        setTranscript(prev => {
+          const filtered = prev.filter(msg => msg.id !== aiMessageId);
+          return [...filtered, { 
+            speaker: "ai", 
+            text: structuredData.ai_response,
+            hint: structuredData.hint,
+            translation: structuredData.translation,
+            id: aiMessageId,
+            status: 'success',
+            structured: true
+          }];
+        });
       }
 
     } catch (error) {
@@ -0,0 +1,222 @@
+import os
+import json
+import zlib
+import asyncio
+import threading
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from storage_utils import atomic_write_json
+
+
+# 超過 N 天未更新的對話移入冷儲存（0 表示停用）
+COLD_STORAGE_DAYS = float(os.getenv("COLD_STORAGE_DAYS", "30"))
+# 背景壓縮工作的執行間隔（秒）
+COLD_STORAGE_INTERVAL = float(os.getenv("COLD_STORAGE_INTERVAL", str(6 * 3600)))
+# 每次批次處理的對話數，避免長時間佔用寫入執行緒
+COLD_STORAGE_BATCH = int(os.getenv("COLD_STORAGE_BATCH", "200"))
+
+
+class ColdStore:
+    """冷儲存：把多個對話壓縮後追加到少數幾個 segment 檔案中。
+
+    - segment-NNNNNN.dat：逐筆追加的 zlib 壓縮 JSON
+    - index.json：key -> [segment, offset, length, meta]，meta 是列表用的小型摘要（標題、時間等）
+    先寫入資料再更新索引，最後才由呼叫端刪除原檔；中途當機最多留下重複資料，不會遺失。
+    """
+
+    def __init__(self, directory: str, max_segment_bytes: int = 32 * 1024 * 1024):
+        self.directory = directory
+        self.max_segment_bytes = max_segment_bytes
+        self.index_file = os.path.join(directory, "index.json")
+        self._index: Dict[str, List[Any]] = {}
+        self._lock = threading.RLock()
+        if os.path.exists(self.index_file):
+            try:
+                with open(self.index_file, 'r', encoding='utf-8') as f:
+                    self._index = json.load(f)
+            except Exception as e:
+                print(f"讀取冷儲存索引失敗: {e}")
+
+    def _segment_path(self, segment: str) -> str:
+        return os.path.join(self.directory, segment)
+
+    def _segments(self) -> List[str]:
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted(n for n in os.listdir(self.directory) if n.startswith("segment-") and n.endswith(".dat"))
+
+    def _current_segment(self) -> str:
+        segments = self._segments()
+        if segments:
+            last = segments[-1]
+            if os.path.getsize(self._segment_path(last)) < self.max_segment_bytes:
+                return last
+            number = int(last[len("segment-"):-len(".dat")]) + 1
+        else:
+            number = 1
+        return f"segment-{number:06d}.dat"
+
+    def _save_index(self) -> None:
+        atomic_write_json(self.index_file, self._index)
+
+    # --- 查詢 ---
+    def __contains__(self, key: str) -> bool:
+        return key in self._index
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            location = self._index.get(key)
+            if location is None:
+                return None
+            segment, offset, length = location[:3]
+            try:
+                with open(self._segment_path(segment), 'rb') as f:
+                    f.seek(offset)
+                    blob = f.read(length)
+                return json.loads(zlib.decompress(blob).decode("utf-8"))
+            except Exception as e:
+                print(f"讀取冷儲存 {key} 失敗: {e}")
+                return None
+
+    def items(self) -> List[Tuple[str, Dict[str, Any]]]:
+        """列出 (key, meta)，不需解壓縮內容"""
+        with self._lock:
+            return [(key, location[3] if len(location) > 3 else {}) for key, location in self._index.items()]
+
+    # --- 寫入 ---
+    def put_many(self, records: Iterable[Tuple[str, Any, Dict[str, Any]]]) -> int:
+        """批次寫入 (key, payload, meta)；回傳寫入筆數"""
+        records = list(records)
+        if not records:
+            return 0
+        with self._lock:
+            os.makedirs(self.directory, exist_ok=True)
+            segment = self._current_segment()
+            path = self._segment_path(segment)
+            count = 0
+            with open(path, 'ab') as f:
+                offset = f.tell()
+                locations = {}
+                for key, payload, meta in records:
+                    blob = zlib.compress(json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode("utf-8"), 6)
+                    f.write(blob)
+                    locations[key] = [segment, offset, len(blob), meta]
+                    offset += len(blob)
+                    count += 1
+                f.flush()
+                os.fsync(f.fileno())
+            self._index.update(locations)
+            self._save_index()
+            return count
+
+    def delete(self, key: str) -> bool:
+        """從索引移除（空間於 vacuum 時回收）"""
+        with self._lock:
+            if self._index.pop(key, None) is None:
+                return False
+            self._save_index()
+            return True
+
+    def vacuum(self, min_live_ratio: float = 0.5) -> int:
+        """重寫存活資料比例過低的 segment，回傳回收的位元組數"""
+        with self._lock:
+            live: Dict[str, int] = {}
+            for location in self._index.values():
+                live[location[0]] = live.get(location[0], 0) + location[2]
+            current = self._current_segment()
+            reclaimed = 0
+            for segment in self._segments():
+                path = self._segment_path(segment)
+                size = os.path.getsize(path)
+                live_bytes = live.get(segment, 0)
+                if live_bytes == 0 and segment != current:
+                    os.remove(path)
+                    reclaimed += size
+                    continue
+                if segment == current or size == 0 or live_bytes / size >= min_live_ratio:
+                    continue
+                # 把存活的資料搬到新的 segment，再刪除舊檔
+                keys = [k for k, loc in self._index.items() if loc[0] == segment]
+                moved = []
+                failed = []
+                for key in keys:
+                    payload = self.get(key)
+                    if payload is None:
+                        failed.append(key)
+                        continue
+                    moved.append((key, payload, self._index[key][3] if len(self._index[key]) > 3 else {}))
+                self.put_many(moved)
+                if failed:
+                    # 仍有無法讀出的資料：保留舊 segment，避免刪除唯一的副本
+                    print(f"冷儲存 {segment} 有 {len(failed)} 筆資料無法讀取，保留該 segment: {failed[:5]}")
+                    continue
+                os.remove(path)
+                reclaimed += size - live_bytes
+            return reclaimed
+
+
+def cold_cutoff(days: float = COLD_STORAGE_DAYS) -> Optional[str]:
+    """回傳冷儲存的時間界線（ISO 字串）；停用時回傳 None"""
+    if days <= 0:
+        return None
+    return (datetime.now() - timedelta(days=days)).isoformat()
+
+
+class ColdStorageJob:
+    """定期把久未更新的對話移入冷儲存。
+
+    tasks 為 (名稱, fn(cutoff, batch) -> 本批移動數) 清單；每輪對每個 task 重複執行批次直到沒有可移動的對話。
+    """
+
+    def __init__(self, tasks: List[Tuple[str, Callable[[str, int], int]]],
+                 days: float = COLD_STORAGE_DAYS, interval: float = COLD_STORAGE_INTERVAL,
+                 batch: int = COLD_STORAGE_BATCH):
+        self.tasks = tasks
+        self.days = days
+        self.interval = interval
+        self.batch = batch
+        self._task: Optional[asyncio.Task] = None
+
+    async def run_once(self) -> Dict[str, int]:
+        cutoff = cold_cutoff(self.days)
+        moved: Dict[str, int] = {}
+        if cutoff is None:
+            return moved
+        for name, fn in self.tasks:
+            total = 0
+            try:
+                while True:
+                    count = await asyncio.to_thread(fn, cutoff, self.batch)
+                    total += count
+                    if count < self.batch:
+                        break
+            except Exception as e:
+                print(f"冷儲存壓縮 {name} 失敗: {e}")
+            moved[name] = total
+            if total:
+                print(f"冷儲存：{name} 移入 {total} 個對話")
+        return moved
+
+    async def _loop(self) -> None:
+        while True:
+            await self.run_once()
+            await asyncio.sleep(self.interval)
+
+    def start(self) -> None:
+        if self.days <= 0 or self._task is not None:
+            return
+        self._task = asyncio.create_task(self._loop())
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
@@ -0,0 +1,166 @@
+import os
+import sys
+import json
+import asyncio
+import argparse
+import threading
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from knowledge_base import MATH_CONCEPTS
+from prompt_loader import get_prompt_version
+from response_cache import normalize_text
+from storage_utils import atomic_write_json
+
+
+# 預先產生的概念解釋存放位置
+CONCEPT_STORE_DIR = os.getenv("CONCEPT_STORE_DIR", "concept_store")
+# 預先產生時同時進行的 LLM 呼叫數
+CONCEPT_PREGEN_CONCURRENCY = int(os.getenv("CONCEPT_PREGEN_CONCURRENCY", "4"))
+
+
+def concept_name_of(entry: str) -> str:
+    """目錄中的概念條目格式為「名稱：說明」，取冒號前的名稱"""
+    return entry.split("：", 1)[0].split(":", 1)[0].strip()
+
+
+def catalog_entries() -> List[Tuple[str, str]]:
+    """列出 MATH_CONCEPTS 中所有 (領域, 概念名稱)，依目錄順序且不重複"""
+    entries: List[Tuple[str, str]] = []
+    seen = set()
+    for domain, sections in MATH_CONCEPTS.items():
+        for concepts in sections.values():
+            for concept in concepts:
+                item = (domain, concept_name_of(concept))
+                if item not in seen:
+                    seen.add(item)
+                    entries.append(item)
+    return entries
+
+
+def concept_prompt_version() -> str:
+    """概念解釋提示詞的版本（提示詞內容的雜湊）"""
+    return get_prompt_version("math.concept_explain_system")[:16]
+
+
+def _entry_key(domain: str, concept_name: str) -> str:
+    return f"{domain}|{normalize_text(concept_name)}"
+
+
+class ConceptStore:
+    """依模型與提示詞版本保存預先產生的概念解釋。
+
+    每個 (模型, 提示詞版本) 一個 JSON 檔：{"領域|概念": ConceptExplanation 資料}。
+    檔案在被批次工作更新後會依 mtime 自動重新載入，伺服器不需重啟。
+    """
+
+    def __init__(self, directory: str = CONCEPT_STORE_DIR):
+        self.directory = directory
+        # path -> (mtime, entries)
+        self._files: Dict[str, Tuple[float, Dict[str, Any]]] = {}
+        self._lock = threading.RLock()
+        self._index: Dict[str, List[Tuple[str, str]]] = {}
+        for domain, name in catalog_entries():
+            self._index.setdefault(normalize_text(name), []).append((domain, name))
+
+    def _path(self, model: str, version: str) -> str:
+        safe_model = "".join(c if c.isalnum() or c in "-._" else "_" for c in model)
+        return os.path.join(self.directory, f"{safe_model}-{version}.json")
+
+    def _entries(self, model: str, version: str) -> Dict[str, Any]:
+        path = self._path(model, version)
+        with self._lock:
+            try:
+                mtime = os.path.getmtime(path)
+            except OSError:
+                return {}
+            cached = self._files.get(path)
+            if cached is not None and cached[0] == mtime:
+                return cached[1]
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    entries = json.load(f)
+            except Exception as e:
+                print(f"讀取概念解釋存檔 {path} 失敗: {e}")
+                entries = {}
+            self._files[path] = (mtime, entries)
+            return entries
+
+    def resolve(self, concept_name: str, domain: Optional[str] = None) -> Optional[Tuple[str, str]]:
+        """把請求的概念對應到目錄中的條目；未指定領域且名稱跨多個領域時不對應"""
+        candidates = self._index.get(normalize_text(concept_name), [])
+        if domain:
+            candidates = [c for c in candidates if c[0] == domain]
+        return candidates[0] if len(candidates) == 1 else None
+
+    def get(self, model: str, concept_name: str, domain: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        entry = self.resolve(concept_name, domain)
+        if entry is None:
+            return None
+        return self._entries(model, concept_prompt_version()).get(_entry_key(*entry))
+
+    def has(self, model: str, version: str, domain: str, concept_name: str) -> bool:
+        return _entry_key(domain, concept_name) in self._entries(model, version)
+
+    def put(self, model: str, version: str, domain: str, concept_name: str, data: Dict[str, Any]) -> None:
+        path = self._path(model, version)
+        with self._lock:
+            entries = dict(self._entries(model, version))
+            entries[_entry_key(domain, concept_name)] = data
+            os.makedirs(self.directory, exist_ok=True)
+            atomic_write_json(path, entries)
+            self._files[path] = (os.path.getmtime(path), entries)
+
+
+async def pregenerate(
+    store: ConceptStore,
+    explain: Callable[[str, Optional[str]], Awaitable[Dict[str, Any]]],
+    model: str,
+    concurrency: int = CONCEPT_PREGEN_CONCURRENCY,
+    force: bool = False,
+) -> Dict[str, int]:
+    """為目錄中每個概念產生解釋並存檔。
+
+    已完成的條目會略過（force=True 時重新產生）；每完成一項即寫入，中斷後重新執行即可接續。
+    """
+    version = concept_prompt_version()
+    entries = catalog_entries()
+    pending = [e for e in entries if force or not store.has(model, version, *e)]
+    counts = {"total": len(entries), "skipped": len(entries) - len(pending), "generated": 0, "failed": 0}
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async def run(domain: str, name: str) -> None:
+        async with semaphore:
+            try:
+                data = await explain(name, domain)
+            except Exception as e:
+                counts["failed"] += 1
+                print(f"產生概念解釋失敗 [{domain}] {name}: {getattr(e, 'detail', e)}")
+                return
+            await asyncio.to_thread(store.put, model, version, domain, name, data)
+            counts["generated"] += 1
+            print(f"[{counts['generated'] + counts['skipped']}/{counts['total']}] {domain} - {name}")
+
+    await asyncio.gather(*(run(domain, name) for domain, name in pending))
+    return counts
+
+
+# 全域實例：/api/v1/math/concept 優先由此讀取
+concept_store = ConceptStore()
+
+
+if __name__ == "__main__":
+    # 用法：python concept_store.py [--concurrency N] [--force] [--model MODEL]
+    parser = argparse.ArgumentParser(description="預先產生 MATH_CONCEPTS 中所有概念的解釋")
+    parser.add_argument("--concurrency", type=int, default=CONCEPT_PREGEN_CONCURRENCY, help="同時進行的 LLM 呼叫數")
+    parser.add_argument("--force", action="store_true", help="重新產生已存在的條目")
+    parser.add_argument("--model", default=None, help="使用的模型（預設與數學解題相同）")
+    args = parser.parse_args()
+
+    from dotenv import load_dotenv
+    load_dotenv()
+    from math_solver import math_solver
+    if args.model:
+        math_solver.model = args.model
+    result = asyncio.run(pregenerate(concept_store, math_solver._explain_concept, math_solver.model, args.concurrency, args.force))
+    print(f"完成：共 {result['total']} 項，新產生 {result['generated']}，略過 {result['skipped']}，失敗 {result['failed']}")
+    sys.exit(1 if result["failed"] else 0)
@@ -1,7 +1,11 @@
 from fastapi import FastAPI, HTTPException
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel
 from typing import Optional, List, Dict, Any
 from config_loader import config_loader
+from response_cache import response_cache
+from single_flight import single_flight
+from llm_clients import llm_clients
 
 
 def register_config_endpoints(app: FastAPI):
@@ -28,6 +32,7 @@ def register_config_endpoints(app: FastAPI):
         success = config_loader.add_endpoint(endpoint)
         if not success:
             raise HTTPException(status_code=400, detail="端點 ID 已存在")
+        llm_clients.refresh()
         return {"ok": True, "endpoint": endpoint}
 
     @app.put("/api/v1/config/endpoints/{endpoint_id}", tags=["Config"])
@@ -36,6 +41,7 @@ def register_config_endpoints(app: FastAPI):
         success = config_loader.update_endpoint(endpoint_id, req.dict(exclude_unset=True))
         if not success:
             raise HTTPException(status_code=404, detail="端點不存在")
+        llm_clients.refresh()
         return {"ok": True}
 
     @app.delete("/api/v1/config/endpoints/{endpoint_id}", tags=["Config"])
@@ -44,6 +50,7 @@ def register_config_endpoints(app: FastAPI):
         success = config_loader.delete_endpoint(endpoint_id)
         if not success:
             raise HTTPException(status_code=404, detail="端點不存在")
+        llm_clients.refresh()
         return {"ok": True}
 
     # ===== 模型管理 =====
@@ -112,5 +119,22 @@ def register_config_endpoints(app: FastAPI):
     async def reload_config():
         """重新載入配置檔案"""
         config_loader.reload()
-        return {"ok": True, "message": "配置已重新載入"}
+        # 端點設定改變時重建對應的連線池（舊連線池在寬限期後關閉）
+        llm_clients.refresh()
+        return {"ok": True, "message": "配置已重新載入", "clients": llm_clients.stats()}
 
+
+    # ===== 回應快取 =====
+
+    @app.get("/api/v1/config/cache", tags=["Config"])
+    async def get_cache_stats():
+        """查看 LLM 回應快取的項目數與命中統計（含合併的同時請求數）"""
+        stats = await run_in_threadpool(response_cache.stats)
+        stats["single_flight"] = single_flight.stats()
+        return stats
+
+    @app.delete("/api/v1/config/cache", tags=["Config"])
+    async def purge_cache(namespace: Optional[str] = None, expired_only: bool = False):
+        """清除 LLM 回應快取（可限定 namespace，例如 english.query，或只清除過期項目）"""
+        deleted = await run_in_threadpool(response_cache.purge, namespace=namespace, expired_only=expired_only)
+        return {"ok": True, "deleted": deleted}
@@ -0,0 +1,143 @@
+import os
+import json
+from typing import Any, Dict, List, Optional, Tuple
+
+
+# 每輪送出的對話歷史上限（估計的 token 數，不含系統提示與摘要）
+ENGLISH_CONTEXT_TOKEN_BUDGET = int(os.getenv("ENGLISH_CONTEXT_TOKEN_BUDGET", "2000"))
+# 逐字保留的最近輪數（一輪 = 使用者 + AI 各一則）
+ENGLISH_CONTEXT_MAX_TURNS = int(os.getenv("ENGLISH_CONTEXT_MAX_TURNS", "6"))
+# 視窗外累積多少則訊息才觸發摘要（避免每輪都呼叫一次）
+ENGLISH_SUMMARY_BATCH = int(os.getenv("ENGLISH_SUMMARY_BATCH", "4"))
+# 摘要本身的長度上限（字元），讓組裝後的提示詞不隨對話長度成長
+ENGLISH_SUMMARY_MAX_CHARS = int(os.getenv("ENGLISH_SUMMARY_MAX_CHARS", "1500"))
+
+# metadata 中保存滾動摘要的欄位：{"text": 摘要, "upto": 已摘要的訊息數, "updated_at": ...}
+SUMMARY_KEY = "context_summary"
+
+
+def estimate_tokens(text: str) -> int:
+    """粗估 token 數：ASCII 約 4 字元一個 token，其他字元（中文等）各算一個"""
+    ascii_chars = sum(1 for c in text if ord(c) < 128)
+    return (ascii_chars + 3) // 4 + (len(text) - ascii_chars)
+
+
+def message_text(message: Dict[str, Any]) -> str:
+    """訊息送給模型的文字：結構化的 AI 回覆只保留 ai_response，hint 與 translation 不再重送"""
+    content = message.get("content")
+    if isinstance(content, dict):
+        if "ai_response" in content:
+            return str(content.get("ai_response") or "")
+        return json.dumps(content, ensure_ascii=False)
+    if isinstance(content, list):
+        return " ".join(
+            str(item.get("text", "")) if isinstance(item, dict) else str(item)
+            for item in content
+        )
+    return str(content or "")
+
+
+def _clip(text: str, budget: int) -> str:
+    """把文字截到約 budget 個 token（保留結尾，最近的內容較重要）"""
+    if estimate_tokens(text) <= budget:
+        return text
+    cost = 0.0
+    start = len(text)
+    while start > 0 and cost < budget:
+        start -= 1
+        cost += 0.25 if ord(text[start]) < 128 else 1
+    return "…" + text[start:]
+
+
+class ContextWindow:
+    """以 token 預算組裝英文對話的提示詞。
+
+    - 保留開場的系統提示，接著是 metadata 中的滾動摘要，最後是預算內最近幾輪的原文
+    - 已摘要的訊息不再送出；視窗外尚未摘要的訊息最多多帶 summary_batch 則，其餘待背景摘要補上
+    - 摘要在一輪結束後由呼叫端非同步更新（pending_summary 決定要摺疊哪些訊息）
+    """
+
+    def __init__(
+        self,
+        token_budget: int = ENGLISH_CONTEXT_TOKEN_BUDGET,
+        max_turns: int = ENGLISH_CONTEXT_MAX_TURNS,
+        summary_batch: int = ENGLISH_SUMMARY_BATCH,
+    ):
+        self.token_budget = token_budget
+        self.max_turns = max_turns
+        self.summary_batch = summary_batch
+
+    @staticmethod
+    def _history_start(messages: List[Dict[str, Any]]) -> int:
+        """開頭的系統提示不屬於對話歷史"""
+        start = 0
+        while start < len(messages) and messages[start].get("role") == "system":
+            start += 1
+        return start
+
+    @staticmethod
+    def summary_of(metadata: Dict[str, Any]) -> Tuple[str, int]:
+        summary = metadata.get(SUMMARY_KEY) or {}
+        return summary.get("text", ""), int(summary.get("upto", 0) or 0)
+
+    def window_start(self, messages: List[Dict[str, Any]]) -> int:
+        """逐字保留的第一則訊息位置：由最新往前，受輪數與 token 預算限制（至少保留最新一則）"""
+        first = self._history_start(messages)
+        start = len(messages)
+        used = 0
+        while start > first and len(messages) - start < self.max_turns * 2:
+            cost = estimate_tokens(message_text(messages[start - 1]))
+            if used + cost > self.token_budget and start < len(messages):
+                break
+            used += cost
+            start -= 1
+        return start
+
+    def build(self, messages: List[Dict[str, Any]], metadata: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """回傳要送出的歷史訊息（不含本輪的使用者訊息）"""
+        first = self._history_start(messages)
+        start = self.window_start(messages)
+        summary_text, upto = self.summary_of(metadata)
+        upto = min(upto, len(messages))
+        if upto >= start:
+            # 已摘要的部分不重送原文
+            start = upto
+        else:
+            # 摘要尚未跟上時，最多多帶 summary_batch 則尚未摘要的訊息
+            start = max(first, upto, start - self.summary_batch)
+
+        context: List[Dict[str, Any]] = list(messages[:first])
+        if summary_text:
+            context.append({
+                "role": "system",
+                "content": f"Summary of the earlier part of this conversation:\n{summary_text}",
+            })
+        for message in messages[start:]:
+            text = message_text(message)
+            if message is messages[-1]:
+                text = _clip(text, self.token_budget)
+            context.append({"role": message.get("role", "user"), "content": text})
+        return context
+
+    def pending_summary(self, messages: List[Dict[str, Any]], metadata: Dict[str, Any]) -> Optional[Tuple[int, int]]:
+        """需要摺疊進摘要的訊息範圍 [from, to)；累積不足 summary_batch 則回傳 None"""
+        first = self._history_start(messages)
+        _, upto = self.summary_of(metadata)
+        begin = max(first, upto)
+        end = self.window_start(messages)
+        if end - begin < self.summary_batch:
+            return None
+        return begin, end
+
+    @staticmethod
+    def transcript(messages: List[Dict[str, Any]]) -> str:
+        lines = []
+        for message in messages:
+            speaker = "AI" if message.get("role") == "assistant" else "User"
+            lines.append(f"{speaker}: {message_text(message)}")
+        return "\n".join(lines)
+
+    @staticmethod
+    def clip_summary(text: str) -> str:
+        text = text.strip()
+        return text if len(text) <= ENGLISH_SUMMARY_MAX_CHARS else text[:ENGLISH_SUMMARY_MAX_CHARS].rstrip() + "…"
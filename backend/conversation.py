@@ -1,115 +1,461 @@
 import os
 import json
+import threading
 from datetime import datetime
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List, Optional, Tuple
 from pydantic import BaseModel
 
 
-from math_model import MathSolution, ConversationInfo 
+from math_model import MathSolution, ConversationInfo
+from write_behind import write_queue
+from cold_storage import ColdStore
+from journal import ConversationJournal
+from conversation_index import ConversationIndex
+from pagination import decode_cursor, cursor_key, key_cursor
+from lru import LRUCache
+from session_locks import SessionLockManager
+
+# 日誌 metadata 紀錄中保存的欄位
+META_FIELDS = ("session_id", "title", "created_at", "updated_at")
+# 摘要索引檔（副檔名刻意不是 .json / .jsonl，避免被當成對話檔）
+SUMMARY_INDEX_FILE = "summaries.idx"
+# 記憶體中保留的已解析 session 數
+MATH_CACHE_MAX_SESSIONS = int(os.getenv("MATH_CACHE_MAX_SESSIONS", "128"))
+# MathSolution 必備的欄位
+SOLUTION_FIELDS = ("problem", "domain", "relevant_concepts", "steps", "final_answer")
+
 
 class ConversationManager:
-    """管理長期對話紀錄，並將其保存到 JSON 檔案中"""
-    def __init__(self, history_dir: str = "conversation_history"):
+    """管理長期對話紀錄：每個 session 一份追加式日誌（{session_id}.jsonl）。
+
+    add_messages 只把新訊息放入記憶體緩衝並登記背景寫入，寫入執行緒再以一次追加落盤；
+    日誌累積過多 metadata 紀錄時的壓縮也在寫入執行緒進行，不佔用請求。
+    舊版的整份 JSON 檔（{session_id}.json）仍可讀取，第一次寫入時轉為日誌。
+    列表由摘要索引（標題、時間、訊息數）提供，每次 add_messages 時同步更新，不需開啟對話檔。
+    最近使用的 session 以 LRU 保留解析後的歷史與最後一次 MathSolution，並以檔案 mtime 驗證。
+    self._lock 只保護記憶體狀態，不在持有時讀寫檔案；同一 session 的讀檔與落盤另以分片的 I/O 鎖序列化
+    （取得順序固定為 I/O 鎖 → self._lock）。
+    """
+    def __init__(self, history_dir: str = "conversation_history", max_cached_sessions: int = MATH_CACHE_MAX_SESSIONS):
         self.history_dir = history_dir
         os.makedirs(self.history_dir, exist_ok=True)
+        self.journal = ConversationJournal(self.history_dir)
+        # 久未更新的對話移入壓縮 segment，讀取時透明地取回
+        self.cold = ColdStore(os.path.join(self.history_dir, "cold"))
+        # session_id -> 尚未落盤的 {"messages": [...], "meta": {...}}
+        self._buffers: Dict[str, Dict[str, Any]] = {}
+        # session_id -> {"meta", "history", "mtime", "last_solution"}
+        self._sessions = LRUCache(max_entries=max_cached_sessions)
+        self._lock = threading.RLock()
+        self._io_locks = SessionLockManager()
+        # session_id -> 摘要（讓後續的 add_messages 與列表都不必重讀歷史）
+        summary_file = os.path.join(self.history_dir, SUMMARY_INDEX_FILE)
+        rebuild = not os.path.exists(summary_file)
+        self.summaries = ConversationIndex(summary_file)
+        if rebuild:
+            self.rebuild_summaries()
+        else:
+            self.reconcile_summaries()
 
     def _get_path(self, session_id: str) -> str:
-        """獲取對話紀錄檔案的路徑"""
+        """舊版（整份 JSON）對話紀錄檔案的路徑"""
         return os.path.join(self.history_dir, f"{session_id}.json")
 
-    def _read_conversation(self, session_id: str) -> Optional[Dict[str, Any]]:
-        """讀取 JSON 檔案中的對話內容"""
+    @staticmethod
+    def _split(data: Dict[str, Any]) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+        """將舊版格式（metadata 與 history 在同一個 dict）拆成 (history, metadata)"""
+        return list(data.get("history", [])), {k: data.get(k) for k in META_FIELDS if k in data}
+
+    def _load_stored(self, session_id: str) -> Optional[Tuple[List[Dict[str, Any]], Dict[str, Any]]]:
+        """讀取已落盤的 (history, metadata)：日誌 → 舊版 JSON → 冷儲存"""
+        replayed = self.journal.replay(session_id)
+        if replayed is not None:
+            return replayed
         filepath = self._get_path(session_id)
-        if not os.path.exists(filepath):
-            return None
-        try:
-            with open(filepath, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        except (json.JSONDecodeError, IOError) as e:
-            print(f"Error reading conversation {session_id}: {e}")
+        if os.path.exists(filepath):
+            try:
+                with open(filepath, 'r', encoding='utf-8') as f:
+                    return self._split(json.load(f))
+            except (json.JSONDecodeError, IOError) as e:
+                print(f"Error reading conversation {session_id}: {e}")
+                return None
+        cold = self.cold.get(session_id)
+        return self._split(cold) if cold is not None else None
+
+    def _stored_mtime(self, session_id: str) -> Optional[int]:
+        """已落盤檔案（日誌或舊版 JSON）的 mtime；只在冷儲存或尚未落盤時為 None"""
+        for path in (os.path.join(self.history_dir, f"{session_id}.jsonl"), self._get_path(session_id)):
+            try:
+                return os.stat(path).st_mtime_ns
+            except FileNotFoundError:
+                continue
+        return None
+
+    @staticmethod
+    def _as_solution(content: Any) -> Optional[MathSolution]:
+        """將助理訊息內容轉成 MathSolution；不符合結構時回傳 None"""
+        if isinstance(content, MathSolution):
+            return content
+        # 檢查內容是否符合 MathSolution 的結構
+        if isinstance(content, dict) and all(k in content for k in SOLUTION_FIELDS):
+            try:
+                return MathSolution(**content)
+            except Exception:
+                return None
+        return None
+
+    def _session(self, session_id: str) -> Optional[Dict[str, Any]]:
+        """取得快取的 session；檔案 mtime 改變（例如被外部修改）時重新載入"""
+        mtime = self._stored_mtime(session_id)
+        with self._lock:
+            cached = self._sessions.get(session_id)
+            if cached is not None and cached["mtime"] == mtime:
+                return cached
+        with self._io_locks.locked(session_id):
+            mtime = self._stored_mtime(session_id)
+            stored = self._load_stored(session_id)
+            # 合併緩衝與放入快取在同一個臨界區，期間的 add_messages 不會遺漏
+            with self._lock:
+                cached = self._sessions.get(session_id)
+                if cached is not None and cached["mtime"] == mtime:
+                    return cached
+                data = self._with_buffer(session_id, stored)
+                if data is None:
+                    self._sessions.pop(session_id)
+                    return None
+                history = data.pop("history")
+                last_solution = None
+                for message in reversed(history):
+                    if message.get("role") == "assistant":
+                        last_solution = self._as_solution(message.get("content"))
+                        if last_solution is not None:
+                            break
+                session = {"meta": data, "history": history, "mtime": mtime, "last_solution": last_solution}
+                self._sessions.put(session_id, session)
+                return session
+
+    def _with_buffer(self, session_id: str, stored: Optional[Tuple[List[Dict[str, Any]], Dict[str, Any]]]) -> Optional[Dict[str, Any]]:
+        """已落盤的 (history, metadata) 加上尚未落盤的緩衝（呼叫端須持有 self._lock）"""
+        buffer = self._buffers.get(session_id)
+        if stored is None and buffer is None:
             return None
+        history, meta = stored if stored is not None else ([], {})
+        if buffer is not None:
+            history = history + buffer["messages"]
+            meta = buffer["meta"]
+        return {**meta, "history": history}
 
-    def _write_conversation(self, session_id: str, data: Dict[str, Any]):
-        """將對話內容寫入 JSON 檔案"""
-        filepath = self._get_path(session_id)
+    def _read_conversation(self, session_id: str) -> Optional[Dict[str, Any]]:
+        """讀取對話內容（已落盤的歷史加上尚未落盤的緩衝）"""
+        with self._io_locks.locked(session_id):
+            stored = self._load_stored(session_id)
+            with self._lock:
+                return self._with_buffer(session_id, stored)
+
+    @staticmethod
+    def _build_summary(session_id: str, meta: Dict[str, Any], message_count: int) -> Dict[str, Any]:
+        return {
+            "session_id": meta.get("session_id") or session_id,
+            "title": meta.get("title"),
+            "created_at": meta.get("created_at"),
+            "updated_at": meta.get("updated_at"),
+            "message_count": message_count,
+        }
+
+    def _session_summary(self, session_id: str) -> Optional[Dict[str, Any]]:
+        """取得摘要；索引中沒有時（例如索引重建前的舊對話）讀取一次並補上"""
+        entry, _ = self.summaries.get(session_id)
+        if entry is None:
+            session = self._session(session_id)
+            if session is None:
+                return None
+            entry = self._build_summary(session_id, session["meta"], len(session["history"]))
+            self.summaries.upsert(session_id, entry, False)
+        return entry
+
+    def rebuild_summaries(self) -> int:
+        """掃描所有對話（日誌、舊版 JSON、冷儲存）重建摘要索引，回傳對話數"""
+        entries: Dict[str, Dict[str, Any]] = {}
+        # 掃描期間不持有 self._lock；之後才有新訊息的對話保留索引中的現值
+        started = datetime.now().isoformat()
+        for filename in os.listdir(self.history_dir):
+            if not (filename.endswith(".jsonl") or filename.endswith(".json")):
+                continue
+            session_id = filename.rsplit(".", 1)[0]
+            if session_id in entries:
+                continue
+            try:
+                data = self._read_conversation(session_id)
+            except Exception as e:
+                print(f"Error reading or parsing conversation file {filename}: {e}")
+                continue
+            if data is not None:
+                entries[session_id] = self._build_summary(session_id, data, len(data.get("history", [])))
+        for session_id, meta in self.cold.items():
+            if session_id in entries:
+                continue
+            count = meta.get("message_count")
+            if count is None:
+                data = self._read_conversation(session_id) or {}
+                count = len(data.get("history", []))
+            entries[session_id] = self._build_summary(session_id, meta, count)
+        with self._lock:
+            for session_id, entry, _ in self.summaries.items():
+                if (entry.get("updated_at") or "") >= started:
+                    entries[session_id] = entry
+            for session_id, buffer in self._buffers.items():
+                if session_id not in entries:
+                    entries[session_id] = self._build_summary(session_id, buffer["meta"], len(buffer["messages"]))
+            self.summaries.replace_all(entries)
+        self.summaries.flush()
+        return len(entries)
+
+    def reconcile_summaries(self) -> int:
+        """啟動時以對話檔校正摘要索引（上次關閉前索引可能尚未寫回），回傳有變動的對話數。
+
+        索引中沒有、或比索引檔新的對話檔重新讀取；檔案與冷儲存都不存在的條目移除。
+        """
+        summary_file = os.path.join(self.history_dir, SUMMARY_INDEX_FILE)
         try:
-            with open(filepath, 'w', encoding='utf-8') as f:
-                json.dump(data, f, ensure_ascii=False, indent=4)
-        except IOError as e:
-            print(f"Error writing conversation {session_id}: {e}")
+            index_mtime = os.stat(summary_file).st_mtime_ns
+        except FileNotFoundError:
+            index_mtime = None
+        changed = 0
+        on_disk = set()
+        with os.scandir(self.history_dir) as entries:
+            for file_entry in entries:
+                if not file_entry.is_file() or not (file_entry.name.endswith(".jsonl") or file_entry.name.endswith(".json")):
+                    continue
+                session_id = file_entry.name.rsplit(".", 1)[0]
+                on_disk.add(session_id)
+                entry, _ = self.summaries.get(session_id)
+                if entry is not None and index_mtime is not None and file_entry.stat().st_mtime_ns <= index_mtime:
+                    continue
+                try:
+                    data = self._read_conversation(session_id)
+                except Exception as e:
+                    print(f"Error reading or parsing conversation file {file_entry.name}: {e}")
+                    continue
+                if data is not None:
+                    self.summaries.upsert(session_id, self._build_summary(session_id, data, len(data.get("history", []))), False)
+                    changed += 1
+        with self._lock:
+            for session_id, _, _ in self.summaries.items():
+                if session_id not in on_disk and session_id not in self.cold and session_id not in self._buffers:
+                    self.summaries.remove(session_id)
+                    changed += 1
+        if changed:
+            print(f"已依對話檔校正數學對話摘要索引：{changed} 個對話")
+            self.summaries.flush()
+        return changed
+
+    def flush(self) -> None:
+        """等待背景寫入完成，並立即寫回摘要索引（供關閉流程與測試使用）"""
+        write_queue.flush()
+        self.summaries.flush()
+
+    def list_summaries(self, cursor: Optional[str] = None, limit: Optional[int] = None) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """依 updated_at 由新到舊分頁列出摘要，回傳 (summaries, next_cursor)；cursor 無效時拋出 ValueError"""
+        rows = self.summaries.page(None, cursor_key(decode_cursor(cursor)), limit)
+        summaries = [entry for _, entry, _ in rows]
+        next_cursor = None
+        if limit and len(rows) == limit:
+            last_sid, last_entry, _ = rows[-1]
+            next_cursor = key_cursor((last_entry.get("updated_at") or "", last_sid))
+        return summaries, next_cursor
+
+    def _flush_session(self, session_id: str):
+        """把緩衝中的訊息以一次追加寫入日誌（由寫入執行緒呼叫）。
+
+        只在取出緩衝與更新快取時持有 self._lock，檔案 I/O 期間事件迴圈上的其他請求不必等待；
+        同一 session 的讀檔則以 I/O 鎖等待這次落盤完成。
+        """
+        with self._io_locks.locked(session_id):
+            with self._lock:
+                buffer = self._buffers.pop(session_id, None)
+                if not buffer:
+                    return
+            before = self._stored_mtime(session_id)
+            try:
+                if self.journal.exists(session_id):
+                    self.journal.append(session_id, buffer["messages"], buffer["meta"])
+                else:
+                    # 新對話、舊版 JSON 或冷儲存中的對話：寫入完整快照後移除舊副本
+                    stored = self._load_stored(session_id)
+                    history = stored[0] if stored is not None else []
+                    self.journal.write_snapshot(session_id, history + buffer["messages"], buffer["meta"])
+                    legacy_file = self._get_path(session_id)
+                    if os.path.exists(legacy_file):
+                        os.remove(legacy_file)
+                    if session_id in self.cold:
+                        self.cold.delete(session_id)
+                after = self._stored_mtime(session_id)
+            except (IOError, OSError) as e:
+                print(f"Error writing conversation {session_id}: {e}")
+                with self._lock:
+                    # 放回緩衝，待下次寫入時重試
+                    pending = self._buffers.get(session_id)
+                    if pending is not None:
+                        buffer = {"messages": buffer["messages"] + pending["messages"], "meta": pending["meta"]}
+                    self._buffers[session_id] = buffer
+                return
+            with self._lock:
+                # 快取已包含這批訊息；若寫入前與磁碟同步，更新 mtime 讓快取繼續有效
+                cached = self._sessions.peek(session_id)
+                if cached is not None:
+                    if cached["mtime"] == before:
+                        cached["mtime"] = after
+                    else:
+                        self._sessions.pop(session_id)
+
+    def archive_cold(self, cutoff: str, batch: int) -> int:
+        """把最後修改早於 cutoff 的對話移入冷儲存，回傳本批移動數"""
+        # 在寫入執行緒上執行，與同一對話的寫入序列化
+        return write_queue.run(("cold", "math"), self._archive_cold, cutoff, batch)
+
+    def _archive_cold(self, cutoff: str, batch: int) -> int:
+        cutoff_ts = datetime.fromisoformat(cutoff).timestamp()
+        moved = []
+        # 掃描、讀取與壓縮都不持有 self._lock；之後才有新訊息的對話由排在後面的落盤從冷儲存取回
+        with os.scandir(self.history_dir) as entries:
+            for entry in entries:
+                if len(moved) >= batch:
+                    break
+                if not entry.is_file() or not (entry.name.endswith(".jsonl") or entry.name.endswith(".json")):
+                    continue
+                session_id = entry.name.rsplit(".", 1)[0]
+                with self._lock:
+                    if session_id in self._buffers:
+                        continue
+                if entry.stat().st_mtime >= cutoff_ts:
+                    continue
+                stored = self._load_stored(session_id)
+                if stored is None:
+                    continue
+                history, meta = stored
+                moved.append((session_id, {**meta, "history": history}, {**meta, "message_count": len(history)}))
+        # 先確保冷儲存寫入完成，再刪除原檔
+        self.cold.put_many(moved)
+        for session_id, _, _ in moved:
+            with self._io_locks.locked(session_id):
+                self.journal.delete(session_id)
+                legacy_file = self._get_path(session_id)
+                if os.path.exists(legacy_file):
+                    os.remove(legacy_file)
+        if len(moved) < batch:
+            self.cold.vacuum()
+        return len(moved)
 
     def get_history(self, session_id: str) -> List[Dict[str, Any]]:
         """獲取指定 session 的對話紀錄"""
-        data = self._read_conversation(session_id)
-        return data.get("history", []) if data else []
+        session = self._session(session_id)
+        return list(session["history"]) if session else []
 
-    def add_message(self, session_id: str, role: str, content: Any, title: Optional[str] = None):
-        """向指定 session 添加一條訊息並保存"""
-        data = self._read_conversation(session_id)
+    def add_messages(self, session_id: str, messages: List[Dict[str, Any]], title: Optional[str] = None):
+        """一次加入多條訊息（[{"role": ..., "content": ..., "response_id": 可省略}, ...]），落盤時只需一次追加"""
         now = datetime.now().isoformat()
-        
-        if data is None:
-            # 這是新對話的第一條訊息
-            data = {
-                "session_id": session_id,
-                "title": title or "新對話",
-                "created_at": now,
-                "history": []
+        entries = []
+        last_solution = None
+        for message in messages:
+            content = message["content"]
+            entry = {
+                "role": message["role"],
+                "content": content.model_dump() if isinstance(content, BaseModel) else content,
+                "timestamp": now
             }
+            # 上游保存的回應 ID，供追問以 previous_response_id 接續
+            if message.get("response_id"):
+                entry["response_id"] = message["response_id"]
+            entries.append(entry)
+            if message["role"] == "assistant":
+                last_solution = self._as_solution(content) or last_solution
+
+        # 索引中沒有摘要時先讀取對話補上（讀檔不持有 self._lock）
+        self._session_summary(session_id)
+        with self._lock:
+            summary, _ = self.summaries.get(session_id)
+            if summary is None:
+                # 這是新對話的第一批訊息
+                summary = self._build_summary(session_id, {"title": title or "新對話", "created_at": now}, 0)
+            summary = {**summary, "updated_at": now, "message_count": summary.get("message_count", 0) + len(entries)}
+            self.summaries.upsert(session_id, summary, False)
+            meta = {k: summary.get(k) for k in META_FIELDS}
+            buffer = self._buffers.setdefault(session_id, {"messages": []})
+            buffer["messages"].extend(entries)
+            buffer["meta"] = meta
+            # 快取中的 session 直接追加，並更新最後一次解題方案的指標
+            cached = self._sessions.peek(session_id)
+            if cached is not None:
+                cached["history"].extend(entries)
+                cached["meta"] = meta
+                if last_solution is not None:
+                    cached["last_solution"] = last_solution
+
+        # 同一 session 尚未執行的寫入會合併，緩衝在寫入時一次取出
+        write_queue.submit(("math", session_id), self._flush_session, session_id)
+
+    def set_title(self, session_id: str, title: str) -> bool:
+        """只更新標題（例如背景產生的正式標題），不改變訊息與 updated_at；對話不存在時回傳 False"""
+        self._session_summary(session_id)
+        with self._lock:
+            summary, _ = self.summaries.get(session_id)
+            if summary is None:
+                return False
+            summary = {**summary, "title": title}
+            self.summaries.upsert(session_id, summary, False)
+            meta = {k: summary.get(k) for k in META_FIELDS}
+            # 沒有新訊息的緩衝會在落盤時追加一筆 metadata 紀錄
+            buffer = self._buffers.setdefault(session_id, {"messages": []})
+            buffer["meta"] = meta
+            cached = self._sessions.peek(session_id)
+            if cached is not None:
+                cached["meta"] = meta
+        write_queue.submit(("math", session_id), self._flush_session, session_id)
+        return True
+
+    def add_message(self, session_id: str, role: str, content: Any, title: Optional[str] = None):
+        """向指定 session 添加一條訊息並保存"""
+        self.add_messages(session_id, [{"role": role, "content": content}], title=title)
 
-        content_to_store = content.dict() if isinstance(content, BaseModel) else content
-        data["history"].append({
-            "role": role,
-            "content": content_to_store,
-            "timestamp": now
-        })
-        data["updated_at"] = now
-        
-        self._write_conversation(session_id, data)
-    
     def get_last_solution(self, session_id: str) -> Optional[MathSolution]:
-        """獲取最近一次的解題方案"""
-        history = self.get_history(session_id)
-        for message in reversed(history):
-            if message["role"] == "assistant":
-                content = message["content"]
-                # 檢查內容是否符合 MathSolution 的結構
-                if isinstance(content, dict) and all(k in content for k in ["problem", "domain", "relevant_concepts", "steps", "final_answer"]):
-                    try:
-                        # 嘗試將字典轉換回 MathSolution 模型
-                        return MathSolution(**content)
-                    except Exception:
-                        continue  # 如果轉換失敗，繼續尋找上一個
+        """獲取最近一次的解題方案（由快取中的指標直接取得，不需重新掃描與驗證）"""
+        session = self._session(session_id)
+        return session["last_solution"] if session else None
+
+    def get_last_response_id(self, session_id: str) -> Optional[str]:
+        """最後一則助理訊息的上游回應 ID；該訊息沒有 ID（例如快取命中或概念解釋）時回傳 None"""
+        session = self._session(session_id)
+        if not session:
+            return None
+        for message in reversed(session["history"]):
+            if message.get("role") == "assistant":
+                return message.get("response_id")
         return None
 
 # 全局對話管理器實例
 conversation_manager = ConversationManager()
 
 # --- API 輔助函數 ---
+def _to_info(meta: Dict[str, Any]) -> ConversationInfo:
+    return ConversationInfo(
+        session_id=meta.get("session_id"),
+        title=meta.get("title") or "無標題",
+        created_at=meta.get("created_at") or "",
+        updated_at=meta.get("updated_at") or "",
+        message_count=meta.get("message_count") or 0,
+    )
+
+
+def list_conversations_page(cursor: Optional[str] = None, limit: Optional[int] = None) -> Tuple[List[ConversationInfo], Optional[str]]:
+    """
+    由摘要索引分頁列出對話（按最後更新時間降序），回傳 (infos, next_cursor)。
+    """
+    summaries, next_cursor = conversation_manager.list_summaries(cursor=cursor, limit=limit)
+    return [_to_info(meta) for meta in summaries], next_cursor
+
+
 def list_conversations() -> List[ConversationInfo]:
     """
     列出所有已保存的對話紀錄。
     """
-    infos = []
-    history_dir = conversation_manager.history_dir
-    if not os.path.exists(history_dir):
-        return []
-
-    for filename in os.listdir(history_dir):
-        if filename.endswith(".json"):
-            try:
-                filepath = os.path.join(history_dir, filename)
-                with open(filepath, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                infos.append(ConversationInfo(
-                    session_id=data.get("session_id"),
-                    title=data.get("title", "無標題"),
-                    created_at=data.get("created_at"),
-                    updated_at=data.get("updated_at"),
-                ))
-            except Exception as e:
-                print(f"Error reading or parsing conversation file {filename}: {e}")
-    
-    # 按最後更新時間降序排序
-    infos.sort(key=lambda x: x.updated_at, reverse=True)
-    return infos
\ No newline at end of file
+    return list_conversations_page()[0]
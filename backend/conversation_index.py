@@ -0,0 +1,134 @@
+import os
+import json
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+from storage_utils import atomic_write_json, DebouncedFlusher
+from pagination import SortKey, SortedKeyIndex
+
+
+class ConversationIndex:
+    """英文對話索引的記憶體版本（以記憶體為準）。
+
+    結構與 index.json 相同：{"active": {sid: entry}, "archived": {sid: entry}}。
+    列表與搜尋直接讀取記憶體；變更後以去抖動的背景任務原子寫回磁碟。
+    另以 (updated_at, sid) 排序的次級索引提供 keyset 分頁（全部 / 僅 archived）。
+    """
+
+    def __init__(self, index_file: str, flush_delay: float = 1.0):
+        self.index_file = index_file
+        self._active: Dict[str, Dict[str, Any]] = {}
+        self._archived: Dict[str, Dict[str, Any]] = {}
+        self._order_all = SortedKeyIndex()
+        self._order_archived = SortedKeyIndex()
+        self._lock = threading.RLock()
+        self._flusher = DebouncedFlusher(self._write, delay=flush_delay)
+        self._load()
+
+    def _load(self) -> None:
+        if not os.path.exists(self.index_file):
+            return
+        try:
+            with open(self.index_file, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            self._active = dict(data.get("active", {}))
+            self._archived = dict(data.get("archived", {}))
+        except Exception as e:
+            print(f"讀取索引檔案時發生錯誤: {e}")
+        for sid in list(self._active) + list(self._archived):
+            self._reorder(sid)
+
+    def _write(self) -> None:
+        with self._lock:
+            data = {"active": dict(self._active), "archived": dict(self._archived)}
+        atomic_write_json(self.index_file, data)
+
+    def flush(self) -> None:
+        self._flusher.flush()
+
+    # --- 查詢 ---
+    def get(self, sid: str) -> Tuple[Optional[Dict[str, Any]], bool]:
+        """回傳 (entry, is_archived)；archived 優先"""
+        with self._lock:
+            if sid in self._archived:
+                return self._archived[sid], True
+            return self._active.get(sid), False
+
+    def is_archived(self, sid: str) -> bool:
+        return sid in self._archived
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            return {"active": dict(self._active), "archived": dict(self._archived)}
+
+    def items(self, section: Optional[str] = None) -> List[Tuple[str, Dict[str, Any], bool]]:
+        """列出 (sid, entry, is_archived)；section 為 None 時列出全部（同 sid 以 archived 為準）"""
+        with self._lock:
+            result: List[Tuple[str, Dict[str, Any], bool]] = []
+            if section in (None, "active"):
+                result.extend((sid, e, False) for sid, e in self._active.items()
+                              if section == "active" or sid not in self._archived)
+            if section in (None, "archived"):
+                result.extend((sid, e, True) for sid, e in self._archived.items())
+            return result
+
+    def page(
+        self,
+        section: Optional[str] = None,
+        after: Optional[SortKey] = None,
+        limit: Optional[int] = None,
+        accept=None,
+    ) -> List[Tuple[str, Dict[str, Any], bool]]:
+        """依 updated_at 由新到舊分頁列出 (sid, entry, is_archived)；accept(entry) 用於額外篩選"""
+        order = self._order_archived if section == "archived" else self._order_all
+        with self._lock:
+            def accept_sid(sid: str) -> bool:
+                return accept is None or accept(self.get(sid)[0])
+
+            result = []
+            for sid in order.page(after, limit, accept_sid):
+                entry, is_archived = self.get(sid)
+                result.append((sid, entry, is_archived))
+            return result
+
+    def _reorder(self, sid: str) -> None:
+        entry, is_archived = self.get(sid)
+        if entry is None:
+            self._order_all.remove(sid)
+            self._order_archived.remove(sid)
+            return
+        self._order_all.upsert(sid, entry.get("updated_at"))
+        if is_archived:
+            self._order_archived.upsert(sid, entry.get("updated_at"))
+        else:
+            self._order_archived.remove(sid)
+
+    # --- 更新 ---
+    def upsert(self, sid: str, entry: Dict[str, Any], is_archived: bool) -> None:
+        with self._lock:
+            # 將條目放入 active 或 archived
+            if is_archived:
+                self._archived[sid] = entry
+                self._active.pop(sid, None)
+            else:
+                self._active[sid] = entry
+            self._reorder(sid)
+        self._flusher.schedule()
+
+    def replace_all(self, active: Dict[str, Dict[str, Any]], archived: Optional[Dict[str, Dict[str, Any]]] = None) -> None:
+        """以重建結果整份取代索引內容"""
+        with self._lock:
+            self._active = dict(active)
+            self._archived = dict(archived or {})
+            self._order_all.clear()
+            self._order_archived.clear()
+            for sid in list(self._active) + list(self._archived):
+                self._reorder(sid)
+        self._flusher.schedule()
+
+    def remove(self, sid: str) -> None:
+        with self._lock:
+            self._active.pop(sid, None)
+            self._archived.pop(sid, None)
+            self._reorder(sid)
+        self._flusher.schedule()
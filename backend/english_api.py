@@ -1,16 +1,43 @@
-from fastapi import FastAPI, HTTPException, UploadFile
+from fastapi import FastAPI, HTTPException, UploadFile, Query, Request
 from fastapi.responses import StreamingResponse, JSONResponse
 from typing import Optional, Literal
 from datetime import datetime, timezone
 
 from english_solver import english_core, store
-from openai import OpenAI as SyncOpenAI
+from llm_clients import llm_clients
+from session_locks import session_locks, ConversationBusy, ConversationConflict
 from pydantic import BaseModel
 import os
 import openai
 from model_registry import model_registry
 from config_loader import config_loader
 import hashlib
+from write_behind import write_queue
+from streaming_json import IncrementalJSONParser
+
+# 串流時每收到幾個上游事件檢查一次用戶端是否已斷線
+DISCONNECT_CHECK_EVERY = int(os.getenv("STREAM_DISCONNECT_CHECK_EVERY", "8"))
+
+
+class TurnStreamingResponse(StreamingResponse):
+    """持有對話租約的串流回應：不論串流完成、用戶端中途斷線，或內容根本沒有開始送出，
+    回應結束時都會釋放租約（產生器的 finally 在內容未開始迭代時不會執行）"""
+
+    def __init__(self, content, sid: str, turn_token: int, **kwargs):
+        super().__init__(content, **kwargs)
+        self.sid = sid
+        self.turn_token = turn_token
+
+    async def __call__(self, scope, receive, send) -> None:
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            session_locks.end_turn(self.sid, self.turn_token)
+
+
+def _write_bytes(path: str, data: bytes):
+    with open(path, "wb") as f:
+        f.write(data)
 
 
 def register_english_endpoints(app: FastAPI):
@@ -64,12 +91,8 @@ def register_english_endpoints(app: FastAPI):
 
             # 快取未命中或讀檔失敗，生成並寫入快取
             audio_bytes = await english_core.tts(text=text_key, voice=voice, speed=speed_key, model=selected_tts_model)
-            try:
-                with open(cache_path, "wb") as f:
-                    f.write(audio_bytes)
-            except Exception:
-                # 寫檔失敗不影響回應
-                pass
+            # 交由背景寫入執行緒落盤；寫檔失敗不影響回應
+            write_queue.submit(("tts", digest), _write_bytes, cache_path, audio_bytes)
             return StreamingResponse(iter([audio_bytes]), media_type="audio/mpeg")
         except Exception:
             # 快取流程意外，退回原本流程
@@ -225,12 +248,8 @@ def register_english_endpoints(app: FastAPI):
             messages = [{"role": "assistant", "content": structured_greeting}]
             
             # 保存到內存和檔案（確保 metadata 完整傳遞）
-            store.conversations_db[sid] = messages
-            store.conversation_metadata[sid] = metadata
-            store.archived_conversations_db[sid] = list(messages)
-            store.archived_conversation_metadata[sid] = dict(metadata)
-            store.save_conversation(sid, messages, metadata, is_archived=False)
-            store.save_conversation(sid, list(messages), dict(metadata), is_archived=True)
+            store.cache_conversation(sid, messages, metadata)
+            store.save_conversation(sid, messages, metadata, is_archived=True)
             
             return {"sid": sid, "ai": greeting, "hint": hint, "translation": translation}
 
@@ -239,14 +258,17 @@ def register_english_endpoints(app: FastAPI):
         return await english_core.next_turn(sid=sid, user_text=req.user)
 
     @app.post("/api/v1/conversation/{sid}/stream", tags=["Conversation"]) 
-    async def next_conversation_turn_stream(sid: str, req: NextTurnRequest):
+    async def next_conversation_turn_stream(sid: str, req: NextTurnRequest, request: Request):
         """串流回傳 AI 回覆（SSE），使用 Structured Outputs 格式化輸出。"""
-        if sid not in store.conversations_db:
+        # 第一次存取時從存儲載入
+        conversation = store.get_conversation(sid)
+        if conversation is None:
             raise HTTPException(status_code=404, detail="Session ID not found.")
 
-        # 準備訊息（包含既有歷史 + 本次 user）
-        messages = list(store.conversations_db[sid])
-        metadata = store.conversation_metadata.get(sid, {})
+        # 準備訊息（預算內的歷史視窗與滾動摘要 + 本次 user）
+        stored_messages, metadata = conversation
+        version = store.get_version(metadata)
+        messages = english_core.build_context(stored_messages, metadata)
         default_llm = config_loader.get_defaults("english").get("llm", english_core.default_llm_model)
         selected_llm = metadata.get("model") or model_registry.get("english", "llm", default_llm)
         level = metadata.get("level", "B1")
@@ -263,17 +285,15 @@ Always provide all three fields."""
         # 構建包含系統提示的訊息列表
         full_messages = [{"role": "system", "content": structured_system_prompt}]
         full_messages.extend(messages)
-        full_messages.append({"role": "user", "content": req.user})
+        # 本次使用者訊息只加入請求副本，串流成功後才與 AI 回覆一起提交
+        user_message = {"role": "user", "content": req.user}
+        full_messages.append(user_message)
 
-        # 先把本次使用者訊息寫入對話記錄
+        # 同一對話同時只允許一輪；租約在串流結束時釋放
         try:
-            store.conversations_db[sid].append({"role": "user", "content": req.user})
-            store.archived_conversations_db[sid] = list(store.conversations_db[sid])
-            store.archived_conversation_metadata[sid] = dict(store.conversation_metadata.get(sid, {}))
-            store.save_conversation(sid, store.conversations_db[sid], store.conversation_metadata.get(sid, {}), is_archived=False)
-            store.save_conversation(sid, list(store.conversations_db[sid]), dict(store.conversation_metadata.get(sid, {})), is_archived=True)
-        except Exception:
-            pass
+            turn_token = session_locks.begin_turn(sid)
+        except ConversationBusy as e:
+            raise HTTPException(status_code=409, detail=str(e))
 
         # 轉換為 Responses API 輸入格式
         input_payload = []
@@ -335,12 +355,20 @@ Always provide all three fields."""
             "additionalProperties": False
         }
 
-        def sse_event_generator():
+        async def sse_event_generator():
+            try:
+                async for chunk in stream_turn():
+                    yield chunk
+            finally:
+                session_locks.end_turn(sid, turn_token)
+
+        async def stream_turn():
             import json
-            client = SyncOpenAI()
-            full_text = []
+            # 逐字送出三個字串欄位的內容，前端不需等待完整 JSON 即可顯示
+            parser = IncrementalJSONParser(stream_paths=[("ai_response",), ("hint",), ("translation",)])
             try:
-                with client.responses.stream(
+                # 依模型的 endpoint 共用 AsyncOpenAI 連線池；串流在事件迴圈上進行，不佔用執行緒
+                stream = await llm_clients.for_model(selected_llm).responses.create(
                     model=selected_llm,
                     input=input_payload,
                     text={
@@ -350,16 +378,25 @@ Always provide all three fields."""
                             "schema": conversation_schema,
                             "strict": True
                         }
-                    }
-                ) as stream:
-                    for event in stream:
+                    },
+                    stream=True,
+                )
+                async with stream:
+                    event_count = 0
+                    async for event in stream:
+                        # 用戶端已斷線：離開 async with 會關閉上游連線，本輪回覆不保存
+                        event_count += 1
+                        if event_count % DISCONNECT_CHECK_EVERY == 0 and await request.is_disconnected():
+                            print(f"Client disconnected from conversation {sid}, upstream stream cancelled")
+                            return
                         etype = getattr(event, "type", "") or getattr(event, "event", "")
                         if etype == "response.output_text.delta":
                             delta = getattr(event, "delta", "")
                             if delta:
-                                full_text.append(delta)
-                                # 串流傳送 JSON 片段
-                                yield f"data: {json.dumps({'type': 'delta', 'content': delta})}\n\n"
+                                # 依欄位送出 ai_response.delta / hint.delta / translation.delta
+                                for kind, path, value in parser.feed_events(delta):
+                                    if kind == "delta" and value:
+                                        yield f"data: {json.dumps({'type': f'{path[0]}.delta', 'content': value})}\n\n"
                         elif etype == "response.completed":
                             break
             except Exception as e:
@@ -369,27 +406,28 @@ Always provide all three fields."""
 
             # 串流結束後，解析並保存完整的結構化回覆
             try:
-                ai_full_json = "".join(full_text)
+                ai_full_json = parser.text
                 parsed_response = json.loads(ai_full_json)
                 
-                # 從 store 獲取最新的 messages 和 metadata，確保一致性
-                current_messages = store.conversations_db.get(sid, [])
-                current_metadata = store.conversation_metadata.get(sid, {})
-
-                # 保存完整的結構化回覆到對話記錄
-                current_messages.append({"role": "assistant", "content": parsed_response})
-                store.save_conversation(sid, current_messages, current_metadata, is_archived=False)
-                store.save_conversation(sid, current_messages, current_metadata, is_archived=True)
-                
+                # 使用者訊息與完整的結構化回覆一起提交；版本不符代表期間有其他寫入，拒絕而不是覆蓋
+                store.append_messages(sid, [user_message, {"role": "assistant", "content": parsed_response}], expected_version=version)
+                english_core.schedule_context_summary(sid)
+
                 # 發送完整的結構化數據
                 yield f"data: {json.dumps({'type': 'complete', 'data': parsed_response})}\n\n"
+            except ConversationConflict as e:
+                yield f"data: {json.dumps({'type': 'error', 'status': 409, 'message': str(e)})}\n\n"
+            except KeyError:
+                yield f"data: {json.dumps({'type': 'error', 'status': 404, 'message': 'Session ID not found.'})}\n\n"
             except Exception as e:
                 yield f"data: {json.dumps({'type': 'error', 'message': f'解析回應失敗: {str(e)}'})}\n\n"
 
             yield "data: [DONE]\n\n"
 
-        return StreamingResponse(
+        return TurnStreamingResponse(
             sse_event_generator(),
+            sid,
+            turn_token,
             media_type="text/event-stream",
             headers={
                 "Cache-Control": "no-cache",
@@ -399,49 +437,19 @@ Always provide all three fields."""
 
     @app.delete("/api/v1/conversation/{sid}", tags=["Conversation"]) 
     async def delete_conversation(sid: str):
-        """刪除指定對話（active 與 archived 檔案一併清理），並從索引移除。"""
+        """刪除指定對話（單一副本），並從索引移除。"""
         try:
-            from english_solver import CONVERSATIONS_DIR, ARCHIVED_DIR, INDEX_FILE
-            
-            # 清理內存資料
-            store.conversations_db.pop(sid, None)
-            store.conversation_metadata.pop(sid, None)
-            store.archived_conversations_db.pop(sid, None)
-            store.archived_conversation_metadata.pop(sid, None)
-
-            # 移除檔案
-            import os, json
-            for is_archived in (False, True):
-                target_dir = ARCHIVED_DIR if is_archived else CONVERSATIONS_DIR
-                path = os.path.join(target_dir, f"{sid}.json")
-                if os.path.exists(path):
-                    try:
-                        os.remove(path)
-                    except Exception:
-                        pass
-            # 更新索引
-            if os.path.exists(INDEX_FILE):
-                try:
-                    with open(INDEX_FILE, 'r', encoding='utf-8') as f:
-                        index = json.load(f)
-                except Exception:
-                    index = {"active": {}, "archived": {}}
-                index.get("active", {}).pop(sid, None)
-                index.get("archived", {}).pop(sid, None)
-                try:
-                    with open(INDEX_FILE, 'w', encoding='utf-8') as f:
-                        json.dump(index, f, ensure_ascii=False, indent=2)
-                except Exception:
-                    pass
+            store.delete_conversation(sid)
             return {"ok": True, "sid": sid}
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"刪除對話失敗: {e}")
 
     # 列出已歸檔的對話
     @app.get("/api/v1/conversations/archived", tags=["Conversation"]) 
-    async def list_archived_conversations():
-        archives = english_core.list_archives()
-        return {"archives": archives}
+    async def list_archived_conversations(cursor: Optional[str] = None, limit: Optional[int] = Query(None, ge=1, le=500)):
+        """未指定 limit 時回傳全部（相容舊版）；否則以 next_cursor 取得下一頁"""
+        archives, next_cursor = english_core.list_archives(cursor=cursor, limit=limit)
+        return {"archives": archives, "next_cursor": next_cursor}
 
     # 建立空白對話
     @app.post("/api/v1/conversations/new", tags=["Conversation"]) 
@@ -457,8 +465,8 @@ Always provide all three fields."""
 
         default_llm = config_loader.get_defaults("english").get("llm", english_core.default_llm_model)
         selected_model = model or model_registry.get("english", "llm", default_llm)
-        store.conversations_db[sid] = []
-        store.conversation_metadata[sid] = {
+        messages = []
+        metadata = {
             "topic": topic if topic != "Practice" else "",
             "level": level,
             "model": selected_model,
@@ -466,8 +474,8 @@ Always provide all three fields."""
             "created_at": datetime.now().isoformat(),
             "updated_at": datetime.now().isoformat(),
         }
-        store.save_conversation(sid, [], store.conversation_metadata[sid], is_archived=False)
-        store.save_conversation(sid, [], dict(store.conversation_metadata[sid]), is_archived=True)
+        store.cache_conversation(sid, messages, metadata)
+        store.save_conversation(sid, messages, metadata, is_archived=True)
         return {"sid": sid, "title": conversation_title, "topic": topic, "level": level}
 
     # 獲取已歸檔的對話記錄
@@ -477,8 +485,14 @@ Always provide all three fields."""
 
     # 搜尋對話
     @app.get("/api/v1/conversations/search", tags=["Conversation"]) 
-    async def search_conversations_api(query: Optional[str] = None, topic: Optional[str] = None, level: Optional[str] = None, limit: int = 10):
-        results = store.search_conversations(query=query or "", topic=topic or "", level=level or "", limit=limit)
-        return {"results": results, "total": len(results)}
+    async def search_conversations_api(query: Optional[str] = None, topic: Optional[str] = None, level: Optional[str] = None,
+                                       limit: int = Query(10, ge=1, le=100), offset: int = Query(0, ge=0), cursor: Optional[str] = None):
+        try:
+            results, next_cursor = store.search_conversations_page(
+                query=query or "", topic=topic or "", level=level or "", limit=limit, offset=offset, cursor=cursor
+            )
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        return {"results": results, "total": len(results), "next_cursor": next_cursor}
 
 
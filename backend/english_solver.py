@@ -1,50 +1,115 @@
 import os
 import uuid
 import json
+import asyncio
 from datetime import datetime
-from typing import Any, Dict, List, Optional, Literal
+from typing import Any, Dict, List, Optional, Literal, Tuple
 
 import openai
 from prompt_loader import get_prompt
 from fastapi import HTTPException
 from model_registry import model_registry
-
-
-# --- OpenAI 客戶端與設定 ---
+from english_storage import create_backend, entry_matches, to_search_result
+from search_index import SearchIndex
+from pagination import decode_cursor, encode_cursor, cursor_key, key_cursor
+from lru import LRUCache
+from write_behind import write_queue
+from session_locks import session_locks, ConversationBusy, ConversationConflict
+from response_cache import response_cache, normalize_text, hash_text
+from single_flight import single_flight
+from llm_clients import llm_clients
+from context_window import ContextWindow, SUMMARY_KEY
+
+
+# --- OpenAI 客戶端與設定（依模型的 endpoint 由 llm_clients 取得） ---
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "YOUR_OPENAI_API_KEY_HERE")
-client = openai.AsyncOpenAI(api_key=OPENAI_API_KEY)
 
 
 # --- 英文學習服務的核心狀態與存取 ---
 DATA_DIR = "conversation_data"
 CONVERSATIONS_DIR = os.path.join(DATA_DIR, "conversations")
-ARCHIVED_DIR = os.path.join(DATA_DIR, "archived")
 INDEX_FILE = os.path.join(DATA_DIR, "index.json")
+SEARCH_INDEX_FILE = os.path.join(DATA_DIR, "search_index.bin")
+
+# 記憶體中保留的對話上限（筆數與估計位元組數），超出時以 LRU 淘汰
+CACHE_MAX_SESSIONS = int(os.getenv("ENGLISH_CACHE_MAX_SESSIONS", "256"))
+CACHE_MAX_BYTES = int(os.getenv("ENGLISH_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
 
 os.makedirs(DATA_DIR, exist_ok=True)
-os.makedirs(CONVERSATIONS_DIR, exist_ok=True)
-os.makedirs(ARCHIVED_DIR, exist_ok=True)
 
 
 class EnglishStore:
-    def __init__(self):
-        self.conversations_db: Dict[str, List[Dict[str, Any]]] = {}
+    def __init__(self, backend=None, max_sessions: int = CACHE_MAX_SESSIONS, max_bytes: int = CACHE_MAX_BYTES):
+        # 訊息列表只在第一次存取時載入，並以 LRU 限制常駐記憶體；淘汰後仍可從後端重新載入
+        self.conversations_db = LRUCache(max_entries=max_sessions, max_bytes=max_bytes, on_evict=self._on_evict)
         self.conversation_metadata: Dict[str, Dict[str, Any]] = {}
-        # archived DB 只用於內存快取，主要數據源是檔案
-        self.archived_conversations_db: Dict[str, List[Dict[str, Any]]] = {}
-        self.archived_conversation_metadata: Dict[str, Dict[str, Any]] = {}
+        # sid -> 已計入快取大小的訊息數
+        self._cached_counts: Dict[str, int] = {}
+        # 儲存後端（檔案日誌或 SQLite），由 ENGLISH_STORE_BACKEND 決定
+        self.backend = backend or create_backend(DATA_DIR)
+        # 訊息內容的全文倒排索引
+        self.search_index = SearchIndex(SEARCH_INDEX_FILE)
         self.load_conversations()
 
+    # --- 記憶體快取 ---
+    @staticmethod
+    def _estimate_bytes(messages: List[Dict[str, Any]]) -> int:
+        return sum(len(json.dumps(m, ensure_ascii=False, default=str)) for m in messages)
+
+    def _on_evict(self, sid: str, _messages: List[Dict[str, Any]]):
+        self.conversation_metadata.pop(sid, None)
+        self._cached_counts.pop(sid, None)
+
+    def cache_conversation(self, sid: str, messages: List[Dict[str, Any]], metadata: Dict[str, Any]):
+        """將對話放入記憶體快取"""
+        self.conversation_metadata[sid] = metadata
+        self._cached_counts[sid] = len(messages)
+        self.conversations_db.put(sid, messages, size=self._estimate_bytes(messages))
+
+    def uncache_conversation(self, sid: str):
+        """從記憶體快取移除（存儲中的資料不受影響）"""
+        self.conversations_db.pop(sid)
+        self._on_evict(sid, [])
+
+    def _refresh_cache_size(self, sid: str, messages: List[Dict[str, Any]]):
+        """訊息追加後，只累加新訊息的大小"""
+        if self.conversations_db.peek(sid) is not messages:
+            return
+        counted = self._cached_counts.get(sid, 0)
+        if counted > len(messages):
+            size = self._estimate_bytes(messages)
+        else:
+            size = self.conversations_db.size_of(sid) + self._estimate_bytes(messages[counted:])
+        self._cached_counts[sid] = len(messages)
+        self.conversations_db.resize(sid, size)
+
+    def get_conversation(self, sid: str) -> Optional[Tuple[List[Dict[str, Any]], Dict[str, Any]]]:
+        """取得 (messages, metadata)；不在快取中時從後端載入，找不到則回傳 None"""
+        messages = self.conversations_db.get(sid)
+        if messages is not None:
+            return messages, self.conversation_metadata.setdefault(sid, {})
+        messages, metadata = self.load_conversation(sid)
+        if messages or metadata:
+            self.cache_conversation(sid, messages, metadata)
+            return messages, metadata
+        return None
+
     # --- 檔案 I/O (重構後的核心保存邏輯) ---
-    def save_conversation(self, sid: str, messages: List[Dict[str, Any]], metadata: Dict[str, Any], is_archived: bool = False):
+    def save_conversation(self, sid: str, messages: List[Dict[str, Any]], metadata: Dict[str, Any], is_archived: bool = False,
+                          touch: bool = True):
         """
-        將單個對話保存到對應的檔案（conversations 或 archived），並更新全局索引。
+        將單個對話保存到儲存後端，並更新全局索引。
+        每個對話只保存一份；is_archived 只決定索引中的歸檔狀態。
+        touch=False 用於只改內部 metadata 的寫入（如背景摘要），保留原本的 updated_at，不影響列表排序。
         這是唯一的寫入點，以確保數據一致性。
         """
         try:
             # 1. 準備和驗證 Metadata
             meta_to_save = metadata.copy()
-            meta_to_save["updated_at"] = datetime.now().isoformat()
+            # updated_at 會寫回呼叫端（快取中）的 metadata，touch=False 時直接沿用，不必查詢後端
+            previous = None if touch else metadata.get("updated_at")
+            meta_to_save["updated_at"] = previous or datetime.now().isoformat()
+            metadata["updated_at"] = meta_to_save["updated_at"]
 
             # 如果 title 無效，則生成一個
             if not meta_to_save.get("title") or meta_to_save["title"] == "Unknown":
@@ -59,126 +124,190 @@ class EnglishStore:
                 base_title = topic if topic and topic.strip() else "新對話"
                 meta_to_save["title"] = f"{base_title} ({level}) @ {time_str}"
 
-            # 2. 準備寫入檔案的完整數據結構
-            conversation_data = {
-                "sid": sid,
-                "metadata": meta_to_save,
-                "messages": messages,
-                "created_at": meta_to_save.get("created_at"),
-                "updated_at": meta_to_save.get("updated_at")
-            }
-
-            # 3. 寫入對話檔案 (conversations 或 archived)
-            target_dir = ARCHIVED_DIR if is_archived else CONVERSATIONS_DIR
-            os.makedirs(target_dir, exist_ok=True)
-            conversation_file = os.path.join(target_dir, f"{sid}.json")
-            with open(conversation_file, 'w', encoding='utf-8') as f:
-                json.dump(conversation_data, f, ensure_ascii=False, indent=2)
-
-            # 4. 更新全局索引 (index.json)
-            self._update_index_file(sid, messages, meta_to_save, is_archived)
+            # 2. 立即更新索引（記憶體），磁碟寫入交給背景寫入執行緒；
+            #    同一對話尚未執行的寫入會被合併，後端只追加尚未保存的訊息
+            self.backend.update_index(sid, messages, meta_to_save, is_archived)
+            self.search_index.update(sid, messages, meta_to_save)
+            self._refresh_cache_size(sid, messages)
+            write_queue.submit(("english", sid), self.backend.write, sid, list(messages), meta_to_save, is_archived)
 
         except Exception as e:
             print(f"❌ 保存會話 {sid} 時發生嚴重錯誤: {e}")
 
-    def _update_index_file(self, sid: str, messages: List[Dict[str, Any]], metadata: Dict[str, Any], is_archived: bool):
-        """獨立函數，專門負責讀寫 index.json，由 save_conversation 調用"""
-        try:
-            # 讀取現有索引
-            if os.path.exists(INDEX_FILE):
-                with open(INDEX_FILE, 'r', encoding='utf-8') as f:
-                    index = json.load(f)
-            else:
-                index = {"active": {}, "archived": {}}
-            
-            # 創建或更新索引條目
-            index_entry = {
-                "title": metadata.get("title"),
-                "topic": metadata.get("topic", ""),
-                "level": metadata.get("level", ""),
-                "created_at": metadata.get("created_at"),
-                "updated_at": metadata.get("updated_at"),
-                "message_count": len(messages)
-            }
-
-            # 將條目放入 active 或 archived
-            if is_archived:
-                index["archived"][sid] = index_entry
-                if sid in index["active"]:
-                    del index["active"][sid]
-            else:
-                index["active"][sid] = index_entry
-
-            # 寫回索引檔案
-            with open(INDEX_FILE, 'w', encoding='utf-8') as f:
-                json.dump(index, f, ensure_ascii=False, indent=2)
-
-        except Exception as e:
-            print(f"❌ 更新索引檔案時發生錯誤: {e}")
-
     def load_conversation(self, sid: str, is_archived: bool = False) -> tuple:
         try:
-            target_dir = ARCHIVED_DIR if is_archived else CONVERSATIONS_DIR
-            conversation_file = os.path.join(target_dir, f"{sid}.json")
-            if os.path.exists(conversation_file):
-                with open(conversation_file, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                    return data.get("messages", []), data.get("metadata", {})
-            return [], {}
+            # 尚未落盤的寫入才是最新狀態
+            if write_queue.peek(("english", sid, "delete")) is not None:
+                return [], {}
+            pending = write_queue.peek(("english", sid))
+            if pending is not None:
+                _, messages, metadata, _ = pending
+                return list(messages), dict(metadata)
+            return self.backend.load(sid, is_archived)
         except Exception as e:
             print(f"加載會話 {sid} 時發生錯誤: {e}")
             return [], {}
 
-    def search_conversations(self, query: str = "", topic: str = "", level: str = "", limit: int = 10) -> List[Dict]:
+    @staticmethod
+    def get_version(metadata: Dict[str, Any]) -> int:
+        return int(metadata.get("version", 0) or 0)
+
+    def append_messages(self, sid: str, new_messages: List[Dict[str, Any]], expected_version: Optional[int] = None) -> int:
+        """在 sid 的鎖內追加訊息、遞增版本並保存，回傳新版本。
+
+        expected_version 與目前版本不符時拋出 ConversationConflict（期間有其他寫入）；
+        對話不存在時拋出 KeyError。
+        """
+        with session_locks.locked(sid):
+            conversation = self.get_conversation(sid)
+            if conversation is None:
+                raise KeyError(sid)
+            messages, metadata = conversation
+            current = self.get_version(metadata)
+            if expected_version is not None and current != expected_version:
+                raise ConversationConflict(sid, expected_version, current)
+            messages.extend(new_messages)
+            metadata["version"] = current + 1
+            self.save_conversation(sid, messages, metadata, is_archived=True)
+            return current + 1
+
+    def has_conversation(self, sid: str, is_archived: bool = False) -> bool:
+        return self.backend.exists(sid, is_archived)
+
+    def delete_conversation(self, sid: str):
+        """刪除對話（單一副本），並從索引移除"""
+        with session_locks.locked(sid):
+            self.uncache_conversation(sid)
+            self.backend.remove_index(sid)
+            self.search_index.remove(sid)
+            write_queue.discard(("english", sid))
+            write_queue.submit(("english", sid, "delete"), self.backend.delete, sid)
+
+    def search_conversations(self, query: str = "", topic: str = "", level: str = "", limit: int = 10, offset: int = 0,
+                             after=None) -> List[Dict]:
+        """有 query 時以全文索引排序（標題、主題與訊息內容）；否則只依主題 / 等級篩選並按更新時間排序"""
         try:
-            if not os.path.exists(INDEX_FILE):
-                return []
-            with open(INDEX_FILE, 'r', encoding='utf-8') as f:
-                index = json.load(f)
+            if not query.strip():
+                return self.backend.search(topic=topic, level=level, limit=limit, offset=offset, after=after)
+
+            def matches_filters(sid: str) -> bool:
+                entry, _ = self.backend.get_entry(sid)
+                return entry is not None and entry_matches(entry, topic, level)
+
+            accept = matches_filters if topic or level else None
 
             results = []
-            all_conversations = {**index.get("active", {}), **index.get("archived", {})}
-            for sid, meta in all_conversations.items():
-                if topic and topic.lower() not in meta.get("topic", "").lower():
-                    continue
-                if level and level.upper() != meta.get("level", "").upper():
+            for sid, score in self.search_index.search(query, limit=limit, offset=offset, accept=accept):
+                entry, is_archived = self.backend.get_entry(sid)
+                if entry is None:
                     continue
-                if query and query.lower() not in meta.get("title", "").lower():
-                    continue
-                results.append({
-                    "sid": sid,
-                    "title": meta.get("title"),
-                    "topic": meta.get("topic"),
-                    "level": meta.get("level"),
-                    "created_at": meta.get("created_at"),
-                    "updated_at": meta.get("updated_at"),
-                    "message_count": meta.get("message_count", 0),
-                    "is_archived": sid in index.get("archived", {})
-                })
-
-            results.sort(key=lambda x: x.get("updated_at", ""), reverse=True)
-            return results[:limit]
+                result = to_search_result(sid, entry, is_archived)
+                result["score"] = score
+                results.append(result)
+            return results
         except Exception as e:
             print(f"搜索會話時發生錯誤: {e}")
             return []
 
+    def search_conversations_page(self, query: str = "", topic: str = "", level: str = "", limit: int = 10,
+                                  offset: int = 0, cursor: Optional[str] = None) -> Tuple[List[Dict], Optional[str]]:
+        """分頁搜尋，回傳 (results, next_cursor)；cursor 無效時拋出 ValueError"""
+        data = decode_cursor(cursor)
+        if query.strip():
+            # 依分數排序的結果以位移分頁
+            if data is not None:
+                offset = int(data.get("o", 0))
+            results = self.search_conversations(query, topic, level, limit, offset)
+            next_cursor = encode_cursor({"o": offset + limit}) if len(results) == limit else None
+        else:
+            after = cursor_key(data)
+            results = self.search_conversations(topic=topic, level=level, limit=limit,
+                                                offset=0 if after else offset, after=after)
+            next_cursor = self._next_key_cursor(results, limit)
+        return results, next_cursor
+
+    @staticmethod
+    def _next_key_cursor(items: List[Dict[str, Any]], limit: Optional[int]) -> Optional[str]:
+        if not limit or len(items) < limit:
+            return None
+        last = items[-1]
+        return key_cursor((last.get("updated_at") or "", last["sid"]))
+
+    def list_archives(self, limit: Optional[int] = None, after=None) -> List[Dict[str, Any]]:
+        try:
+            return self.backend.list_archived(limit=limit, after=after)
+        except Exception as e:
+            print(f"Error listing archives from index: {e}")
+            return []
+
+    def list_archives_page(self, cursor: Optional[str] = None, limit: Optional[int] = None) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """由新到舊分頁列出歸檔對話，回傳 (archives, next_cursor)；未指定 limit 時回傳全部"""
+        archives = self.list_archives(limit=limit, after=cursor_key(decode_cursor(cursor)))
+        return archives, self._next_key_cursor(archives, limit)
+
+    def archive_cold(self, cutoff: str, batch: int) -> int:
+        """把久未更新的對話移入冷儲存；記憶體中或尚未落盤的對話略過"""
+        skip = set(self.conversations_db)
+        skip.update(key[1] for key, _ in write_queue.pending_items("english"))
+        # 在寫入執行緒上執行，與同一對話的寫入序列化
+        return write_queue.run(("cold", "english"), self.backend.archive_cold, cutoff, batch, skip)
+
+    def flush(self):
+        """等待背景寫入完成，並將索引等狀態立即寫入磁碟（供關閉流程與測試使用）"""
+        try:
+            write_queue.flush()
+            self.backend.flush()
+            self.search_index.flush()
+        except Exception as e:
+            print(f"寫回會話存儲時發生錯誤: {e}")
+
     def load_conversations(self):
+        """啟動時只讀取索引（先以對話檔校正）；訊息內容在第一次存取時才載入"""
         try:
-            if os.path.exists(INDEX_FILE):
-                with open(INDEX_FILE, 'r', encoding='utf-8') as f:
-                    index = json.load(f)
-                for sid in index.get("active", {}):
-                    messages, metadata = self.load_conversation(sid, is_archived=False)
-                    if messages or metadata:
-                        self.conversations_db[sid] = messages
-                        self.conversation_metadata[sid] = metadata
-                for sid, idx_metadata in index.get("archived", {}).items():
-                    self.archived_conversation_metadata[sid] = idx_metadata
+            changed = self.backend.reconcile_index()
+            index = self.backend.load_index()
+            if not index["active"] and not index["archived"]:
+                print("沒有找到既有會話，開始新的會話存儲")
+            elif not self.search_index.loaded:
+                self.rebuild_search_index(set(index["active"]) | set(index["archived"]))
             else:
-                print("沒有找到索引文件，開始新的會話存儲")
+                self.reconcile_search_index(index, changed)
         except Exception as e:
             print(f"加載會話數據時發生錯誤: {e}")
 
+    def reconcile_search_index(self, index: Dict[str, Dict[str, Any]], changed=()) -> int:
+        """全文索引與會話索引不一致（例如上次關閉前尚未寫回）時，只重新索引有差異的會話"""
+        entries = {**index["active"], **index["archived"]}
+        stale = set(changed) & set(entries)
+        stale.update(sid for sid, entry in entries.items()
+                     if self.search_index.indexed_count(sid) != entry.get("message_count", 0))
+        for sid in sorted(stale):
+            messages, metadata = self.load_conversation(sid)
+            self.search_index.update(sid, messages, metadata)
+        removed = [sid for sid in self.search_index.sids() if sid not in entries]
+        for sid in removed:
+            self.search_index.remove(sid)
+        if stale or removed:
+            print(f"已校正全文搜尋索引：{len(stale) + len(removed)} 個會話")
+            self.search_index.flush()
+        return len(stale) + len(removed)
+
+    def rebuild_search_index(self, sids=None) -> int:
+        """從儲存後端重建全文索引（首次升級或索引檔損毀時）"""
+        if sids is None:
+            index = self.backend.load_index()
+            sids = set(index["active"]) | set(index["archived"])
+
+        def iter_conversations():
+            for sid in sorted(sids):
+                messages, metadata = self.load_conversation(sid)
+                if messages or metadata:
+                    yield sid, messages, metadata
+
+        count = self.search_index.rebuild(iter_conversations())
+        print(f"已重建全文搜尋索引：{count} 個會話")
+        return count
+
 
 store = EnglishStore()
 
@@ -194,6 +323,10 @@ class EnglishCore:
             "tts-1": {"version": "latest", "voices": ["alloy", "echo", "fable", "onyx", "nova", "shimmer"], "speeds": ["slow", "normal"]},
             "tts-1-hd": {"version": "latest", "voices": ["alloy", "echo", "fable", "onyx", "nova", "shimmer"], "speeds": ["slow", "normal"]},
         }
+        # 對話歷史以 token 預算組裝；較早的輪次由背景摘要摺疊進 metadata
+        self.context_window = ContextWindow()
+        # sid -> 進行中的摘要工作（同一對話同時只跑一個）
+        self._summary_tasks: Dict[str, asyncio.Task] = {}
 
     # --- Responses API 包裝 ---
     async def _responses_create(
@@ -286,7 +419,7 @@ class EnglishCore:
         if max_output_tokens is not None:
             kwargs["max_output_tokens"] = max_output_tokens
 
-        return await client.responses.create(**kwargs)
+        return await llm_clients.for_model(model).responses.create(**kwargs)
 
     def _extract_json_output(self, response: Any) -> Optional[Dict[str, Any]]:
         """Best-effort extraction of a single JSON object from a Responses API response.
@@ -377,8 +510,15 @@ class EnglishCore:
         selected_tts_model = model if model and model in self.available_tts_models_info else model_registry.get("english", "tts", self.default_tts_model)
         selected_voice = voice if voice else model_registry.get("english", "tts_voice", self.default_tts_voice)
         tts_speed_value = 0.85 if speed == "slow" else 1.0
+        # 相同文字、聲音、語速與模型的同時請求只呼叫一次上游
+        return await single_flight.do(
+            ("english.tts", text, selected_voice, tts_speed_value, selected_tts_model),
+            self._tts_upstream, text, selected_voice, tts_speed_value, selected_tts_model
+        )
+
+    async def _tts_upstream(self, text: str, selected_voice: str, tts_speed_value: float, selected_tts_model: str) -> bytes:
         try:
-            response = await client.audio.speech.create(
+            response = await llm_clients.for_model(selected_tts_model, "tts").audio.speech.create(
                 model=selected_tts_model,
                 voice=selected_voice,
                 input=text,
@@ -422,6 +562,18 @@ If unsure about the type, classify as 'unknown' and provide a helpful response o
             {"role": "user", "content": q}
         ]
 
+        # 相同查詢（正規化後）、等級、模型與提示詞的結果直接由快取回傳
+        cache_key = response_cache.make_key(
+            "english.query", normalize_text(q), level_text, selected_llm, hash_text(messages[0]["content"])
+        )
+        cached = await response_cache.aget(cache_key)
+        if cached is not None:
+            return cached
+
+        # 快取未命中時，相同查詢的同時請求共用一次上游呼叫
+        return await single_flight.do(("english.query", cache_key), self._smart_query_uncached, q, selected_llm, messages, cache_key)
+
+    async def _smart_query_uncached(self, q: str, selected_llm: str, messages: List[Dict[str, Any]], cache_key: str) -> Dict[str, Any]:
         # Structured Outputs: JSON Schema
         schema: Dict[str, Any] = {
             "type": "object",
@@ -510,6 +662,8 @@ If unsure about the type, classify as 'unknown' and provide a helpful response o
                     "grammar_tips": fallback_text[:2000],
                     "audio_url": None,
                 }
+            # 只快取結構化結果，退回的純文字回應不快取
+            response_cache.set(cache_key, parsed)
             return parsed
         except openai.APIError as e:
             print(f"OpenAI API error during query: {e}")
@@ -549,6 +703,84 @@ If unsure about the type, classify as 'unknown' and provide a helpful response o
                 "audio_url": None,
             }
 
+    # --- 對話脈絡視窗與滾動摘要 ---
+    def build_context(self, messages: List[Dict[str, Any]], metadata: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """組裝送給模型的歷史（開場系統提示 + 滾動摘要 + 預算內最近幾輪），長度不隨對話成長"""
+        return self.context_window.build(messages, metadata)
+
+    def schedule_context_summary(self, sid: str) -> None:
+        """一輪完成後呼叫：視窗外累積足夠的訊息時，在背景更新滾動摘要"""
+        task = self._summary_tasks.get(sid)
+        if task is not None and not task.done():
+            return
+        conversation = store.get_conversation(sid)
+        if conversation is None:
+            return
+        messages, metadata = conversation
+        if self.context_window.pending_summary(messages, metadata) is None:
+            return
+        task = asyncio.ensure_future(self._summarize_context(sid))
+        self._summary_tasks[sid] = task
+        task.add_done_callback(lambda t, sid=sid: self._summary_done(sid, t))
+
+    def _summary_done(self, sid: str, task: asyncio.Task) -> None:
+        if self._summary_tasks.get(sid) is task:
+            del self._summary_tasks[sid]
+
+    async def _summarize_context(self, sid: str) -> None:
+        conversation = store.get_conversation(sid)
+        if conversation is None:
+            return
+        messages, metadata = conversation
+        pending = self.context_window.pending_summary(messages, metadata)
+        if pending is None:
+            return
+        begin, end = pending
+        previous, upto = self.context_window.summary_of(metadata)
+        selected_llm = metadata.get("model") or model_registry.get("english", "llm", self.default_llm_model)
+        system_prompt = get_prompt("english.context_summary_system", default="""You maintain a running summary of an English practice conversation between a learner (User) and an AI partner (AI).
+Update the summary with the new transcript. Keep what the next replies need: topics discussed, facts the user shared about themselves, questions still open, and recurring mistakes the user made.
+Write in English, at most 150 words, as plain prose without headings.""")
+        user_prompt = (f"Current summary:\n{previous}\n\n" if previous else "") + \
+            f"New transcript:\n{self.context_window.transcript(messages[begin:end])}"
+        try:
+            resp = await self._responses_create(
+                model=selected_llm,
+                messages=[
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": user_prompt},
+                ],
+                max_output_tokens=400,
+            )
+            summary_text = self.context_window.clip_summary(self._extract_plain_text(resp))
+            if not summary_text:
+                return
+        except Exception as e:
+            print(f"更新對話摘要失敗 {sid}: {e}")
+            return
+
+        # 只寫回 metadata；期間若摘要已被更新或對話被刪除則放棄
+        with session_locks.locked(sid):
+            conversation = store.get_conversation(sid)
+            if conversation is None:
+                return
+            messages, metadata = conversation
+            if self.context_window.summary_of(metadata)[1] != upto or len(messages) < end:
+                return
+            metadata[SUMMARY_KEY] = {
+                "text": summary_text,
+                "upto": end,
+                "updated_at": datetime.now().isoformat(),
+            }
+            # 摘要不是使用者的活動，不更新 updated_at
+            store.save_conversation(sid, messages, metadata, is_archived=True, touch=False)
+
+    async def drain_background_tasks(self, timeout: float = 10.0) -> None:
+        """等待背景摘要完成，供關閉服務前呼叫"""
+        tasks = [t for t in self._summary_tasks.values() if not t.done()]
+        if tasks:
+            await asyncio.wait(tasks, timeout=timeout)
+
     async def start_conversation(self, topic: str, level: str, model: Optional[str] = None, title: Optional[str] = None) -> Dict[str, Any]:
         if OPENAI_API_KEY == "YOUR_OPENAI_API_KEY_HERE":
             raise HTTPException(status_code=500, detail="OpenAI API Key not configured.")
@@ -619,12 +851,10 @@ Your goal is to help the user practice speaking English in a natural way.
             messages.append({"role": "assistant", "content": structured_greeting})
             
             # 更新內存
-            store.conversations_db[sid] = messages
-            store.conversation_metadata[sid] = metadata
+            store.cache_conversation(sid, messages, metadata)
             
             # 使用新的保存邏輯
-            store.save_conversation(sid, messages, metadata, is_archived=False)
-            store.save_conversation(sid, messages, metadata, is_archived=True) # 同步 archived
+            store.save_conversation(sid, messages, metadata, is_archived=True)
             
             return {"sid": sid, "ai": ai_greeting, "hint": initial_hint, "translation": translation}
         except openai.APIError as e:
@@ -637,20 +867,26 @@ Your goal is to help the user practice speaking English in a natural way.
     async def next_turn(self, sid: str, user_text: str) -> Dict[str, Any]:
         if OPENAI_API_KEY == "YOUR_OPENAI_API_KEY_HERE":
             raise HTTPException(status_code=500, detail="OpenAI API Key not configured.")
-        if sid not in store.conversations_db:
-            # 嘗試從存檔加載
-            messages, metadata = store.load_conversation(sid, is_archived=True)
-            if not messages:
-                raise HTTPException(status_code=404, detail="Session ID not found.")
-            store.conversations_db[sid] = messages
-            store.conversation_metadata[sid] = metadata
-        
-        messages = store.conversations_db[sid]
-        metadata = store.conversation_metadata[sid]
+        # 同一對話同時只允許一輪，重複送出（連點、重試）直接回傳 409
+        try:
+            with session_locks.turn(sid):
+                return await self._next_turn_locked(sid, user_text)
+        except ConversationBusy as e:
+            raise HTTPException(status_code=409, detail=str(e))
+
+    async def _next_turn_locked(self, sid: str, user_text: str) -> Dict[str, Any]:
+        # 第一次存取時從存儲載入
+        conversation = store.get_conversation(sid)
+        if conversation is None:
+            raise HTTPException(status_code=404, detail="Session ID not found.")
+        stored_messages, metadata = conversation
+        version = store.get_version(metadata)
         selected_llm = metadata.get("model") or model_registry.get("english", "llm", self.default_llm_model)
         level = metadata.get("level", "B1")
-        
-        messages.append({"role": "user", "content": user_text})
+
+        # 以副本組裝請求，成功後才與 AI 回覆一起提交；歷史只送預算內的視窗與摘要
+        user_message = {"role": "user", "content": user_text}
+        messages = self.build_context(stored_messages, metadata) + [user_message]
 
         # 為 Structured Outputs 添加特定的系統提示
         structured_system_prompt = f"""You are an English conversation partner. Please respond with:
@@ -694,49 +930,30 @@ Always provide all three fields."""
                 raise Exception("LLM did not return output_text.")
                 
             parsed_response = json.loads(output_text)
-            
-            messages.append({"role": "assistant", "content": parsed_response})
 
-            # 更新內存並使用新的保存邏輯
-            store.conversations_db[sid] = messages
-            store.conversation_metadata[sid] = metadata # metadata 在這裡是舊的，但 save 會更新 updated_at
-            store.save_conversation(sid, messages, metadata, is_archived=False)
-            store.save_conversation(sid, messages, metadata, is_archived=True)
-            
+            # 版本不符代表期間有其他寫入，拒絕而不是覆蓋
+            store.append_messages(sid, [user_message, {"role": "assistant", "content": parsed_response}], expected_version=version)
+            self.schedule_context_summary(sid)
+
             return parsed_response # 直接回傳整個結構化物件
 
+        except ConversationConflict as e:
+            raise HTTPException(status_code=409, detail=str(e))
+        except KeyError:
+            raise HTTPException(status_code=404, detail="Session ID not found.")
         except Exception as e:
             print(f"Error in conversation turn (next_turn): {e}")
             raise HTTPException(status_code=500, detail=f"Conversation turn failed: {str(e)}")
 
-    def list_archives(self) -> List[Dict[str, Any]]:
-        # 改為直接從索引讀取，更可靠
+    def list_archives(self, cursor: Optional[str] = None, limit: Optional[int] = None) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        # 直接由儲存後端的排序索引分頁查詢
         try:
-            if not os.path.exists(INDEX_FILE):
-                return []
-            with open(INDEX_FILE, 'r', encoding='utf-8') as f:
-                index = json.load(f)
-            
-            archives = []
-            all_conversations = index.get("archived", {})
-            for sid, meta in all_conversations.items():
-                 archives.append({
-                    "sid": sid,
-                    "title": meta.get("title", "N/A"),
-                    "topic": meta.get("topic"),
-                    "level": meta.get("level"),
-                    "message_count": meta.get("message_count", 0),
-                    "updated_at": meta.get("updated_at"),
-                 })
-            # 按更新時間排序
-            archives.sort(key=lambda x: x.get("updated_at", ""), reverse=True)
-            return archives
-        except Exception as e:
-            print(f"Error listing archives from index: {e}")
-            return []
+            return store.list_archives_page(cursor=cursor, limit=limit)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
 
     def get_archive_transcript(self, sid: str) -> Dict[str, Any]:
-        if not os.path.exists(os.path.join(ARCHIVED_DIR, f"{sid}.json")):
+        if not store.has_conversation(sid, is_archived=True):
             raise HTTPException(status_code=404, detail="Archived session ID not found.")
         
         messages, metadata = store.load_conversation(sid, is_archived=True)
@@ -777,17 +994,17 @@ Always provide all three fields."""
         }
 
     def end_conversation(self, sid: str) -> Dict[str, Any]:
-        if sid not in store.archived_conversations_db:
+        conversation = store.get_conversation(sid)
+        if conversation is None:
             raise HTTPException(status_code=404, detail="Session ID not found in active or archived records.")
         transcript_entries = []
-        history = store.archived_conversations_db.get(sid, [])
+        history, metadata = conversation
         for message in history:
             role = message.get("role")
             content = message.get("content")
             if role in ["user", "assistant"]:
                 speaker = "ai" if role == "assistant" else "user"
                 transcript_entries.append({"speaker": speaker, "text": content})
-        metadata = store.archived_conversation_metadata.get(sid, {})
         response = {
             "sid": sid,
             "topic": metadata.get("topic"),
@@ -795,12 +1012,10 @@ Always provide all three fields."""
             "title": metadata.get("title"),
             "transcript": transcript_entries
         }
-        if sid in store.conversations_db:
-            store.conversations_db.pop(sid)
-        if sid in store.conversation_metadata:
-            store.conversation_metadata.pop(sid)
-        if history and metadata:
-            store.save_conversation(sid, history, metadata, is_archived=True)
+        with session_locks.locked(sid):
+            store.uncache_conversation(sid)
+            if history and metadata:
+                store.save_conversation(sid, history, metadata, is_archived=True)
         return response
 
 
@@ -0,0 +1,622 @@
+import os
+import sys
+import json
+import sqlite3
+import threading
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from journal import ConversationJournal
+from conversation_index import ConversationIndex
+from pagination import SortKey
+from cold_storage import ColdStore
+
+
+# --- 共用的索引條目格式 ---
+def build_index_entry(messages: List[Dict[str, Any]], metadata: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "title": metadata.get("title"),
+        "topic": metadata.get("topic", ""),
+        "level": metadata.get("level", ""),
+        "created_at": metadata.get("created_at"),
+        "updated_at": metadata.get("updated_at"),
+        "message_count": len(messages)
+    }
+
+
+def to_search_result(sid: str, entry: Dict[str, Any], is_archived: bool) -> Dict[str, Any]:
+    return {
+        "sid": sid,
+        "title": entry.get("title"),
+        "topic": entry.get("topic"),
+        "level": entry.get("level"),
+        "created_at": entry.get("created_at"),
+        "updated_at": entry.get("updated_at"),
+        "message_count": entry.get("message_count", 0),
+        "is_archived": is_archived
+    }
+
+
+def entry_matches(entry: Dict[str, Any], topic: str = "", level: str = "") -> bool:
+    """主題（不分大小寫的子字串）與等級（不分大小寫相等）篩選"""
+    if topic and topic.lower() not in (entry.get("topic") or "").lower():
+        return False
+    if level and level.upper() != (entry.get("level") or "").upper():
+        return False
+    return True
+
+
+def to_archive_item(sid: str, entry: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "sid": sid,
+        "title": entry.get("title") or "N/A",
+        "topic": entry.get("topic"),
+        "level": entry.get("level"),
+        "message_count": entry.get("message_count", 0),
+        "updated_at": entry.get("updated_at"),
+    }
+
+
+class FileBackend:
+    """檔案後端：每個對話只有一份追加式日誌（conversations/），外加記憶體索引。
+
+    是否歸檔只是索引中的狀態（active / archived 區段），不再另存一份實體副本。
+    久未更新的對話由 archive_cold 移入 cold/ 的壓縮 segment，讀取時透明地取回。
+    """
+
+    name = "file"
+
+    def __init__(self, data_dir: str):
+        self.data_dir = data_dir
+        self.conversations_dir = os.path.join(data_dir, "conversations")
+        # 舊版把每個對話複製一份到 archived/，只在遷移時讀取
+        self.archived_dir = os.path.join(data_dir, "archived")
+        self.index_file = os.path.join(data_dir, "index.json")
+        self.journal = ConversationJournal(self.conversations_dir)
+        self.index = ConversationIndex(self.index_file)
+        self.cold = ColdStore(os.path.join(data_dir, "cold"))
+        self._migrate_archived_copies()
+
+    def _legacy_path(self, sid: str) -> str:
+        """舊版（整份 JSON）對話檔案路徑"""
+        return os.path.join(self.conversations_dir, f"{sid}.json")
+
+    @staticmethod
+    def _read_copy(directory: str, sid: str) -> Optional[Tuple[List[Dict[str, Any]], Dict[str, Any]]]:
+        """讀取某目錄下的對話副本（日誌或舊版 JSON）"""
+        replayed = ConversationJournal(directory).replay(sid)
+        if replayed is not None:
+            return replayed
+        legacy_file = os.path.join(directory, f"{sid}.json")
+        if os.path.exists(legacy_file):
+            with open(legacy_file, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            return data.get("messages", []), data.get("metadata", {})
+        return None
+
+    def _migrate_archived_copies(self) -> None:
+        """一次性遷移：合併 conversations/ 與 archived/ 的重複副本，只保留較新的一份"""
+        if not os.path.isdir(self.archived_dir):
+            return
+        sids = sorted({name.rsplit(".", 1)[0] for name in os.listdir(self.archived_dir)
+                       if name.endswith(".jsonl") or name.endswith(".json")})
+        for sid in sids:
+            try:
+                copies = [c for c in (self._read_copy(self.archived_dir, sid),
+                                      self._read_copy(self.conversations_dir, sid)) if c is not None]
+                if not copies:
+                    continue
+                # 訊息較多者較新；相同時比較 updated_at
+                messages, metadata = max(copies, key=lambda c: (len(c[0]), c[1].get("updated_at") or ""))
+                self.journal.write_snapshot(sid, messages, metadata)
+                for path in (os.path.join(self.archived_dir, f"{sid}.jsonl"),
+                             os.path.join(self.archived_dir, f"{sid}.json"),
+                             self._legacy_path(sid)):
+                    if os.path.exists(path):
+                        os.remove(path)
+                entry, _ = self.index.get(sid)
+                if entry is None:
+                    self.index.upsert(sid, build_index_entry(messages, metadata), True)
+            except Exception as e:
+                print(f"遷移歸檔副本 {sid} 失敗: {e}")
+        try:
+            os.rmdir(self.archived_dir)
+        except OSError:
+            # 目錄內仍有無法遷移的檔案，保留以便人工處理
+            pass
+
+    def reconcile_index(self) -> List[str]:
+        """啟動時以對話檔校正索引（上次關閉前索引可能尚未寫回），回傳有變動的 sid。
+
+        - 索引中沒有、或比 index.json 新的日誌：重播後更新條目（新條目歸入 archived，與保存時相同）
+        - 索引中有但日誌、舊版 JSON 與冷儲存都找不到的條目：移除
+        """
+        try:
+            index_mtime = os.stat(self.index_file).st_mtime_ns
+        except FileNotFoundError:
+            index_mtime = None
+        changed: List[str] = []
+        on_disk = set()
+        if os.path.isdir(self.conversations_dir):
+            with os.scandir(self.conversations_dir) as entries:
+                for file_entry in entries:
+                    if not file_entry.is_file() or not (file_entry.name.endswith(".jsonl") or file_entry.name.endswith(".json")):
+                        continue
+                    sid = file_entry.name.rsplit(".", 1)[0]
+                    on_disk.add(sid)
+                    entry, is_archived = self.index.get(sid)
+                    if entry is not None and index_mtime is not None and file_entry.stat().st_mtime_ns <= index_mtime:
+                        continue
+                    try:
+                        messages, metadata = self.load(sid)
+                    except Exception as e:
+                        print(f"校正索引時讀取會話 {sid} 失敗: {e}")
+                        continue
+                    if messages or metadata:
+                        self.index.upsert(sid, build_index_entry(messages, metadata), is_archived if entry is not None else True)
+                        changed.append(sid)
+        for sid, _, _ in self.index.items():
+            if sid not in on_disk and sid not in self.cold:
+                self.index.remove(sid)
+                changed.append(sid)
+        if changed:
+            print(f"已依對話檔校正索引：{len(changed)} 個會話")
+            self.index.flush()
+        return changed
+
+    # --- 對話內容 ---
+    def update_index(self, sid: str, messages: List[Dict[str, Any]], metadata: Dict[str, Any], is_archived: bool) -> None:
+        """只更新記憶體索引（不做磁碟 I/O），可在請求處理中直接呼叫"""
+        self.index.upsert(sid, build_index_entry(messages, metadata), is_archived)
+
+    def write(self, sid: str, messages: List[Dict[str, Any]], metadata: Dict[str, Any], is_archived: bool) -> None:
+        """寫入對話日誌（阻塞 I/O，由寫入執行緒呼叫）；歸檔狀態只記錄在索引"""
+        self.journal.save(sid, messages, metadata)
+        # 舊版整份 JSON 檔已被日誌取代，移除
+        legacy_file = self._legacy_path(sid)
+        if os.path.exists(legacy_file):
+            os.remove(legacy_file)
+        # 冷儲存中的對話被重新使用後回到日誌
+        if sid in self.cold:
+            self.cold.delete(sid)
+
+    def save(self, sid: str, messages: List[Dict[str, Any]], metadata: Dict[str, Any], is_archived: bool) -> None:
+        self.write(sid, messages, metadata, is_archived)
+        self.update_index(sid, messages, metadata, is_archived)
+
+    def load(self, sid: str, is_archived: bool = False) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+        # 優先重播日誌，否則退回舊版整份 JSON 檔，最後查冷儲存
+        copy = self._read_copy(self.conversations_dir, sid)
+        if copy is not None:
+            return copy
+        cold = self.cold.get(sid)
+        if cold is not None:
+            return cold.get("messages", []), cold.get("metadata", {})
+        return [], {}
+
+    def exists(self, sid: str, is_archived: bool = False) -> bool:
+        # 索引已包含尚未落盤的對話，先查記憶體
+        entry, in_archived = self.index.get(sid)
+        if entry is not None:
+            return in_archived or not is_archived
+        return not is_archived and (self.journal.exists(sid) or os.path.exists(self._legacy_path(sid)) or sid in self.cold)
+
+    def remove_index(self, sid: str) -> None:
+        self.index.remove(sid)
+
+    def delete(self, sid: str) -> None:
+        """刪除對話檔案（阻塞 I/O，由寫入執行緒呼叫）"""
+        try:
+            self.journal.delete(sid)
+            legacy_file = self._legacy_path(sid)
+            if os.path.exists(legacy_file):
+                os.remove(legacy_file)
+            self.cold.delete(sid)
+        except Exception:
+            pass
+
+    def archive_cold(self, cutoff: str, batch: int, skip=()) -> int:
+        """把 updated_at 早於 cutoff 的對話移入冷儲存（由寫入執行緒呼叫），回傳本批移動數"""
+        moved = []
+        for sid, entry, _ in self.index.items():
+            if len(moved) >= batch:
+                break
+            if sid in skip or (entry.get("updated_at") or "") >= cutoff:
+                continue
+            if not self.journal.exists(sid) and not os.path.exists(self._legacy_path(sid)):
+                continue
+            messages, metadata = self.load(sid)
+            moved.append((sid, {"messages": messages, "metadata": metadata}, {"updated_at": entry.get("updated_at")}))
+        # 先確保冷儲存寫入完成，再刪除原檔
+        self.cold.put_many(moved)
+        for sid, _, _ in moved:
+            self.journal.delete(sid)
+            legacy_file = self._legacy_path(sid)
+            if os.path.exists(legacy_file):
+                os.remove(legacy_file)
+        if len(moved) < batch:
+            self.cold.vacuum()
+        return len(moved)
+
+    # --- 索引（全部由記憶體提供） ---
+    def load_index(self) -> Dict[str, Dict[str, Any]]:
+        return self.index.snapshot()
+
+    def get_entry(self, sid: str) -> Tuple[Optional[Dict[str, Any]], bool]:
+        return self.index.get(sid)
+
+    def search(self, query: str = "", topic: str = "", level: str = "", limit: int = 10, offset: int = 0,
+               after: Optional[SortKey] = None) -> List[Dict[str, Any]]:
+        def accept(meta: Dict[str, Any]) -> bool:
+            if not entry_matches(meta, topic, level):
+                return False
+            return not query or query.lower() in (meta.get("title") or "").lower()
+
+        # 次級索引已按更新時間排序，只需讀取 offset + limit 筆
+        rows = self.index.page(None, after, offset + limit, accept)
+        return [to_search_result(sid, meta, is_archived) for sid, meta, is_archived in rows[offset:]]
+
+    def list_archived(self, limit: Optional[int] = None, after: Optional[SortKey] = None) -> List[Dict[str, Any]]:
+        return [to_archive_item(sid, meta) for sid, meta, _ in self.index.page("archived", after, limit)]
+
+    def flush(self) -> None:
+        self.index.flush()
+
+    def iter_conversations(self):
+        """逐一產生 (sid, messages, metadata, is_archived)，供遷移使用"""
+        index = self.load_index()
+        sids = set(index["active"]) | set(index["archived"])
+        if os.path.isdir(self.conversations_dir):
+            for filename in os.listdir(self.conversations_dir):
+                if filename.endswith(".jsonl") or filename.endswith(".json"):
+                    sids.add(filename.rsplit(".", 1)[0])
+        for sid in sorted(sids):
+            messages, metadata = self.load(sid)
+            if messages or metadata:
+                yield sid, messages, metadata, sid in index["archived"]
+
+
+class SQLiteBackend:
+    """SQLite（WAL 模式）後端：conversations / messages / metadata 三張表
+
+    - conversations：索引欄位（title/topic/level/時間/訊息數/是否歸檔）
+    - messages：每則訊息一列，以 (sid, seq) 為主鍵，每輪只插入新增的訊息
+    - metadata：每個對話完整的 metadata JSON
+    update_index 只記錄在記憶體（尚未落盤的索引條目），conversations 列由寫入執行緒在同一個交易中寫入；
+    查詢以另一條唯讀連線進行（WAL 下不會被寫入交易擋住），並疊加尚未落盤的條目。
+    """
+
+    name = "sqlite"
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS conversations (
+        sid TEXT PRIMARY KEY,
+        title TEXT,
+        topic TEXT NOT NULL DEFAULT '',
+        level TEXT NOT NULL DEFAULT '',
+        created_at TEXT,
+        updated_at TEXT NOT NULL DEFAULT '',
+        message_count INTEGER NOT NULL DEFAULT 0,
+        is_archived INTEGER NOT NULL DEFAULT 0
+    );
+    CREATE TABLE IF NOT EXISTS messages (
+        sid TEXT NOT NULL,
+        seq INTEGER NOT NULL,
+        data TEXT NOT NULL,
+        PRIMARY KEY (sid, seq)
+    ) WITHOUT ROWID;
+    CREATE TABLE IF NOT EXISTS metadata (
+        sid TEXT PRIMARY KEY,
+        data TEXT NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS store_meta (
+        key TEXT PRIMARY KEY,
+        value TEXT NOT NULL
+    );
+    DROP INDEX IF EXISTS idx_conversations_updated_at;
+    DROP INDEX IF EXISTS idx_conversations_archived;
+    CREATE INDEX IF NOT EXISTS idx_conversations_order ON conversations (updated_at, sid);
+    CREATE INDEX IF NOT EXISTS idx_conversations_topic ON conversations (topic COLLATE NOCASE);
+    CREATE INDEX IF NOT EXISTS idx_conversations_level ON conversations (level COLLATE NOCASE);
+    CREATE INDEX IF NOT EXISTS idx_conversations_archived_order ON conversations (is_archived, updated_at, sid);
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        # 寫入連線 + 鎖：寫入以交易序列化，不會互相覆蓋
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._lock = threading.RLock()
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.executescript(self.SCHEMA)
+        # 讀取連線：WAL 下讀取只看到已提交的資料，不需等待寫入交易
+        self._read_conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._read_conn.row_factory = sqlite3.Row
+        self._read_lock = threading.Lock()
+        # sid -> (索引條目, 是否歸檔)；None 表示已刪除。寫入執行緒落盤後移除
+        self._pending: Dict[str, Optional[Tuple[Dict[str, Any], bool]]] = {}
+        self._pending_lock = threading.Lock()
+
+    def _read(self, sql: str, params=()) -> List[sqlite3.Row]:
+        with self._read_lock:
+            return self._read_conn.execute(sql, params).fetchall()
+
+    def _pending_items(self) -> Dict[str, Optional[Tuple[Dict[str, Any], bool]]]:
+        with self._pending_lock:
+            return dict(self._pending)
+
+    def _settle(self, sid: str, value: Optional[Tuple[Dict[str, Any], bool]]) -> None:
+        """落盤完成：尚未落盤的條目仍是剛寫入的內容時移除（期間又有更新則保留）"""
+        with self._pending_lock:
+            if sid in self._pending and self._pending[sid] == value:
+                del self._pending[sid]
+
+    # --- 儲存層狀態 ---
+    def get_meta(self, key: str) -> Optional[str]:
+        rows = self._read("SELECT value FROM store_meta WHERE key = ?", (key,))
+        return rows[0]["value"] if rows else None
+
+    def set_meta(self, key: str, value: str) -> None:
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO store_meta (key, value) VALUES (?, ?)", (key, value))
+
+    # --- 對話內容 ---
+    def _upsert_conversation_row(self, sid: str, messages: List[Dict[str, Any]], metadata: Dict[str, Any], is_archived: bool) -> None:
+        entry = build_index_entry(messages, metadata)
+        self._conn.execute(
+            """INSERT INTO conversations (sid, title, topic, level, created_at, updated_at, message_count, is_archived)
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+               ON CONFLICT(sid) DO UPDATE SET
+                   title = excluded.title, topic = excluded.topic, level = excluded.level,
+                   created_at = excluded.created_at, updated_at = excluded.updated_at,
+                   message_count = excluded.message_count,
+                   is_archived = excluded.is_archived""",
+            (sid, entry["title"], entry["topic"] or "", entry["level"] or "", entry["created_at"],
+             entry["updated_at"] or "", entry["message_count"], 1 if is_archived else 0)
+        )
+
+    def update_index(self, sid: str, messages: List[Dict[str, Any]], metadata: Dict[str, Any], is_archived: bool) -> None:
+        """只更新記憶體中尚未落盤的索引條目（不做資料庫 I/O），可在請求處理中直接呼叫"""
+        with self._pending_lock:
+            self._pending[sid] = (build_index_entry(messages, metadata), is_archived)
+
+    def write(self, sid: str, messages: List[Dict[str, Any]], metadata: Dict[str, Any], is_archived: bool) -> None:
+        """寫入新增的訊息與 metadata（由寫入執行緒呼叫）"""
+        with self._lock:
+            conn = self._conn
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute("SELECT COUNT(*) FROM messages WHERE sid = ?", (sid,)).fetchone()
+                persisted = row[0]
+                if persisted > len(messages):
+                    # 歷史被截短：移除多出的訊息
+                    conn.execute("DELETE FROM messages WHERE sid = ? AND seq >= ?", (sid, len(messages)))
+                    persisted = len(messages)
+                conn.executemany(
+                    "INSERT OR REPLACE INTO messages (sid, seq, data) VALUES (?, ?, ?)",
+                    [(sid, seq, json.dumps(messages[seq], ensure_ascii=False)) for seq in range(persisted, len(messages))]
+                )
+                self._upsert_conversation_row(sid, messages, metadata, is_archived)
+                conn.execute(
+                    "INSERT OR REPLACE INTO metadata (sid, data) VALUES (?, ?)",
+                    (sid, json.dumps(metadata, ensure_ascii=False))
+                )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        self._settle(sid, (build_index_entry(messages, metadata), is_archived))
+
+    def save(self, sid: str, messages: List[Dict[str, Any]], metadata: Dict[str, Any], is_archived: bool) -> None:
+        self.write(sid, messages, metadata, is_archived)
+
+    def load(self, sid: str, is_archived: bool = False) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+        with self._read_lock:
+            # 同一個讀取交易內取得 metadata 與訊息，看到的是同一個已提交版本
+            self._read_conn.execute("BEGIN")
+            try:
+                meta_row = self._read_conn.execute("SELECT data FROM metadata WHERE sid = ?", (sid,)).fetchone()
+                rows = [] if meta_row is None else self._read_conn.execute(
+                    "SELECT data FROM messages WHERE sid = ? ORDER BY seq", (sid,)).fetchall()
+            finally:
+                self._read_conn.execute("COMMIT")
+        if meta_row is None:
+            return [], {}
+        return [json.loads(r["data"]) for r in rows], json.loads(meta_row["data"])
+
+    def exists(self, sid: str, is_archived: bool = False) -> bool:
+        pending = self._pending_items()
+        if sid in pending:
+            return pending[sid] is not None and (pending[sid][1] or not is_archived)
+        sql = "SELECT 1 FROM conversations WHERE sid = ?"
+        if is_archived:
+            sql += " AND is_archived = 1"
+        return bool(self._read(sql, (sid,)))
+
+    def remove_index(self, sid: str) -> None:
+        """只在記憶體中標記刪除；資料列由寫入執行緒的 delete 移除"""
+        with self._pending_lock:
+            self._pending[sid] = None
+
+    def delete(self, sid: str) -> None:
+        with self._lock:
+            conn = self._conn
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute("DELETE FROM messages WHERE sid = ?", (sid,))
+                conn.execute("DELETE FROM metadata WHERE sid = ?", (sid,))
+                conn.execute("DELETE FROM conversations WHERE sid = ?", (sid,))
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        self._settle(sid, None)
+
+    # --- 索引 ---
+    @staticmethod
+    def _row_to_entry(row: sqlite3.Row) -> Dict[str, Any]:
+        return {
+            "title": row["title"],
+            "topic": row["topic"],
+            "level": row["level"],
+            "created_at": row["created_at"],
+            "updated_at": row["updated_at"],
+            "message_count": row["message_count"],
+        }
+
+    def load_index(self) -> Dict[str, Dict[str, Any]]:
+        index: Dict[str, Dict[str, Any]] = {"active": {}, "archived": {}}
+        rows = self._read("SELECT * FROM conversations")
+        pending = self._pending_items()
+        for row in rows:
+            if row["sid"] not in pending:
+                section = "archived" if row["is_archived"] else "active"
+                index[section][row["sid"]] = self._row_to_entry(row)
+        for sid, value in pending.items():
+            if value is not None:
+                index["archived" if value[1] else "active"][sid] = value[0]
+        return index
+
+    def get_entry(self, sid: str) -> Tuple[Optional[Dict[str, Any]], bool]:
+        pending = self._pending_items()
+        if sid in pending:
+            return pending[sid] if pending[sid] is not None else (None, False)
+        rows = self._read("SELECT * FROM conversations WHERE sid = ?", (sid,))
+        if not rows:
+            return None, False
+        return self._row_to_entry(rows[0]), bool(rows[0]["is_archived"])
+
+    def _with_pending(self, rows: List[sqlite3.Row], accept, after: Optional[SortKey],
+                      limit: Optional[int]) -> List[Tuple[str, Dict[str, Any], bool]]:
+        """把尚未落盤的條目疊加到查詢結果：取代或移除同 sid 的列，再依 (updated_at, sid) 由新到舊排序"""
+        pending = self._pending_items()
+        merged = [(row["sid"], self._row_to_entry(row), bool(row["is_archived"]))
+                  for row in rows if row["sid"] not in pending]
+        for sid, value in pending.items():
+            if value is None:
+                continue
+            entry, is_archived = value
+            if not accept(entry, is_archived):
+                continue
+            if after is not None and ((entry.get("updated_at") or ""), sid) >= tuple(after):
+                continue
+            merged.append((sid, entry, is_archived))
+        merged.sort(key=lambda item: ((item[1].get("updated_at") or ""), item[0]), reverse=True)
+        return merged if limit is None else merged[:limit]
+
+    def search(self, query: str = "", topic: str = "", level: str = "", limit: int = 10, offset: int = 0,
+               after: Optional[SortKey] = None) -> List[Dict[str, Any]]:
+        clauses, params = [], []
+        if topic:
+            clauses.append("topic LIKE ?")
+            params.append(f"%{topic}%")
+        if level:
+            clauses.append("level = ? COLLATE NOCASE")
+            params.append(level)
+        if query:
+            clauses.append("title LIKE ?")
+            params.append(f"%{query}%")
+        if after is not None:
+            # keyset 分頁：只讀取 cursor 之後的列
+            clauses.append("(updated_at, sid) < (?, ?)")
+            params.extend(after)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        # 尚未落盤的條目可能取代或擠掉查詢到的列，多讀取這些筆數後再合併
+        extra = len(self._pending_items())
+        sql = f"SELECT * FROM conversations {where} ORDER BY updated_at DESC, sid DESC LIMIT ?"
+        params.append(offset + limit + extra)
+
+        def accept(entry: Dict[str, Any], _is_archived: bool) -> bool:
+            if not entry_matches(entry, topic, level):
+                return False
+            return not query or query.lower() in (entry.get("title") or "").lower()
+
+        rows = self._with_pending(self._read(sql, params), accept, after, offset + limit)
+        return [to_search_result(sid, entry, is_archived) for sid, entry, is_archived in rows[offset:]]
+
+    def list_archived(self, limit: Optional[int] = None, after: Optional[SortKey] = None) -> List[Dict[str, Any]]:
+        sql, params = "SELECT * FROM conversations WHERE is_archived = 1", []
+        if after is not None:
+            sql += " AND (updated_at, sid) < (?, ?)"
+            params.extend(after)
+        sql += " ORDER BY updated_at DESC, sid DESC"
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit + len(self._pending_items()))
+        rows = self._with_pending(self._read(sql, params), lambda _entry, is_archived: is_archived, after, limit)
+        return [to_archive_item(sid, entry) for sid, entry, _ in rows]
+
+    def flush(self) -> None:
+        with self._lock:
+            self._conn.execute("PRAGMA wal_checkpoint(PASSIVE)")
+
+    def reconcile_index(self) -> List[str]:
+        """索引列與訊息在同一個交易中寫入，不會失去同步"""
+        return []
+
+    def count(self) -> int:
+        index = self.load_index()
+        return len(index["active"]) + len(index["archived"])
+
+    def archive_cold(self, cutoff: str, batch: int, skip=()) -> int:
+        """所有對話都在同一個資料庫檔案中，不會累積檔案數，不需要冷儲存"""
+        return 0
+
+
+# store_meta 中記錄檔案資料已完整匯入的鍵；沒有這筆記錄時，下次啟動會繼續遷移
+MIGRATION_MARKER = "file_store_migrated"
+
+
+def migrate_file_store(data_dir: str, target: SQLiteBackend) -> int:
+    """把 conversation_data/ 下的日誌與 JSON 檔匯入 SQLite，回傳本次遷移筆數。
+
+    可重複執行：資料庫中已有且不比檔案舊的對話會略過，因此中斷或部分失敗後再執行會從未完成的對話接續。
+    全部成功後才在 store_meta 寫入完成記錄。
+    """
+    source = FileBackend(data_dir)
+    migrated = failed = 0
+    for sid, messages, metadata, is_archived in source.iter_conversations():
+        if not metadata:
+            continue
+        try:
+            entry, _ = target.get_entry(sid)
+            if entry is not None and (entry.get("updated_at") or "") >= (metadata.get("updated_at") or ""):
+                continue
+            target.save(sid, messages, metadata, is_archived)
+            migrated += 1
+        except Exception as e:
+            failed += 1
+            print(f"遷移會話 {sid} 失敗: {e}")
+    if failed:
+        print(f"{failed} 個會話遷移失敗，下次啟動時重試")
+    else:
+        target.set_meta(MIGRATION_MARKER, datetime.now().isoformat())
+    return migrated
+
+
+def create_backend(data_dir: str):
+    """依環境變數 ENGLISH_STORE_BACKEND（file / sqlite）建立儲存後端"""
+    backend_name = os.getenv("ENGLISH_STORE_BACKEND", "file").lower()
+    if backend_name == "sqlite":
+        db_path = os.getenv("ENGLISH_STORE_DB", os.path.join(data_dir, "english.db"))
+        backend = SQLiteBackend(db_path)
+        # 尚未完成匯入時（新資料庫，或上次遷移中斷 / 部分失敗）匯入既有檔案資料
+        if backend.get_meta(MIGRATION_MARKER) is None and os.path.exists(os.path.join(data_dir, "index.json")):
+            migrated = migrate_file_store(data_dir, backend)
+            print(f"已將 {migrated} 個會話從 {data_dir} 遷移至 {db_path}")
+        return backend
+    return FileBackend(data_dir)
+
+
+if __name__ == "__main__":
+    # 用法：python english_storage.py migrate [data_dir] [db_path]
+    if len(sys.argv) < 2 or sys.argv[1] != "migrate":
+        print("用法: python english_storage.py migrate [data_dir] [db_path]")
+        sys.exit(1)
+    source_dir = sys.argv[2] if len(sys.argv) > 2 else "conversation_data"
+    db_path = sys.argv[3] if len(sys.argv) > 3 else os.path.join(source_dir, "english.db")
+    count = migrate_file_store(source_dir, SQLiteBackend(db_path))
+    print(f"已遷移 {count} 個會話至 {db_path}")
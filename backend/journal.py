@@ -0,0 +1,162 @@
+import os
+import json
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+
+class ConversationJournal:
+    """追加式（append-only）對話日誌，每個對話一個 JSON Lines 檔案。
+
+    每一行是一筆紀錄：
+      - {"t": "msg", "d": {...}}  一則訊息
+      - {"t": "meta", "d": {...}} 一份完整的 metadata（以最後一筆為準）
+
+    每次保存只追加新增的訊息與一筆 metadata，寫入成本與歷史長度無關；
+    metadata 紀錄累積過多時才以「寫入暫存檔再改名」的方式壓縮成快照。
+    """
+
+    def __init__(self, directory: str, compact_threshold: int = 64):
+        self.directory = directory
+        self.compact_threshold = compact_threshold
+        # key -> 已寫入日誌的訊息數
+        self._message_counts: Dict[str, int] = {}
+        # key -> 自上次壓縮以來追加的 metadata 紀錄數
+        self._meta_counts: Dict[str, int] = {}
+        self._lock = threading.RLock()
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _get_path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.jsonl")
+
+    def exists(self, key: str) -> bool:
+        return os.path.exists(self._get_path(key))
+
+    # --- 讀取 ---
+    def replay(self, key: str) -> Optional[Tuple[List[Dict[str, Any]], Dict[str, Any]]]:
+        """重播日誌，回傳 (messages, metadata)；日誌不存在時回傳 None"""
+        with self._lock:
+            path = self._get_path(key)
+            if not os.path.exists(path):
+                return None
+            messages: List[Dict[str, Any]] = []
+            metadata: Dict[str, Any] = {}
+            meta_records = 0
+            with open(path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        # 最後一行可能因中斷而不完整，略過即可
+                        continue
+                    if record.get("t") == "msg":
+                        messages.append(record.get("d"))
+                    elif record.get("t") == "meta":
+                        metadata = record.get("d") or {}
+                        meta_records += 1
+            self._message_counts[key] = len(messages)
+            self._meta_counts[key] = meta_records
+            return messages, metadata
+
+    # --- 寫入 ---
+    def save(self, key: str, messages: List[Dict[str, Any]], metadata: Dict[str, Any]) -> None:
+        """只追加尚未寫入的訊息與最新的 metadata"""
+        with self._lock:
+            persisted = self._message_counts.get(key)
+            if persisted is None:
+                persisted = len(self.replay(key)[0]) if self.exists(key) else -1
+            if persisted < 0 or persisted > len(messages):
+                # 新日誌或歷史被截短，直接寫入完整快照
+                self.write_snapshot(key, messages, metadata)
+                return
+
+            records = [{"t": "msg", "d": m} for m in messages[persisted:]]
+            records.append({"t": "meta", "d": metadata})
+            self._append(key, records)
+            self._message_counts[key] = len(messages)
+            self._meta_counts[key] = self._meta_counts.get(key, 0) + 1
+
+            if self._meta_counts[key] > self.compact_threshold:
+                self.write_snapshot(key, messages, metadata)
+
+    def append(self, key: str, new_messages: List[Dict[str, Any]], metadata: Dict[str, Any]) -> None:
+        """只追加新訊息與最新 metadata，不需要完整歷史；日誌不存在時寫入快照"""
+        with self._lock:
+            if not self.exists(key):
+                self.write_snapshot(key, new_messages, metadata)
+                return
+            records = [{"t": "msg", "d": m} for m in new_messages]
+            records.append({"t": "meta", "d": metadata})
+            self._append(key, records)
+            if key in self._message_counts:
+                self._message_counts[key] += len(new_messages)
+            self._meta_counts[key] = self._meta_counts.get(key, 0) + 1
+
+            if self._meta_counts[key] > self.compact_threshold:
+                self.compact(key)
+
+    def _append(self, key: str, records: List[Dict[str, Any]]) -> None:
+        lines = "".join(json.dumps(r, ensure_ascii=False) + "\n" for r in records)
+        path = self._get_path(key)
+        self._truncate_partial_tail(path)
+        with open(path, 'a', encoding='utf-8') as f:
+            f.write(lines)
+
+    @staticmethod
+    def _truncate_partial_tail(path: str) -> None:
+        """中斷的寫入可能留下沒有換行結尾的半行；截掉它，避免下一筆紀錄接在同一行而一起被略過"""
+        try:
+            with open(path, 'rb+') as f:
+                size = f.seek(0, os.SEEK_END)
+                if size == 0:
+                    return
+                f.seek(size - 1)
+                if f.read(1) == b"\n":
+                    return
+                # 往回找最後一個換行，保留完整的紀錄
+                block = 4096
+                end = size
+                while end > 0:
+                    start = max(0, end - block)
+                    f.seek(start)
+                    chunk = f.read(end - start)
+                    index = chunk.rfind(b"\n")
+                    if index >= 0:
+                        f.truncate(start + index + 1)
+                        break
+                    end = start
+                else:
+                    f.truncate(0)
+                print(f"日誌 {path} 結尾有不完整的紀錄，已截除")
+        except FileNotFoundError:
+            return
+
+    def write_snapshot(self, key: str, messages: List[Dict[str, Any]], metadata: Dict[str, Any]) -> None:
+        """壓縮：以單一 metadata 紀錄加全部訊息重寫日誌（原子替換）"""
+        with self._lock:
+            path = self._get_path(key)
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                for m in messages:
+                    f.write(json.dumps({"t": "msg", "d": m}, ensure_ascii=False) + "\n")
+                f.write(json.dumps({"t": "meta", "d": metadata}, ensure_ascii=False) + "\n")
+            os.replace(tmp_path, path)
+            self._message_counts[key] = len(messages)
+            self._meta_counts[key] = 1
+
+    def compact(self, key: str) -> None:
+        """重播後重寫為快照"""
+        with self._lock:
+            replayed = self.replay(key)
+            if replayed is not None:
+                self.write_snapshot(key, *replayed)
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._message_counts.pop(key, None)
+            self._meta_counts.pop(key, None)
+            path = self._get_path(key)
+            if os.path.exists(path):
+                os.remove(path)
@@ -0,0 +1,43 @@
+import threading
+from collections import deque
+from typing import Any, Deque, Dict
+
+
+class LatencyMetrics:
+    """依標籤（例如模式名稱）統計延遲：總次數、失敗次數與最近 window 筆的平均 / p50 / p95 / 最大值"""
+
+    def __init__(self, window: int = 500):
+        self.window = window
+        self._lock = threading.Lock()
+        self._samples: Dict[str, Deque[float]] = {}
+        self._counts: Dict[str, Dict[str, int]] = {}
+
+    def record(self, label: str, seconds: float, outcome: str = "ok") -> None:
+        with self._lock:
+            samples = self._samples.get(label)
+            if samples is None:
+                samples = self._samples[label] = deque(maxlen=self.window)
+            samples.append(seconds)
+            counts = self._counts.setdefault(label, {})
+            counts[outcome] = counts.get(outcome, 0) + 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            result: Dict[str, Any] = {}
+            for label, samples in self._samples.items():
+                ordered = sorted(samples)
+                n = len(ordered)
+                result[label] = {
+                    "count": sum(self._counts[label].values()),
+                    "outcomes": dict(self._counts[label]),
+                    "avg_ms": round(sum(ordered) / n * 1000, 1),
+                    "p50_ms": round(ordered[n // 2] * 1000, 1),
+                    "p95_ms": round(ordered[min(n - 1, int(n * 0.95))] * 1000, 1),
+                    "max_ms": round(ordered[-1] * 1000, 1),
+                }
+            return result
+
+    def reset(self) -> None:
+        with self._lock:
+            self._samples.clear()
+            self._counts.clear()
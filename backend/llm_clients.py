@@ -0,0 +1,125 @@
+import os
+import asyncio
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+import openai
+
+from config_loader import config_loader, ConfigLoader
+
+
+# 連線池與逾時設定（每個端點一個 AsyncOpenAI / httpx 連線池）
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "200"))
+LLM_MAX_KEEPALIVE = int(os.getenv("LLM_MAX_KEEPALIVE", "50"))
+LLM_KEEPALIVE_EXPIRY = float(os.getenv("LLM_KEEPALIVE_EXPIRY", "90"))
+LLM_CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", "10"))
+LLM_READ_TIMEOUT = float(os.getenv("LLM_READ_TIMEOUT", "300"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))
+# 端點設定變更後，舊連線池保留多久再關閉（讓進行中的請求完成）
+LLM_RETIRE_GRACE_SECONDS = float(os.getenv("LLM_RETIRE_GRACE_SECONDS", "600"))
+
+DEFAULT_ENDPOINT_ID = "openai"
+_MISSING_KEY = "YOUR_OPENAI_API_KEY_HERE"
+
+
+def _endpoint_signature(endpoint: Dict[str, Any]) -> Tuple[Any, ...]:
+    key_env = endpoint.get("api_key_env") or "OPENAI_API_KEY"
+    return (endpoint.get("base_url"), key_env, os.getenv(key_env))
+
+
+class LLMClientRegistry:
+    """依 config/models.json 的 endpoints 為每個端點建立一個共用連線池的 AsyncOpenAI。
+
+    - for_model(model_id, model_type)：依模型的 endpoint 欄位取得客戶端；未設定或找不到時使用預設端點
+    - 端點設定（base_url、api_key_env 或金鑰）改變時整組重建並一次替換，
+      舊客戶端在寬限期後才關閉，進行中的請求不受影響
+    """
+
+    def __init__(self, loader: ConfigLoader = config_loader):
+        self.loader = loader
+        self._lock = threading.Lock()
+        # (簽章, {endpoint_id: AsyncOpenAI})；整組替換，讀取端不需加鎖
+        self._state: Tuple[Dict[str, Tuple[Any, ...]], Dict[str, openai.AsyncOpenAI]] = ({}, {})
+
+    @staticmethod
+    def _build_client(endpoint: Dict[str, Any]) -> openai.AsyncOpenAI:
+        key_env = endpoint.get("api_key_env") or "OPENAI_API_KEY"
+        http_client = openai.DefaultAsyncHttpxClient(
+            limits=httpx.Limits(
+                max_connections=LLM_MAX_CONNECTIONS,
+                max_keepalive_connections=LLM_MAX_KEEPALIVE,
+                keepalive_expiry=LLM_KEEPALIVE_EXPIRY,
+            ),
+            timeout=httpx.Timeout(LLM_READ_TIMEOUT, connect=LLM_CONNECT_TIMEOUT),
+        )
+        return openai.AsyncOpenAI(
+            api_key=os.getenv(key_env) or _MISSING_KEY,
+            base_url=endpoint.get("base_url") or None,
+            max_retries=LLM_MAX_RETRIES,
+            http_client=http_client,
+        )
+
+    def _endpoints(self) -> List[Dict[str, Any]]:
+        endpoints = [ep for ep in self.loader.get_endpoints() if ep.get("enabled", True)]
+        if not any(ep.get("id") == DEFAULT_ENDPOINT_ID for ep in endpoints):
+            # 至少保留預設的 OpenAI 端點（與原本的模組層級客戶端相同）
+            endpoints.append({"id": DEFAULT_ENDPOINT_ID, "api_key_env": "OPENAI_API_KEY"})
+        return endpoints
+
+    def refresh(self) -> bool:
+        """端點設定有變更時重建客戶端，回傳是否重建"""
+        endpoints = self._endpoints()
+        signatures = {ep["id"]: _endpoint_signature(ep) for ep in endpoints}
+        if signatures == self._state[0]:
+            return False
+        with self._lock:
+            old_signatures, old_clients = self._state
+            if signatures == old_signatures:
+                return False
+            clients: Dict[str, openai.AsyncOpenAI] = {}
+            for ep in endpoints:
+                endpoint_id = ep["id"]
+                if old_signatures.get(endpoint_id) == signatures[endpoint_id]:
+                    clients[endpoint_id] = old_clients[endpoint_id]
+                else:
+                    clients[endpoint_id] = self._build_client(ep)
+            retired = [c for eid, c in old_clients.items() if clients.get(eid) is not c]
+            self._state = (signatures, clients)
+        self._retire(retired)
+        return True
+
+    def _retire(self, clients: List[openai.AsyncOpenAI]) -> None:
+        if not clients:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        for client in clients:
+            loop.call_later(LLM_RETIRE_GRACE_SECONDS, lambda c=client: asyncio.ensure_future(c.close()))
+
+    def for_endpoint(self, endpoint_id: Optional[str] = None) -> openai.AsyncOpenAI:
+        self.refresh()
+        clients = self._state[1]
+        return clients.get(endpoint_id or DEFAULT_ENDPOINT_ID) or clients[DEFAULT_ENDPOINT_ID]
+
+    def for_model(self, model_id: Optional[str], model_type: str = "llm") -> openai.AsyncOpenAI:
+        """依模型設定中的 endpoint 取得客戶端"""
+        model = self.loader.get_model(model_id, model_type) if model_id else None
+        return self.for_endpoint((model or {}).get("endpoint"))
+
+    def stats(self) -> Dict[str, Any]:
+        clients = self._state[1]
+        return {eid: {"base_url": str(client.base_url)} for eid, client in clients.items()}
+
+    async def aclose(self) -> None:
+        with self._lock:
+            _, clients = self._state
+            self._state = ({}, {})
+        for client in clients.values():
+            await client.close()
+
+
+# 全域實例：所有模型呼叫都經由此取得客戶端
+llm_clients = LLMClientRegistry()
@@ -0,0 +1,106 @@
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Iterator, Optional, Tuple
+
+
+class LRUCache:
+    """同時限制筆數與總位元組數的 LRU 快取（執行緒安全）。
+
+    size 由呼叫端提供（例如序列化後的長度估計），超過任一上限時
+    從最久未使用的項目開始淘汰，並呼叫 on_evict(key, value)。
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 256,
+        max_bytes: Optional[int] = None,
+        on_evict: Optional[Callable[[Hashable, Any], None]] = None,
+    ):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.on_evict = on_evict
+        self._data: "OrderedDict[Hashable, Tuple[Any, int]]" = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.RLock()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._data
+
+    def __iter__(self) -> Iterator[Hashable]:
+        with self._lock:
+            return iter(list(self._data.keys()))
+
+    @property
+    def total_bytes(self) -> int:
+        return self._total_bytes
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return default
+            self._data.move_to_end(key)
+            return item[0]
+
+    def peek(self, key: Hashable, default: Any = None) -> Any:
+        """讀取但不更新使用順序"""
+        item = self._data.get(key)
+        return default if item is None else item[0]
+
+    def size_of(self, key: Hashable) -> int:
+        item = self._data.get(key)
+        return 0 if item is None else item[1]
+
+    def put(self, key: Hashable, value: Any, size: int = 0) -> None:
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self._total_bytes -= old[1]
+            self._data[key] = (value, size)
+            self._total_bytes += size
+            self._evict()
+
+    def resize(self, key: Hashable, size: int) -> None:
+        """更新既有項目的大小（例如訊息追加後）"""
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return
+            self._total_bytes += size - item[1]
+            self._data[key] = (item[0], size)
+            self._data.move_to_end(key)
+            self._evict()
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            item = self._data.pop(key, None)
+            if item is None:
+                return default
+            self._total_bytes -= item[1]
+            return item[0]
+
+    def items(self):
+        with self._lock:
+            return [(k, v[0]) for k, v in self._data.items()]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self._total_bytes = 0
+
+    def _evict(self) -> None:
+        # 至少保留最新的一筆，避免單一大項目被立即淘汰
+        while len(self._data) > 1 and (
+            len(self._data) > self.max_entries
+            or (self.max_bytes is not None and self._total_bytes > self.max_bytes)
+        ):
+            key, (value, size) = self._data.popitem(last=False)
+            self._total_bytes -= size
+            if self.on_evict is not None:
+                try:
+                    self.on_evict(key, value)
+                except Exception as e:
+                    print(f"LRU 淘汰回呼失敗: {e}")
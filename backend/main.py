@@ -1,3 +1,4 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 import os
@@ -10,12 +11,42 @@ load_dotenv()
 
 # 拆分後的 API 註冊器
 from english_api import register_english_endpoints
+from english_solver import store as english_store, english_core
+from conversation import conversation_manager
+from cold_storage import ColdStorageJob
 from math_api import register_math_endpoints
+from math_solver import math_solver
 from config_api import register_config_endpoints
+from llm_clients import llm_clients
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 定期把久未更新的對話移入冷儲存（COLD_STORAGE_DAYS=0 停用）
+    cold_storage_job = ColdStorageJob([
+        ("english", english_store.archive_cold),
+        ("math", conversation_manager.archive_cold),
+    ])
+    cold_storage_job.start()
+    try:
+        yield
+    finally:
+        try:
+            await cold_storage_job.stop()
+            # 等待背景產生中的標題與對話摘要寫回
+            await math_solver.drain_background_tasks()
+            await english_core.drain_background_tasks()
+        finally:
+            # 關閉前等待背景寫入完成，並寫回尚未落盤的會話索引與數學對話摘要（前面步驟失敗也照樣執行）
+            english_store.flush()
+            conversation_manager.flush()
+            # 關閉各端點的 LLM 連線池
+            await llm_clients.aclose()
+
 
 # 建立fastapi 實例
 def create_app() -> FastAPI:
-    app = FastAPI(title="api", version="v1")
+    app = FastAPI(title="api", version="v1", lifespan=lifespan)
 
     allowed_origins_env = os.getenv("ALLOWED_ORIGINS", "http://localhost:5173,http://127.0.0.1:5173")
     allowed_origins = [o.strip() for o in allowed_origins_env.split(",") if o.strip()]
@@ -25,6 +56,8 @@ def create_app() -> FastAPI:
         allow_credentials=True,
         allow_methods=["*"],
         allow_headers=["*"],
+        # 分頁端點以標頭回傳下一頁的 cursor
+        expose_headers=["X-Next-Cursor"],
     )
 
     # 註冊端點
@@ -1,6 +1,9 @@
-from fastapi import FastAPI, HTTPException, UploadFile
-from fastapi.responses import JSONResponse
+import json
+from fastapi import FastAPI, HTTPException, UploadFile, Query, Response
+from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi.concurrency import run_in_threadpool
 from typing import Dict, List, Optional
+from pydantic import BaseModel
 from model_registry import model_registry
 
 # 導入數學解題模塊
@@ -8,7 +11,7 @@ from math_solver import (
     MathProblem, MathSolution, ConceptRequest, ConceptExplanation, 
     QuestionRequest, MathDomain, DifficultyLevel, ImageMathProblem,
     math_solver, get_available_concepts,
-    list_conversations, ConversationInfo, MathSolutionResponse
+    list_conversations_page, conversation_manager, ConversationInfo, MathSolutionResponse
 )
 
 # --- API 端點定義 ---
@@ -17,14 +20,44 @@ def register_math_endpoints(app: FastAPI):
     """將數學解題端點註冊到主應用"""
     
     @app.get("/api/v1/math/conversations", response_model=List[ConversationInfo], tags=["Math"])
-    async def list_math_conversations():
+    async def list_math_conversations(response: Response, cursor: Optional[str] = None,
+                                      limit: Optional[int] = Query(None, ge=1, le=500)):
         """
-        獲取所有已保存的數學解題對話列表，按更新時間降序排序。
+        獲取已保存的數學解題對話列表，按更新時間降序排序。
+        指定 limit 時分頁，下一頁的 cursor 由 X-Next-Cursor 標頭回傳；未指定時回傳全部。
         """
         try:
-            return list_conversations()
+            infos, next_cursor = list_conversations_page(cursor=cursor, limit=limit)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"獲取對話列表失敗: {str(e)}")
+        if next_cursor:
+            response.headers["X-Next-Cursor"] = next_cursor
+        return infos
+
+    @app.post("/api/v1/math/conversations/reindex", tags=["Math"])
+    async def rebuild_math_conversation_index():
+        """重新掃描對話檔案，重建列表用的摘要索引（在執行緒池中掃描，不阻塞其他請求）"""
+        count = await run_in_threadpool(conversation_manager.rebuild_summaries)
+        return {"ok": True, "count": count}
+
+    class ClassifierModeRequest(BaseModel):
+        mode: str
+
+    @app.get("/api/v1/math/classifier", tags=["Math"])
+    async def get_classifier_mode():
+        """查看預先分類器的執行模式（serial / speculative / off）與各模式的解題延遲"""
+        return math_solver.classifier_stats()
+
+    @app.put("/api/v1/math/classifier", tags=["Math"])
+    async def set_classifier_mode(req: ClassifierModeRequest):
+        """切換預先分類器的執行模式"""
+        try:
+            math_solver.set_classifier_mode(req.mode)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        return {"ok": True, **math_solver.classifier_stats()}
 
     @app.post("/api/v1/math/solve", response_model=MathSolutionResponse, tags=["Math"])
     async def solve_math_problem(problem: MathProblem):
@@ -45,6 +78,33 @@ def register_math_endpoints(app: FastAPI):
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"解題失敗: {str(e)}")
     
+    @app.post("/api/v1/math/solve/stream", tags=["Math"])
+    async def solve_math_problem_stream(problem: MathProblem):
+        """
+        以 SSE 串流解決數學問題
+
+        事件（data 為 JSON）：
+        - session：本次的 session_id
+        - field：頂層欄位完成（problem、solution_approach、final_answer 等）
+        - step：solution 的每個步驟完成時立即送出
+        - complete：完整的 MathSolution（已驗證並寫入對話）
+        - error：含 status 與 message
+        最後以 [DONE] 結束。
+        """
+        async def sse_event_generator():
+            async for event in math_solver.solve_problem_stream(problem):
+                yield f"data: {json.dumps(event, ensure_ascii=False)}\n\n"
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(
+            sse_event_generator(),
+            media_type="text/event-stream",
+            headers={
+                "Cache-Control": "no-cache",
+                "X-Accel-Buffering": "no"
+            }
+        )
+
     @app.post("/api/v1/math/concept", response_model=ConceptExplanation, tags=["Math"])
     async def explain_concept(request: ConceptRequest):
         """
@@ -75,6 +75,7 @@ class ConversationInfo(BaseModel):
     title: str = Field(description="對話標題")
     created_at: str = Field(description="創建時間")
     updated_at: str = Field(description="最後更新時間")
+    message_count: int = Field(default=0, description="訊息數")
 
 class ConceptExplanation(BaseModel):
     concept_name: str = Field(description="概念名稱")
@@ -6,12 +6,14 @@ import json
 import os
 import uuid
 import base64
-from typing import Any, Dict, List, Optional, Union
+import hashlib
+import time
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple, Union
 from datetime import datetime
 
 import openai
 from openai import OpenAI, AsyncOpenAI
-from prompt_loader import get_prompt
+from prompt_loader import get_prompt, get_prompt_version
 from fastapi import HTTPException
 from pydantic import BaseModel
 
@@ -30,18 +32,39 @@ from knowledge_base import MATH_CONCEPTS
 # (匯入函式和實例)
 from conversation import (
     conversation_manager, ConversationManager, 
-    list_conversations as list_conversations_from_db
+    list_conversations as list_conversations_from_db,
+    list_conversations_page as list_conversations_page_from_db,
 )
 from model_registry import model_registry
+from llm_clients import llm_clients
+from response_cache import response_cache, normalize_text, collapse_whitespace
+from single_flight import single_flight
+from concept_store import concept_store
+from latency_metrics import LatencyMetrics
+from streaming_json import IncrementalJSONParser
 
-# --- OpenAI 客戶端 ---
+# --- OpenAI 客戶端（依模型的 endpoint 由 llm_clients 取得） ---
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "YOUR_OPENAI_API_KEY_HERE")
-client = openai.AsyncOpenAI(api_key=OPENAI_API_KEY)
+
+# 預先分類器的執行模式：
+# - serial：先分類，確認是數學題後才解題（預設）
+# - speculative：分類與解題同時進行，分類判定不是數學題時取消解題
+# - off：不做預先分類（只依賴解題結果中的 is_math_question）
+CLASSIFIER_MODES = ("serial", "speculative", "off")
+MATH_CLASSIFIER_MODE = os.getenv("MATH_CLASSIFIER_MODE", "serial")
+
+# 既有對話中再次解題時接續的上游回應：(previous_response_id, 本地歷史)
+SolveChain = Tuple[str, List[Dict[str, Any]]]
 
 
 class MathSolver:
     def __init__(self):
         self.model = os.getenv("DEFAULT_LLM_MODEL", model_registry.get("math", "llm", "gpt-5"))
+        self.classifier_mode = MATH_CLASSIFIER_MODE if MATH_CLASSIFIER_MODE in CLASSIFIER_MODES else "serial"
+        # 依模式統計「分類 + 解題」的延遲
+        self.classifier_metrics = LatencyMetrics()
+        # 進行中的背景工作（保留參照，避免 task 被回收）
+        self._background_tasks: set = set()
         self._define_schemas()
 
     def _define_schemas(self):
@@ -237,8 +260,9 @@ class MathSolver:
             {"role": "user", "content": [{"type": "input_text", "text": problem_text}]}
         ]
         try:
-            resp = await client.responses.create(
-                model=model_registry.get("math", "llm", self.model), # 或是使用 gpt-5-mini
+            title_model = model_registry.get("math", "llm", self.model) # 或是使用 gpt-5-mini
+            resp = await llm_clients.for_model(title_model).responses.create(
+                model=title_model,
                 input=messages,
                 max_output_tokens=40,
             )
@@ -274,7 +298,7 @@ class MathSolver:
             {"role": "user", "content": [{"type": "input_text", "text": problem_text}]}
         ]
         try:
-            resp = await client.responses.create(
+            resp = await llm_clients.for_model("gpt-5-mini").responses.create(
                 model="gpt-5-mini",
                 input=messages,
                 text={
@@ -312,8 +336,9 @@ class MathSolver:
             },
         ]
         try:
-            resp = await client.responses.create(
-                model=model_registry.get("math", "llm", self.model),
+            classifier_model = model_registry.get("math", "llm", self.model)
+            resp = await llm_clients.for_model(classifier_model).responses.create(
+                model=classifier_model,
                 input=messages,
                 text={
                     "format": {
@@ -332,84 +357,239 @@ class MathSolver:
         except Exception:
             return None # 失敗時返回 None
 
-    # --- 統一的核心解題邏輯 (新) ---
-    async def _solve(
+    # --- 解答快取 ---
+    def _solution_cache_key(self, kind: str, content: str, problem_input: BaseModel, *extra: Any) -> str:
+        """以題目內容、領域、難度、概念、模型與提示詞版本組成解答快取鍵"""
+        # 提示詞版本：math 區段的提示詞內容有任何修改都會讓舊快取失效
+        prompt_version = get_prompt_version("math")
+        return response_cache.make_key(
+            "math.solution",
+            kind,
+            content,
+            problem_input.domain.value if problem_input.domain else None,
+            problem_input.difficulty.value if problem_input.difficulty else None,
+            sorted(problem_input.specific_concepts or []),
+            *extra,
+            self.model,
+            prompt_version,
+        )
+
+    async def _record_turn(
         self,
-        messages: List[Dict[str, Any]],
         session_id: str,
-        problem_input: BaseModel, # (MathProblem or ImageMathProblem)
+        problem_input: BaseModel,
+        solution: MathSolution,
+        is_new_conversation: bool,
+        response_id: Optional[str] = None
+    ) -> None:
+        """把一輪解題寫入對話；新對話先使用暫定標題，正式標題在背景產生後再更新。
+
+        response_id 為上游保存的回應 ID，之後的追問以 previous_response_id 接續（快取命中時沒有）。
+        """
+        title = self._provisional_title(solution.problem) if is_new_conversation else None
+        conversation_manager.add_messages(session_id, [
+            {"role": "user", "content": problem_input},
+            {"role": "assistant", "content": solution, "response_id": response_id},
+        ], title=title)
+        if is_new_conversation:
+            task = asyncio.create_task(self._refine_title(session_id, solution.problem))
+            self._background_tasks.add(task)
+            task.add_done_callback(self._background_tasks.discard)
+
+    @staticmethod
+    def _provisional_title(problem_text: str, max_length: int = 15) -> str:
+        """以題目文字的開頭作為暫定標題"""
+        text = " ".join((problem_text or "").split())
+        if not text:
+            return "數學問題"
+        return text if len(text) <= max_length else text[:max_length] + "…"
+
+    async def _refine_title(self, session_id: str, problem_text: str) -> None:
+        """背景產生正式標題並更新對話與摘要索引"""
+        try:
+            title = await self._generate_title(problem_text)
+            conversation_manager.set_title(session_id, title)
+        except Exception as e:
+            print(f"Error refining title for {session_id}: {e}")
+
+    async def drain_background_tasks(self, timeout: float = 10.0) -> None:
+        """等待背景工作（例如標題產生）完成，供關閉服務前呼叫"""
+        if self._background_tasks:
+            await asyncio.wait(list(self._background_tasks), timeout=timeout)
+
+    async def _solve_cached(
+        self,
+        cache_key: str,
+        session_id: str,
+        problem_input: BaseModel,
         is_new_conversation: bool
-    ) -> MathSolutionResponse:
-        """統一的解題核心函式"""
-        
+    ) -> Optional[MathSolutionResponse]:
+        """快取命中時直接回傳已存的解答，但仍記錄到呼叫者的對話中"""
+        cached = await response_cache.aget(cache_key)
+        if cached is None:
+            return None
         try:
-            # 轉換 messages 為 API 要求的格式
-            input_payload: List[Dict[str, Any]] = []
-            for m in messages:
-                role = m.get("role", "user")
-                content = m.get("content")
-                converted_role = "developer" if role == "system" else role
-                
-                if isinstance(content, list):
-                    # 處理圖片和文字混合
-                    converted_items = []
-                    for item in content:
-                        if item.get("type") == "text":
-                            converted_items.append({"type": "input_text", "text": item.get("text", "")})
-                        elif item.get("type") == "image_url":
-                            converted_items.append({"type": "input_image", "image_url": item.get("image_url")})
-                    input_payload.append({"role": converted_role, "content": converted_items})
-                else:
-                    # 處理純文字
-                    input_payload.append({
-                        "role": converted_role,
-                        "content": [{"type": "input_text", "text": str(content)}]
-                    })
+            solution = MathSolution(**cached)
+        except Exception as e:
+            print(f"解答快取內容無效: {e}")
+            return None
+        await self._record_turn(session_id, problem_input, solution, is_new_conversation)
+        return MathSolutionResponse(session_id=session_id, solution=solution)
 
-            # 呼叫 OpenAI API
-            resp = await client.responses.create(
-                model=self.model,
-                input=input_payload,
-                text={
-                    "format": {
-                        "type": "json_schema",
-                        "name": "math_solution",
-                        "schema": self._get_math_solution_schema(),
-                        "strict": True
-                    },
-                    "verbosity": "medium",
-                },
-                max_output_tokens=3500,
-                reasoning={"effort": "medium", "summary": "auto"},
-                store=True,
-                include=[
-                    "reasoning.encrypted_content",
-                    "web_search_call.action.sources"
-                ]
-            )
+    # --- 預先分類與解題的排程 ---
+    def set_classifier_mode(self, mode: str) -> None:
+        if mode not in CLASSIFIER_MODES:
+            raise ValueError(f"未知的分類模式: {mode}")
+        self.classifier_mode = mode
 
-            output_text = getattr(resp, "output_text", None)
-            if not output_text:
-                raise HTTPException(status_code=500, detail="AI 未能生成結構化解答")
+    async def _classify_and_solve(
+        self,
+        classify: Callable[[], Awaitable[None]],
+        messages: List[Dict[str, Any]],
+        cache_key: Optional[str] = None,
+        chain: Optional[SolveChain] = None
+    ) -> Tuple[MathSolution, Optional[str]]:
+        """依 classifier_mode 執行預先分類與解題，並記錄該模式的延遲；回傳 (解答, 回應 ID)
 
-            solution_data = json.loads(output_text)
+        chain 為 (previous_response_id, 本地歷史)，見 _solve_chain。
+        """
+        mode = self.classifier_mode
+        start = time.perf_counter()
+        outcome = "ok"
+        try:
+            if mode == "off":
+                solution, response_id = await self._solve(messages, chain)
+            elif mode == "speculative":
+                # 解題與分類同時開始；分類拒絕（或失敗）時取消解題
+                solve_task = asyncio.ensure_future(self._solve(messages, chain))
+                solve_task.add_done_callback(lambda t: t.cancelled() or t.exception())
+                try:
+                    await classify()
+                except BaseException:
+                    solve_task.cancel()
+                    raise
+                solution, response_id = await solve_task
+            else:
+                await classify()
+                solution, response_id = await self._solve(messages, chain)
+            # 分類通過後才寫入快取（speculative 模式下解題可能比分類先完成）
+            if cache_key:
+                response_cache.set(cache_key, solution.model_dump(mode="json"))
+            return solution, response_id
+        except HTTPException as e:
+            outcome = "rejected" if e.status_code == 400 else "error"
+            raise
+        except BaseException:
+            outcome = "error"
+            raise
+        finally:
+            self.classifier_metrics.record(mode, time.perf_counter() - start, outcome)
 
-            if not solution_data.get("is_math_question", True):
-                raise HTTPException(status_code=400, detail="[NOT_MATH] 這不是一個數學問題。")
+    def classifier_stats(self) -> Dict[str, Any]:
+        return {"mode": self.classifier_mode, "modes": list(CLASSIFIER_MODES), "latency": self.classifier_metrics.snapshot()}
 
-            solution_data.pop("is_math_question", None)
-            solution = MathSolution(**solution_data)
+    # --- 統一的核心解題邏輯 (新) ---
+    @staticmethod
+    def _to_input_payload(messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """轉換 messages 為 Responses API 要求的格式"""
+        input_payload: List[Dict[str, Any]] = []
+        for m in messages:
+            role = m.get("role", "user")
+            content = m.get("content")
+            converted_role = "developer" if role == "system" else role
             
-            # 儲存到對話
-            if is_new_conversation:
-                title = await self._generate_title(solution.problem)
-                conversation_manager.add_message(session_id, "user", problem_input, title=title)
-                conversation_manager.add_message(session_id, "assistant", solution)
+            if isinstance(content, list):
+                # 處理圖片和文字混合
+                converted_items = []
+                for item in content:
+                    if item.get("type") == "text":
+                        converted_items.append({"type": "input_text", "text": item.get("text", "")})
+                    elif item.get("type") == "image_url":
+                        converted_items.append({"type": "input_image", "image_url": item.get("image_url")})
+                input_payload.append({"role": converted_role, "content": converted_items})
             else:
-                conversation_manager.add_message(session_id, "user", problem_input)
-                conversation_manager.add_message(session_id, "assistant", solution)
+                # 處理純文字
+                input_payload.append({
+                    "role": converted_role,
+                    "content": [{"type": "input_text", "text": str(content)}]
+                })
+        return input_payload
+
+    def _solution_request(
+        self,
+        messages: List[Dict[str, Any]],
+        previous_response_id: Optional[str] = None,
+        history: Optional[List[Dict[str, Any]]] = None
+    ) -> Dict[str, Any]:
+        """解題請求的參數（一般與串流解題共用）。
+
+        previous_response_id：接續上游保存的對話，只送出本次題目；system 提示詞不會沿用，改以 instructions 每次帶上。
+        history：無法接續時，把本地對話紀錄插在 system 提示詞與本次題目之間。
+        """
+        system = [m for m in messages if m.get("role") == "system"]
+        rest = [m for m in messages if m.get("role") != "system"]
+        extra: Dict[str, Any] = {}
+        if previous_response_id:
+            input_payload = self._to_input_payload(rest)
+            extra = dict(instructions="\n\n".join(str(m.get("content")) for m in system),
+                         previous_response_id=previous_response_id)
+        elif history:
+            input_payload = self._to_input_payload(system) + self._history_turns(history) + self._to_input_payload(rest)
+        else:
+            input_payload = self._to_input_payload(messages)
+        return dict(
+            model=self.model,
+            input=input_payload,
+            text={
+                "format": {
+                    "type": "json_schema",
+                    "name": "math_solution",
+                    "schema": self._get_math_solution_schema(),
+                    "strict": True
+                },
+                "verbosity": "medium",
+            },
+            max_output_tokens=3500,
+            reasoning={"effort": "medium", "summary": "auto"},
+            store=True,
+            include=[
+                "reasoning.encrypted_content",
+                "web_search_call.action.sources"
+            ],
+            **extra
+        )
+
+    @staticmethod
+    def _parse_solution(solution_data: Dict[str, Any]) -> MathSolution:
+        if not solution_data.get("is_math_question", True):
+            raise HTTPException(status_code=400, detail="[NOT_MATH] 這不是一個數學問題。")
+        solution_data = dict(solution_data)
+        solution_data.pop("is_math_question", None)
+        return MathSolution(**solution_data)
+
+    async def _solve(self, messages: List[Dict[str, Any]], chain: Optional[SolveChain] = None) -> Tuple[MathSolution, Optional[str]]:
+        """統一的解題核心函式（只產生解答，記錄對話由呼叫端負責）；回傳 (解答, 回應 ID)
+
+        有 chain 時以 previous_response_id 接續對話；上游拒絕（例如已過期）時改由本地歷史重建。
+        """
+        
+        try:
+            # 呼叫 OpenAI API
+            client = llm_clients.for_model(self.model)
+            resp = None
+            if chain is not None:
+                try:
+                    resp = await client.responses.create(**self._solution_request(messages, previous_response_id=chain[0]))
+                except (openai.BadRequestError, openai.NotFoundError) as e:
+                    print(f"previous_response_id {chain[0]} 無法使用，改用本地歷史: {e}")
+            if resp is None:
+                resp = await client.responses.create(**self._solution_request(messages, history=chain[1] if chain else None))
+
+            output_text = getattr(resp, "output_text", None)
+            if not output_text:
+                raise HTTPException(status_code=500, detail="AI 未能生成結構化解答")
 
-            return MathSolutionResponse(session_id=session_id, solution=solution)
+            return self._parse_solution(json.loads(output_text)), getattr(resp, "id", None)
 
         except HTTPException:
             raise
@@ -433,21 +613,163 @@ class MathSolver:
         session_id = problem.session_id or str(uuid.uuid4())
         is_new_conversation = not problem.session_id
 
-        # 1. 預先分類
-        classifier = await self._classify_text_is_reasonable_math(problem.problem)
-        if classifier and not classifier.is_reasonable_math_question:
-            raise HTTPException(status_code=400, detail=f"[NOT_MATH] 這不是合理的數學問題: {classifier.reason}")
-        
-        # 2. 構建提示詞
+        chain = self._solve_chain(problem.session_id)
+        if chain is not None:
+            # 既有對話：接續上游回應，解答依賴對話內容，不使用共用的快取與 single-flight
+            solution, response_id = await self._solve_text(problem, None, chain)
+        else:
+            # 1. 相同題目直接使用快取的解答（跳過分類與解題）
+            cache_key = self._solution_cache_key("text", collapse_whitespace(problem.problem), problem)
+            cached = await self._solve_cached(cache_key, session_id, problem, is_new_conversation)
+            if cached is not None:
+                return cached
+
+            # 2. 分類與解題；同一題目同時進行的請求共用一次上游呼叫
+            solution, response_id = await single_flight.do(("math.solution", cache_key), self._solve_text, problem, cache_key)
+
+        # 3. 儲存到對話
+        await self._record_turn(session_id, problem, solution, is_new_conversation, response_id)
+        return MathSolutionResponse(session_id=session_id, solution=solution)
+
+    def _text_messages(self, problem: MathProblem) -> List[Dict[str, Any]]:
         system_prompt = self._build_system_prompt(problem)
         user_prompt = self._build_user_prompt(problem)
-        messages = [
+        return [
             {"role": "system", "content": system_prompt},
             {"role": "user", "content": user_prompt}
         ]
+
+    async def _check_text_is_math(self, problem: MathProblem) -> None:
+        """預先分類；不是合理的數學題時拋出 400"""
+        classifier = await self._classify_text_is_reasonable_math(problem.problem)
+        if classifier and not classifier.is_reasonable_math_question:
+            raise HTTPException(status_code=400, detail=f"[NOT_MATH] 這不是合理的數學問題: {classifier.reason}")
+
+    @staticmethod
+    def _solve_chain(session_id: Optional[str]) -> Optional[SolveChain]:
+        """既有對話的最後一則助理訊息有上游回應 ID 時，回傳 (previous_response_id, 本地歷史)"""
+        if not session_id:
+            return None
+        previous_response_id = conversation_manager.get_last_response_id(session_id)
+        if not previous_response_id:
+            return None
+        return previous_response_id, conversation_manager.get_history(session_id)
+
+    async def _solve_text(self, problem: MathProblem, cache_key: Optional[str], chain: Optional[SolveChain] = None) -> Tuple[MathSolution, Optional[str]]:
+        # 1. 構建提示詞
+        messages = self._text_messages(problem)
         
-        # 3. 呼叫核心解題
-        return await self._solve(messages, session_id, problem, is_new_conversation)
+        # 2. 依模式執行分類與核心解題
+        return await self._classify_and_solve(lambda: self._check_text_is_math(problem), messages, cache_key, chain)
+
+    # --- 串流解題 ---
+    @staticmethod
+    def _stream_event(path: Tuple[Any, ...], value: Any) -> Optional[Dict[str, Any]]:
+        """把解析器回報的完成值轉成 SSE 事件：頂層欄位與 steps 的每個元素"""
+        if len(path) == 2 and path[0] == "steps":
+            return {"type": "step", "index": path[1], "data": value}
+        if len(path) == 1 and path[0] not in ("steps", "is_math_question"):
+            return {"type": "field", "name": path[0], "data": value}
+        return None
+
+    async def solve_problem_stream(self, problem: MathProblem) -> AsyncIterator[Dict[str, Any]]:
+        """串流解決文字數學問題：產生事件 dict。
+
+        session → field（problem、solution_approach、final_answer 等頂層欄位完成時）/ step（每個步驟完成時）
+        → complete（驗證為 MathSolution 並寫入對話後）；失敗時產生 error（含 status）。
+        """
+        session_id = problem.session_id or str(uuid.uuid4())
+        is_new_conversation = not problem.session_id
+        yield {"type": "session", "session_id": session_id}
+
+        classify_task: Optional[asyncio.Future] = None
+        try:
+            # 1. 快取命中時依序送出已存解答的各欄位（既有對話接續上游回應，不使用共用快取）
+            chain = self._solve_chain(problem.session_id)
+            cache_key = self._solution_cache_key("text", collapse_whitespace(problem.problem), problem)
+            cached = await response_cache.aget(cache_key) if chain is None else None
+            solution = None
+            response_id = None
+            if cached is not None:
+                try:
+                    solution = MathSolution(**cached)
+                except Exception as e:
+                    print(f"解答快取內容無效: {e}")
+            if solution is not None:
+                for name, value in solution.model_dump(mode="json").items():
+                    if name == "steps":
+                        for index, step in enumerate(value):
+                            yield self._stream_event(("steps", index), step)
+                    else:
+                        yield self._stream_event((name,), value)
+            else:
+                if OPENAI_API_KEY == "YOUR_OPENAI_API_KEY_HERE":
+                    raise HTTPException(status_code=500, detail="OpenAI API Key not configured.")
+                # 2. 預先分類：serial 先完成再開始串流；speculative 與串流同時進行，結束前必須通過
+                mode = self.classifier_mode
+                start = time.perf_counter()
+                if mode == "serial":
+                    await self._check_text_is_math(problem)
+                elif mode == "speculative":
+                    classify_task = asyncio.ensure_future(self._check_text_is_math(problem))
+                    classify_task.add_done_callback(lambda t: t.cancelled() or t.exception())
+
+                # 3. 串流解題，每個欄位 / 步驟完成就送出
+                parser = IncrementalJSONParser()
+                client = llm_clients.for_model(self.model)
+                messages = self._text_messages(problem)
+                stream = None
+                if chain is not None:
+                    try:
+                        stream = await client.responses.create(**self._solution_request(messages, previous_response_id=chain[0]), stream=True)
+                    except (openai.BadRequestError, openai.NotFoundError) as e:
+                        print(f"previous_response_id {chain[0]} 無法使用，改用本地歷史: {e}")
+                if stream is None:
+                    stream = await client.responses.create(**self._solution_request(messages, history=chain[1] if chain else None), stream=True)
+                async with stream:
+                    async for event in stream:
+                        if classify_task is not None and classify_task.done():
+                            classify_task.result()
+                        etype = getattr(event, "type", "")
+                        if etype == "response.created":
+                            response_id = getattr(getattr(event, "response", None), "id", None)
+                        elif etype == "response.output_text.delta":
+                            for path, value in parser.feed(getattr(event, "delta", "") or ""):
+                                if path == ("is_math_question",) and value is False:
+                                    raise HTTPException(status_code=400, detail="[NOT_MATH] 這不是一個數學問題。")
+                                stream_event = self._stream_event(path, value)
+                                if stream_event is not None:
+                                    yield stream_event
+                        elif etype in ("response.failed", "error"):
+                            raise HTTPException(status_code=500, detail="AI 串流解題失敗")
+                if classify_task is not None:
+                    await classify_task
+
+                # 4. 驗證完整結果並寫入快取
+                if not parser.text:
+                    raise HTTPException(status_code=500, detail="AI 未能生成結構化解答")
+                solution = self._parse_solution(json.loads(parser.text))
+                if chain is None:
+                    response_cache.set(cache_key, solution.model_dump(mode="json"))
+                self.classifier_metrics.record(f"{mode}:stream", time.perf_counter() - start)
+
+            # 5. 寫入對話
+            await self._record_turn(session_id, problem, solution, is_new_conversation, response_id)
+            yield {"type": "complete", "session_id": session_id, "solution": solution.model_dump(mode="json")}
+        except HTTPException as e:
+            yield {"type": "error", "status": e.status_code, "message": e.detail}
+        except openai.APIError as e:
+            print(f"OpenAI API error during math streaming: {e}")
+            yield {"type": "error", "status": 500, "message": f"數學解題失敗: {e.message}"}
+        except json.JSONDecodeError as e:
+            print(f"JSON decode error: {e}")
+            yield {"type": "error", "status": 500, "message": "解析 AI 回應時發生錯誤"}
+        except Exception as e:
+            print(f"Error in solve_problem_stream: {e}")
+            yield {"type": "error", "status": 500, "message": "解題過程中發生內部錯誤"}
+        finally:
+            if classify_task is not None and not classify_task.done():
+                classify_task.cancel()
 
     async def solve_image_problem(self, image_data: bytes, image_problem: ImageMathProblem) -> MathSolutionResponse:
         """(重構) 解決圖片中的數學問題"""
@@ -456,13 +778,37 @@ class MathSolver:
         
         session_id = image_problem.session_id or str(uuid.uuid4())
         is_new_conversation = not image_problem.session_id
-        
+
+        chain = self._solve_chain(image_problem.session_id)
+        if chain is not None:
+            # 既有對話：接續上游回應，不使用共用的快取與 single-flight
+            solution, response_id = await self._solve_image(image_data, image_problem, None, chain)
+        else:
+            # 1. 同一張圖片（以位元組雜湊識別）直接使用快取的解答
+            cache_key = self._solution_cache_key(
+                "image", hashlib.sha256(image_data).hexdigest(), image_problem,
+                collapse_whitespace(image_problem.additional_context or "")
+            )
+            cached = await self._solve_cached(cache_key, session_id, image_problem, is_new_conversation)
+            if cached is not None:
+                return cached
+
+            # 2. 分類與解題；同一張圖片同時進行的請求共用一次上游呼叫
+            solution, response_id = await single_flight.do(("math.solution", cache_key), self._solve_image, image_data, image_problem, cache_key)
+
+        # 3. 儲存到對話
+        await self._record_turn(session_id, image_problem, solution, is_new_conversation, response_id)
+        return MathSolutionResponse(session_id=session_id, solution=solution)
+
+    async def _solve_image(self, image_data: bytes, image_problem: ImageMathProblem, cache_key: Optional[str],
+                           chain: Optional[SolveChain] = None) -> Tuple[MathSolution, Optional[str]]:
         base64_image = base64.b64encode(image_data).decode('utf-8')
         
-        # 1. 預先分類
-        is_math = await self._classify_image_is_math(base64_image, image_problem.additional_context)
-        if is_math is False:
-            raise HTTPException(status_code=400, detail="[NOT_MATH] 這張圖片看起來不是數學題。")
+        # 1. 預先分類（不是數學題時拋出 400）
+        async def classify() -> None:
+            is_math = await self._classify_image_is_math(base64_image, image_problem.additional_context)
+            if is_math is False:
+                raise HTTPException(status_code=400, detail="[NOT_MATH] 這張圖片看起來不是數學題。")
 
         # 2. 構建提示詞
         system_prompt = self._build_image_system_prompt(image_problem)
@@ -477,15 +823,33 @@ class MathSolver:
             }
         ]
         
-        # 3. 呼叫核心解題
-        return await self._solve(messages, session_id, image_problem, is_new_conversation)
+        # 3. 依模式執行分類與核心解題
+        return await self._classify_and_solve(classify, messages, cache_key, chain)
 
     async def get_concept_explanation(self, request: ConceptRequest) -> ConceptExplanation:
         """(重構) 獲取數學概念的詳細解釋"""
-        if OPENAI_API_KEY == "YOUR_OPENAI_API_KEY_HERE":
-            raise HTTPException(status_code=500, detail="OpenAI API Key not configured.")
-        
-        relevant_info = self._find_concept_info(request.concept_name, request.domain)
+        # 目錄中的概念優先使用預先產生的解釋（見 concept_store.py），沒有時才即時產生
+        explanation_data = concept_store.get(self.model, request.concept_name, request.domain)
+        if explanation_data is None:
+            if OPENAI_API_KEY == "YOUR_OPENAI_API_KEY_HERE":
+                raise HTTPException(status_code=500, detail="OpenAI API Key not configured.")
+            # 相同概念（與領域）同時進行的請求共用一次上游呼叫；每個請求各自取得一份副本
+            explanation_data = await single_flight.do(
+                ("math.concept", normalize_text(request.concept_name), request.domain, self.model),
+                self._explain_concept, request.concept_name, request.domain
+            )
+        explanation = ConceptExplanation(**explanation_data)
+
+        if request.session_id:
+            explanation.session_id = request.session_id
+            conversation_manager.add_messages(request.session_id, [
+                {"role": "user", "content": request},
+                {"role": "assistant", "content": explanation},
+            ])
+        return explanation
+
+    async def _explain_concept(self, concept_name: str, domain: Optional[str]) -> Dict[str, Any]:
+        relevant_info = self._find_concept_info(concept_name, domain)
         try:
             system_prompt = get_prompt("math.concept_explain_system", relevant_info=relevant_info, default=f"你是一位高中數學教師... (省略，同原檔)")
         except ValueError as e:
@@ -493,11 +857,11 @@ class MathSolver:
         
         messages = [
             {"role": "developer", "content": [{"type": "input_text", "text": system_prompt}]},
-            {"role": "user", "content": [{"type": "input_text", "text": f"請解釋數學概念：{request.concept_name}"}]}
+            {"role": "user", "content": [{"type": "input_text", "text": f"請解釋數學概念：{concept_name}"}]}
         ]
         
         try:
-            resp = await client.responses.create(
+            resp = await llm_clients.for_model(self.model).responses.create(
                 model=self.model,
                 input=messages,
                 text={
@@ -516,32 +880,87 @@ class MathSolver:
                 raise HTTPException(status_code=500, detail="AI 未能生成結構化的概念解釋")
 
             explanation_data = json.loads(output_text)
-            explanation = ConceptExplanation(**explanation_data)
-            
-            if request.session_id:
-                explanation.session_id = request.session_id
-                conversation_manager.add_message(request.session_id, "user", request)
-                conversation_manager.add_message(request.session_id, "assistant", explanation)
-            return explanation
+            # 先驗證一次，格式不符時由這裡統一回報錯誤
+            ConceptExplanation(**explanation_data)
+            return explanation_data
             
         except Exception as e:
             print(f"Error in get_concept_explanation: {e}")
             raise HTTPException(status_code=500, detail="獲取概念解釋時發生內部錯誤")
 
     async def answer_question(self, request: QuestionRequest) -> str:
-        """(重構) 回答關於解題過程的問題"""
+        """(重構) 回答關於解題過程的問題。
+
+        上一則助理訊息有上游回應 ID 時以 previous_response_id 接續，只送出本次問題；
+        沒有 ID 或上游拒絕（例如已過期）時，改由本地歷史重建對話後送出。
+        """
         history = conversation_manager.get_history(request.session_id)
         if not history:
             return "對話紀錄為空，無法回答問題。"
 
-        # 構建傳送給模型的對話歷史 
         try:
             answer_system_prompt = get_prompt("math.answer_question_system", default="你是一位專業的數學教師...")
         except ValueError as e:
             raise HTTPException(status_code=500, detail=f"缺少提示詞配置: {str(e)}")
-        messages_for_api = [
-            {"role": "developer", "content": [{"type": "input_text", "text": answer_system_prompt}]}
-        ]
+
+        # 本次問題
+        current_question_text = request.question
+        if request.step_number:
+            last_solution = conversation_manager.get_last_solution(request.session_id)
+            if last_solution and 1 <= request.step_number <= len(last_solution.steps):
+                step = last_solution.steps[request.step_number - 1]
+                current_question_text += f" (針對步驟 {request.step_number}：'{step.description}')"
+        question_message = {"role": "user", "content": [{"type": "input_text", "text": current_question_text}]}
+
+        try:
+            resp = None
+            previous_response_id = conversation_manager.get_last_response_id(request.session_id)
+            if previous_response_id:
+                try:
+                    # 上游已保存之前的輸入、解答與推理內容；instructions 不會沿用，需每次帶上
+                    resp = await llm_clients.for_model(self.model).responses.create(
+                        model=self.model,
+                        instructions=answer_system_prompt,
+                        input=[question_message],
+                        previous_response_id=previous_response_id,
+                        store=True,
+                        max_output_tokens=3000,
+                    )
+                except (openai.BadRequestError, openai.NotFoundError) as e:
+                    print(f"previous_response_id {previous_response_id} 無法使用，改用本地歷史: {e}")
+            if resp is None:
+                resp = await llm_clients.for_model(self.model).responses.create(
+                    model=self.model,
+                    input=self._history_messages(answer_system_prompt, history) + [question_message],
+                    store=True,
+                    max_output_tokens=3000,
+                )
+            response = getattr(resp, "output_text", None)
+            if not response:
+                raise HTTPException(status_code=500, detail="AI 未能生成回答")
+            
+            conversation_manager.add_messages(request.session_id, [
+                {"role": "user", "content": request},
+                {"role": "assistant", "content": {"answer": response}, "response_id": getattr(resp, "id", None)},
+            ])
+            
+            return response
+            
+        except Exception as e:
+            print(f"Error in answer_question: {e}")
+            raise HTTPException(status_code=500, detail="回答問題時發生錯誤")
+
+    @classmethod
+    def _history_messages(cls, system_prompt: str, history: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """由本地對話紀錄重建傳送給模型的對話（無法接續上游回應時使用）"""
+        return [
+            {"role": "developer", "content": [{"type": "input_text", "text": system_prompt}]}
+        ] + cls._history_turns(history)
+
+    @staticmethod
+    def _history_turns(history: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """把本地對話紀錄轉成 Responses API 的輸入訊息"""
+        messages_for_api = []
         
         for msg in history:
             role = msg.get("role")
@@ -564,35 +983,7 @@ class MathSolver:
             api_role = "user" if role == "user" else "assistant"
             if text:
                  messages_for_api.append({"role": api_role, "content": [{"type": "input_text", "text": text}]})
-
-        # 添加當前問題
-        current_question_text = request.question
-        if request.step_number:
-            last_solution = conversation_manager.get_last_solution(request.session_id)
-            if last_solution and 1 <= request.step_number <= len(last_solution.steps):
-                step = last_solution.steps[request.step_number - 1]
-                current_question_text += f" (針對步驟 {request.step_number}：'{step.description}')"
-        
-        messages_for_api.append({"role": "user", "content": [{"type": "input_text", "text": current_question_text}]})
-        
-        try:
-            resp = await client.responses.create(
-                model=self.model,
-                input=messages_for_api,
-                max_output_tokens=3000,
-            )
-            response = getattr(resp, "output_text", None)
-            if not response:
-                raise HTTPException(status_code=500, detail="AI 未能生成回答")
-            
-            conversation_manager.add_message(request.session_id, "user", request)
-            conversation_manager.add_message(request.session_id, "assistant", {"answer": response})
-            
-            return response
-            
-        except Exception as e:
-            print(f"Error in answer_question: {e}")
-            raise HTTPException(status_code=500, detail="回答問題時發生錯誤")
+        return messages_for_api
 
     async def _check_problem_clarity(self, problem_text: str) -> ProblemClarityResponse:
         """(重構) 檢查數學問題描述是否清楚明確"""
@@ -608,7 +999,7 @@ class MathSolver:
         ]
 
         try:
-            resp = await client.responses.create(
+            resp = await llm_clients.for_model(self.model).responses.create(
                 model=self.model,
                 input=messages,
                 text={
@@ -659,4 +1050,11 @@ def list_conversations() -> List[ConversationInfo]:
     列出所有對話紀錄。
     (此函式是對 conversation.py 的轉發，讓 math_api.py 方便導入)
     """
-    return list_conversations_from_db()
\ No newline at end of file
+    return list_conversations_from_db()
+
+def list_conversations_page(cursor: Optional[str] = None, limit: Optional[int] = None) -> Tuple[List[ConversationInfo], Optional[str]]:
+    """
+    分頁列出對話紀錄，回傳 (infos, next_cursor)。
+    (轉發 conversation.py，讓 math_api.py 方便導入)
+    """
+    return list_conversations_page_from_db(cursor=cursor, limit=limit)
\ No newline at end of file
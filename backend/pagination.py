@@ -0,0 +1,103 @@
+import json
+import base64
+import bisect
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+
+SortKey = Tuple[str, str]
+
+
+def encode_cursor(data: Dict[str, Any]) -> str:
+    """將分頁位置編碼為不透明字串（URL 安全的 base64）"""
+    raw = json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: Optional[str]) -> Optional[Dict[str, Any]]:
+    """解碼 cursor；空值回傳 None，格式錯誤時拋出 ValueError"""
+    if not cursor:
+        return None
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        data = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")).decode("utf-8"))
+    except Exception as e:
+        raise ValueError(f"無效的 cursor: {e}")
+    if not isinstance(data, dict):
+        raise ValueError("無效的 cursor")
+    return data
+
+
+def key_cursor(key: SortKey) -> str:
+    """以 (updated_at, sid) 建立 cursor"""
+    return encode_cursor({"u": key[0], "s": key[1]})
+
+
+def cursor_key(data: Optional[Dict[str, Any]]) -> Optional[SortKey]:
+    """從解碼後的 cursor 取出 (updated_at, sid)"""
+    if not data or "s" not in data:
+        return None
+    return str(data.get("u") or ""), str(data["s"])
+
+
+class SortedKeyIndex:
+    """以 (updated_at, sid) 排序的次級索引，支援由新到舊的 keyset 分頁。
+
+    以 bisect 維護排序陣列：更新為 O(log n) 搜尋加上一次陣列搬移，
+    取一頁只需定位 cursor 後往前讀 limit 筆。
+    """
+
+    def __init__(self):
+        self._keys: List[SortKey] = []
+        self._by_sid: Dict[str, SortKey] = {}
+        self._lock = threading.RLock()
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def __contains__(self, sid: str) -> bool:
+        return sid in self._by_sid
+
+    def upsert(self, sid: str, updated_at: Optional[str]) -> None:
+        key = (updated_at or "", sid)
+        with self._lock:
+            old = self._by_sid.get(sid)
+            if old == key:
+                return
+            if old is not None:
+                self._remove_key(old)
+            bisect.insort(self._keys, key)
+            self._by_sid[sid] = key
+
+    def remove(self, sid: str) -> None:
+        with self._lock:
+            old = self._by_sid.pop(sid, None)
+            if old is not None:
+                self._remove_key(old)
+
+    def _remove_key(self, key: SortKey) -> None:
+        pos = bisect.bisect_left(self._keys, key)
+        if pos < len(self._keys) and self._keys[pos] == key:
+            del self._keys[pos]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._keys.clear()
+            self._by_sid.clear()
+
+    def page(
+        self,
+        after: Optional[SortKey] = None,
+        limit: Optional[int] = None,
+        accept: Optional[Callable[[str], bool]] = None,
+    ) -> List[str]:
+        """由新到舊回傳 sid；after 為上一頁最後一筆的 key（不含），accept 用於額外篩選"""
+        with self._lock:
+            pos = len(self._keys) if after is None else bisect.bisect_left(self._keys, after)
+            result: List[str] = []
+            while pos > 0 and (limit is None or len(result) < limit):
+                pos -= 1
+                sid = self._keys[pos][1]
+                if accept is None or accept(sid):
+                    result.append(sid)
+            return result
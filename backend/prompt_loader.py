@@ -1,9 +1,12 @@
 import os
 import json
+import hashlib
 from typing import Any, Dict, Optional
 
 _PROMPTS_CACHE: Dict[str, Any] = {}
 _PROMPTS_MTIME: Optional[float] = None
+# dot-path -> 提示詞內容的雜湊；提示詞重新載入時清空
+_PROMPT_VERSIONS: Dict[str, str] = {}
 
 def _get_prompts_path() -> str:
     base_dir = os.path.dirname(__file__)
@@ -11,7 +14,7 @@ def _get_prompts_path() -> str:
     return path
 
 def _load_prompts_if_changed() -> None:
-    global _PROMPTS_CACHE, _PROMPTS_MTIME
+    global _PROMPTS_CACHE, _PROMPTS_MTIME, _PROMPT_VERSIONS
     path = _get_prompts_path()
     try:
         mtime = os.path.getmtime(path)
@@ -19,10 +22,12 @@ def _load_prompts_if_changed() -> None:
             with open(path, 'r', encoding='utf-8') as f:
                 _PROMPTS_CACHE = json.load(f)
             _PROMPTS_MTIME = mtime
+            _PROMPT_VERSIONS = {}
     except FileNotFoundError:
         # 若找不到檔案，保持快取為空，呼叫者可提供 default
         _PROMPTS_CACHE = {}
         _PROMPTS_MTIME = None
+        _PROMPT_VERSIONS = {}
 
 def get_prompts() -> Dict[str, Any]:
     _load_prompts_if_changed()
@@ -36,6 +41,20 @@ def _get_by_path(data: Dict[str, Any], path: str) -> Optional[Any]:
         cur = cur[part]
     return cur
 
+def get_prompt_version(path: str) -> str:
+    """提示詞（dot-path 指向的字串或整個區段）的版本雜湊，供快取鍵使用。
+
+    每次載入提示詞檔後只計算一次，檔案修改後自動重新計算。
+    """
+    _load_prompts_if_changed()
+    version = _PROMPT_VERSIONS.get(path)
+    if version is None:
+        value = _get_by_path(_PROMPTS_CACHE, path)
+        payload = json.dumps(value, ensure_ascii=False, sort_keys=True)
+        version = hashlib.sha256(payload.encode("utf-8")).hexdigest()
+        _PROMPT_VERSIONS[path] = version
+    return version
+
 def get_prompt(path: str, default: Optional[str] = None, **kwargs: Any) -> str:
     """取得提示詞字串，支援 dot-path 與 format 參數替換。
 
@@ -0,0 +1,217 @@
+import os
+import json
+import time
+import asyncio
+import hashlib
+import sqlite3
+import threading
+from typing import Any, Dict, Optional
+
+from lru import LRUCache
+from write_behind import write_queue
+
+
+# 快取資料庫位置與預設參數（皆可由環境變數調整）
+RESPONSE_CACHE_DB = os.getenv("RESPONSE_CACHE_DB", os.path.join("cache", "response_cache.db"))
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", str(30 * 24 * 3600)))
+RESPONSE_CACHE_MEMORY_ENTRIES = int(os.getenv("RESPONSE_CACHE_MEMORY_ENTRIES", "1024"))
+RESPONSE_CACHE_MAX_ROWS = int(os.getenv("RESPONSE_CACHE_MAX_ROWS", "50000"))
+
+
+def collapse_whitespace(text: str) -> str:
+    """去除頭尾空白並合併連續空白，保留大小寫（數學題中 A 與 a、P(A) 與 p(a) 意義不同）"""
+    return " ".join((text or "").split())
+
+
+def normalize_text(text: str) -> str:
+    """快取鍵用的正規化：去除頭尾空白、合併連續空白、不分大小寫"""
+    return collapse_whitespace(text).casefold()
+
+
+def hash_text(text: str) -> str:
+    return hashlib.sha256((text or "").encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """LLM 回應的兩層快取：記憶體 LRU + SQLite（WAL）。
+
+    - get：先查記憶體，再查 SQLite（命中後提升到記憶體）；過期的項目視為未命中
+    - aget：非同步版本，記憶體未命中時在執行緒中查詢 SQLite，不阻塞事件迴圈（請求處理一律使用）
+    - set：立即寫入記憶體，SQLite 寫入交給背景寫入執行緒
+    - 超過 max_rows 時依最後存取時間淘汰；purge 供管理端清除
+    鍵由呼叫端以 make_key(namespace, ...) 組成，namespace 用於分組統計與清除。
+    """
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS response_cache (
+        key TEXT PRIMARY KEY,
+        namespace TEXT NOT NULL,
+        value TEXT NOT NULL,
+        created_at REAL NOT NULL,
+        expires_at REAL NOT NULL,
+        last_access REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_response_cache_namespace ON response_cache (namespace);
+    CREATE INDEX IF NOT EXISTS idx_response_cache_last_access ON response_cache (last_access);
+    """
+
+    def __init__(
+        self,
+        db_path: str = RESPONSE_CACHE_DB,
+        ttl: float = RESPONSE_CACHE_TTL,
+        memory_entries: int = RESPONSE_CACHE_MEMORY_ENTRIES,
+        max_rows: int = RESPONSE_CACHE_MAX_ROWS,
+    ):
+        self.db_path = db_path
+        self.ttl = ttl
+        self.max_rows = max_rows
+        # key -> (value, expires_at)
+        self._memory = LRUCache(max_entries=memory_entries)
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.RLock()
+        self._writes_since_evict = 0
+        self._counters: Dict[str, Dict[str, int]] = {}
+
+    # --- 連線 ---
+    def _db(self) -> sqlite3.Connection:
+        with self._lock:
+            if self._conn is None:
+                os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+                self._conn = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None)
+                self._conn.execute("PRAGMA journal_mode=WAL")
+                self._conn.execute("PRAGMA synchronous=NORMAL")
+                self._conn.executescript(self.SCHEMA)
+            return self._conn
+
+    # --- 鍵與統計 ---
+    @staticmethod
+    def make_key(namespace: str, *parts: Any) -> str:
+        digest = hashlib.sha256(json.dumps(parts, ensure_ascii=False, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+        return f"{namespace}:{digest}"
+
+    @staticmethod
+    def _namespace(key: str) -> str:
+        return key.split(":", 1)[0]
+
+    def _count(self, key: str, field: str) -> None:
+        with self._lock:
+            counters = self._counters.setdefault(self._namespace(key), {"memory_hits": 0, "disk_hits": 0, "misses": 0, "sets": 0})
+            counters[field] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            counters = {ns: dict(c) for ns, c in self._counters.items()}
+            rows = self._db().execute(
+                "SELECT namespace, COUNT(*), SUM(LENGTH(value)) FROM response_cache GROUP BY namespace"
+            ).fetchall()
+        return {
+            "memory_entries": len(self._memory),
+            "disk": {ns: {"entries": count, "bytes": size or 0} for ns, count, size in rows},
+            "counters": counters,
+        }
+
+    # --- 讀寫 ---
+    def _get_memory(self, key: str, now: float) -> Optional[Any]:
+        item = self._memory.get(key)
+        if item is not None:
+            value, expires_at = item
+            if expires_at > now:
+                self._count(key, "memory_hits")
+                return value
+            self._memory.pop(key)
+        return None
+
+    def get(self, key: str) -> Optional[Any]:
+        now = time.time()
+        value = self._get_memory(key, now)
+        if value is not None:
+            return value
+        return self._get_stored(key, now)
+
+    async def aget(self, key: str) -> Optional[Any]:
+        now = time.time()
+        value = self._get_memory(key, now)
+        if value is not None:
+            return value
+        return await asyncio.to_thread(self._get_stored, key, now)
+
+    def _get_stored(self, key: str, now: float) -> Optional[Any]:
+        """查詢 SQLite 層；命中時提升到記憶體並登記背景更新存取時間"""
+        try:
+            with self._lock:
+                row = self._db().execute(
+                    "SELECT value, expires_at FROM response_cache WHERE key = ?", (key,)
+                ).fetchone()
+        except sqlite3.Error as e:
+            print(f"讀取回應快取失敗: {e}")
+            row = None
+        if row is None or row[1] <= now:
+            self._count(key, "misses")
+            return None
+        value = json.loads(row[0])
+        self._memory.put(key, (value, row[1]))
+        self._count(key, "disk_hits")
+        write_queue.submit(("response_cache", key, "touch"), self._touch, key, now)
+        return value
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        now = time.time()
+        expires_at = now + (self.ttl if ttl is None else ttl)
+        self._memory.put(key, (value, expires_at))
+        self._count(key, "sets")
+        payload = json.dumps(value, ensure_ascii=False, default=str)
+        write_queue.submit(("response_cache", key), self._write, key, payload, now, expires_at)
+
+    def _write(self, key: str, payload: str, now: float, expires_at: float) -> None:
+        """寫入 SQLite（由寫入執行緒呼叫）"""
+        with self._lock:
+            self._db().execute(
+                "INSERT OR REPLACE INTO response_cache (key, namespace, value, created_at, expires_at, last_access) VALUES (?, ?, ?, ?, ?, ?)",
+                (key, self._namespace(key), payload, now, expires_at, now)
+            )
+            self._writes_since_evict += 1
+            if self._writes_since_evict >= 100:
+                self._writes_since_evict = 0
+                self._evict()
+
+    def _touch(self, key: str, now: float) -> None:
+        with self._lock:
+            self._db().execute("UPDATE response_cache SET last_access = ? WHERE key = ?", (now, key))
+
+    def _evict(self) -> None:
+        """刪除過期項目；仍超過 max_rows 時刪除最久未存取的項目"""
+        conn = self._db()
+        conn.execute("DELETE FROM response_cache WHERE expires_at <= ?", (time.time(),))
+        count = conn.execute("SELECT COUNT(*) FROM response_cache").fetchone()[0]
+        if count > self.max_rows:
+            conn.execute(
+                "DELETE FROM response_cache WHERE key IN (SELECT key FROM response_cache ORDER BY last_access LIMIT ?)",
+                (count - self.max_rows,)
+            )
+
+    def purge(self, namespace: Optional[str] = None, expired_only: bool = False) -> int:
+        """清除快取（可限定 namespace 或只清除過期項目），回傳刪除的 SQLite 列數"""
+        # 先讓尚未落盤的寫入完成，避免清除後又被寫回
+        write_queue.flush()
+        clauses, params = [], []
+        if namespace:
+            clauses.append("namespace = ?")
+            params.append(namespace)
+        if expired_only:
+            clauses.append("expires_at <= ?")
+            params.append(time.time())
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        with self._lock:
+            deleted = self._db().execute(f"DELETE FROM response_cache {where}", params).rowcount
+            now = time.time()
+            for key, (_, expires_at) in self._memory.items():
+                if namespace and self._namespace(key) != namespace:
+                    continue
+                if expired_only and expires_at > now:
+                    continue
+                self._memory.pop(key)
+        return deleted
+
+
+# 全域實例：英文查詢與數學解題共用，以 namespace 區分
+response_cache = ResponseCache()
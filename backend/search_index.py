@@ -0,0 +1,273 @@
+import os
+import re
+import json
+import math
+import zlib
+import heapq
+import bisect
+import threading
+from collections import Counter
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from storage_utils import atomic_write_bytes, DebouncedFlusher
+
+
+# 英文單字（含數字）與連續的 CJK 字元
+_TOKEN_RE = re.compile(r"[a-z0-9]+|[\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff]+")
+_CJK_RE = re.compile(r"[\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff]")
+
+# 助理結構化回覆中要納入索引的欄位
+INDEXED_FIELDS = ("ai_response", "hint", "translation")
+# 標題 / 主題命中的權重（相當於在內文出現幾次）
+META_WEIGHT = 2
+# BM25 參數
+BM25_K1 = 1.2
+BM25_B = 0.75
+# 查詢詞也比對以它開頭的索引詞（如 "rest" → "restaurant"）；每個查詢詞最多展開的索引詞數
+PREFIX_MAX_EXPANSIONS = 50
+
+
+def tokenize(text: str) -> List[str]:
+    """英文以單字切分（轉小寫），中文以相鄰兩字（bigram）切分；單一中文字保留原字"""
+    tokens: List[str] = []
+    for match in _TOKEN_RE.findall((text or "").lower()):
+        if _CJK_RE.match(match):
+            if len(match) == 1:
+                tokens.append(match)
+            else:
+                tokens.extend(match[i:i + 2] for i in range(len(match) - 1))
+        else:
+            tokens.append(match)
+    return tokens
+
+
+def message_text(message: Dict[str, Any]) -> str:
+    """取出訊息中可搜尋的文字（略過 system 訊息）"""
+    if message.get("role") not in ("user", "assistant"):
+        return ""
+    content = message.get("content")
+    if isinstance(content, str):
+        return content
+    if isinstance(content, dict):
+        return " ".join(str(content[k]) for k in INDEXED_FIELDS if content.get(k))
+    if isinstance(content, list):
+        return " ".join(part.get("text", "") for part in content if isinstance(part, dict))
+    return ""
+
+
+class SearchIndex:
+    """英文對話的增量倒排索引。
+
+    - postings：term -> {sid: 加權詞頻}，查詢只走訪查詢詞的倒排列表，不掃描全部對話
+    - 排序過的詞表供前綴比對（以 bisect 查找），詞彙增減時以 insort / 刪除逐一維護，不在查詢時重新排序
+    - 每次保存只對新增的訊息做斷詞；標題 / 主題變更時替換其貢獻
+    - 以 zlib 壓縮的 JSON 持久化（只存每個對話的詞頻，倒排列表於載入時重建）
+    """
+
+    def __init__(self, index_file: str, flush_delay: float = 2.0):
+        self.index_file = index_file
+        # sid -> {"n": 已索引訊息數, "l": 內文詞數, "t": 內文詞頻, "m": 標題/主題詞頻}
+        self._docs: Dict[str, Dict[str, Any]] = {}
+        self._postings: Dict[str, Dict[str, int]] = {}
+        # 排序後的詞表（前綴比對用）；None 只出現在整批載入 / 重建期間，結束時一次排序
+        self._sorted_terms: Optional[List[str]] = []
+        self._total_len = 0
+        self._lock = threading.RLock()
+        self._flusher = DebouncedFlusher(self._write, delay=flush_delay)
+        self.loaded = self._load()
+
+    # --- 持久化 ---
+    def _load(self) -> bool:
+        if not os.path.exists(self.index_file):
+            return False
+        try:
+            with open(self.index_file, 'rb') as f:
+                data = json.loads(zlib.decompress(f.read()).decode("utf-8"))
+            self._sorted_terms = None
+            for sid, doc in data.get("docs", {}).items():
+                self._docs[sid] = doc
+                self._add_postings(sid, doc)
+            self._sorted_terms = sorted(self._postings)
+            return True
+        except Exception as e:
+            print(f"讀取搜尋索引失敗，將重建: {e}")
+            self._docs.clear()
+            self._postings.clear()
+            self._sorted_terms = []
+            self._total_len = 0
+            return False
+
+    def _write(self) -> None:
+        with self._lock:
+            payload = json.dumps({"docs": self._docs}, ensure_ascii=False, separators=(",", ":"))
+        atomic_write_bytes(self.index_file, zlib.compress(payload.encode("utf-8"), 6))
+
+    def flush(self) -> None:
+        self._flusher.flush()
+
+    # --- 倒排列表維護 ---
+    @staticmethod
+    def _doc_len(doc: Dict[str, Any]) -> int:
+        return doc["l"] + META_WEIGHT * sum(doc["m"].values())
+
+    def _add_postings(self, sid: str, doc: Dict[str, Any], sign: int = 1) -> None:
+        weights = Counter(doc["t"])
+        for term, tf in doc["m"].items():
+            weights[term] += META_WEIGHT * tf
+        for term, tf in weights.items():
+            self._bump(term, sid, sign * tf)
+        self._total_len += sign * self._doc_len(doc)
+
+    def _bump(self, term: str, sid: str, delta: int) -> None:
+        posting = self._postings.get(term)
+        if posting is None:
+            posting = self._postings[term] = {}
+            if self._sorted_terms is not None:
+                bisect.insort(self._sorted_terms, term)
+        value = posting.get(sid, 0) + delta
+        if value > 0:
+            posting[sid] = value
+        else:
+            posting.pop(sid, None)
+            if not posting:
+                del self._postings[term]
+                if self._sorted_terms is not None:
+                    i = bisect.bisect_left(self._sorted_terms, term)
+                    if i < len(self._sorted_terms) and self._sorted_terms[i] == term:
+                        del self._sorted_terms[i]
+
+    def _term_posting(self, term: str) -> Optional[Dict[str, int]]:
+        """查詢詞的倒排列表：完全相同的詞加上以它開頭的詞（合併詞頻）；都沒有時回傳 None"""
+        terms = self._sorted_terms
+        start = bisect.bisect_left(terms, term)
+        matched = []
+        for candidate in terms[start:start + PREFIX_MAX_EXPANSIONS]:
+            if not candidate.startswith(term):
+                break
+            matched.append(candidate)
+        if not matched:
+            return None
+        if len(matched) == 1:
+            return self._postings[matched[0]]
+        merged: Dict[str, int] = {}
+        for candidate in matched:
+            for sid, tf in self._postings[candidate].items():
+                merged[sid] = merged.get(sid, 0) + tf
+        return merged
+
+    def update(self, sid: str, messages: List[Dict[str, Any]], metadata: Dict[str, Any]) -> None:
+        """索引新增的訊息並更新標題 / 主題；歷史被截短時整份重建"""
+        with self._lock:
+            self._update_locked(sid, messages, metadata)
+        self._flusher.schedule()
+
+    def _update_locked(self, sid: str, messages: List[Dict[str, Any]], metadata: Dict[str, Any]) -> None:
+        doc = self._docs.get(sid)
+        if doc is not None and len(messages) < doc["n"]:
+            self._remove_locked(sid)
+            doc = None
+        if doc is None:
+            doc = {"n": 0, "l": 0, "t": {}, "m": {}}
+            self._docs[sid] = doc
+
+        body = Counter()
+        for message in messages[doc["n"]:]:
+            body.update(tokenize(message_text(message)))
+        doc["n"] = len(messages)
+        for term, tf in body.items():
+            doc["t"][term] = doc["t"].get(term, 0) + tf
+            self._bump(term, sid, tf)
+        added = sum(body.values())
+        doc["l"] += added
+        self._total_len += added
+
+        meta = dict(Counter(tokenize(f"{metadata.get('title') or ''} {metadata.get('topic') or ''}")))
+        if meta != doc["m"]:
+            for term, tf in doc["m"].items():
+                self._bump(term, sid, -META_WEIGHT * tf)
+            for term, tf in meta.items():
+                self._bump(term, sid, META_WEIGHT * tf)
+            self._total_len += META_WEIGHT * (sum(meta.values()) - sum(doc["m"].values()))
+            doc["m"] = meta
+
+    def _remove_locked(self, sid: str) -> None:
+        doc = self._docs.pop(sid, None)
+        if doc is not None:
+            self._add_postings(sid, doc, sign=-1)
+
+    def indexed_count(self, sid: str) -> Optional[int]:
+        """已索引的訊息數；尚未索引時回傳 None"""
+        with self._lock:
+            doc = self._docs.get(sid)
+            return doc["n"] if doc is not None else None
+
+    def sids(self) -> List[str]:
+        with self._lock:
+            return list(self._docs)
+
+    def remove(self, sid: str) -> None:
+        with self._lock:
+            self._remove_locked(sid)
+        self._flusher.schedule()
+
+    def rebuild(self, conversations: Iterable[Tuple[str, List[Dict[str, Any]], Dict[str, Any]]]) -> int:
+        """從 (sid, messages, metadata) 重建整份索引，回傳對話數"""
+        with self._lock:
+            self._docs.clear()
+            self._postings.clear()
+            self._sorted_terms = None
+            self._total_len = 0
+            count = 0
+            for sid, messages, metadata in conversations:
+                self._update_locked(sid, messages, metadata)
+                count += 1
+            self._sorted_terms = sorted(self._postings)
+        self.flush()
+        return count
+
+    def __contains__(self, sid: str) -> bool:
+        return sid in self._docs
+
+    def __len__(self) -> int:
+        return len(self._docs)
+
+    # --- 查詢 ---
+    def search(
+        self,
+        query: str,
+        limit: int = 10,
+        offset: int = 0,
+        accept: Optional[Callable[[str], bool]] = None,
+    ) -> List[Tuple[str, float]]:
+        """回傳依 BM25 分數排序的 [(sid, score)]；所有查詢詞都必須出現（AND），查詢詞可以是單字的開頭。
+
+        從最短的倒排列表開始交集，只計算候選對話的分數，並以 heap 取前 offset+limit 筆。
+        accept 可用於套用主題 / 等級等額外條件。
+        """
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not terms or limit <= 0:
+            return []
+        with self._lock:
+            postings = [self._term_posting(term) for term in terms]
+            if any(p is None for p in postings):
+                return []
+            postings.sort(key=len)
+            n_docs = len(self._docs)
+            avg_len = (self._total_len / n_docs) if n_docs else 1.0
+            idf = [math.log(1 + (n_docs - len(p) + 0.5) / (len(p) + 0.5)) for p in postings]
+
+            def scored():
+                for sid in postings[0]:
+                    if any(sid not in p for p in postings[1:]):
+                        continue
+                    if accept is not None and not accept(sid):
+                        continue
+                    norm = BM25_K1 * (1 - BM25_B + BM25_B * self._doc_len(self._docs[sid]) / (avg_len or 1.0))
+                    score = 0.0
+                    for p, w in zip(postings, idf):
+                        tf = p[sid]
+                        score += w * tf * (BM25_K1 + 1) / (tf + norm)
+                    yield score, sid
+
+            top = heapq.nlargest(offset + limit, scored())
+        return [(sid, round(score, 4)) for score, sid in top[offset:]]
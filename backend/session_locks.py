@@ -0,0 +1,97 @@
+import os
+import time
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional
+
+
+# 一輪對話的最長佔用時間（秒）；逾時的佔用視為失效，避免連線中斷後永遠鎖住
+TURN_LEASE_SECONDS = float(os.getenv("ENGLISH_TURN_LEASE_SECONDS", "120"))
+
+
+class ConversationBusy(Exception):
+    """同一對話已有另一輪正在進行"""
+
+    def __init__(self, sid: str):
+        super().__init__(f"Conversation {sid} already has a turn in progress.")
+        self.sid = sid
+
+
+class ConversationConflict(Exception):
+    """提交時版本不符（期間有其他寫入）"""
+
+    def __init__(self, sid: str, expected: int, actual: int):
+        super().__init__(f"Conversation {sid} was modified concurrently (expected version {expected}, found {actual}).")
+        self.sid = sid
+        self.expected = expected
+        self.actual = actual
+
+
+class _Shard:
+    __slots__ = ("lock", "leases")
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        # sid -> (租約編號, 到期時間)
+        self.leases: Dict[str, tuple] = {}
+
+
+class SessionLockManager:
+    """以 sid 雜湊分片的鎖管理器。
+
+    - locked(sid)：短暫的臨界區（讀取版本、追加訊息、保存），同一分片內序列化
+    - begin_turn / end_turn：整輪對話（含 LLM 呼叫）的佔用租約；同一 sid 同時只允許一輪，
+      第二個請求立即以 ConversationBusy 拒絕，而不是長時間持有分片鎖
+    鎖同時適用於事件迴圈與執行緒池中的串流產生器。
+    """
+
+    def __init__(self, shards: int = 64, lease_seconds: float = TURN_LEASE_SECONDS):
+        self._shards: List[_Shard] = [_Shard() for _ in range(shards)]
+        self.lease_seconds = lease_seconds
+        self._next_token = 0
+        self._token_lock = threading.Lock()
+
+    def _shard(self, sid: str) -> _Shard:
+        return self._shards[hash(sid) % len(self._shards)]
+
+    @contextmanager
+    def locked(self, sid: str) -> Iterator[None]:
+        shard = self._shard(sid)
+        with shard.lock:
+            yield
+
+    def begin_turn(self, sid: str) -> int:
+        """取得整輪對話的租約，回傳租約編號；已被佔用時拋出 ConversationBusy"""
+        shard = self._shard(sid)
+        now = time.monotonic()
+        with shard.lock:
+            lease = shard.leases.get(sid)
+            if lease is not None and lease[1] > now:
+                raise ConversationBusy(sid)
+            with self._token_lock:
+                self._next_token += 1
+                token = self._next_token
+            shard.leases[sid] = (token, now + self.lease_seconds)
+            return token
+
+    def end_turn(self, sid: str, token: Optional[int]) -> None:
+        """釋放租約（只釋放自己的，逾時後被他人取得的租約不受影響）"""
+        if token is None:
+            return
+        shard = self._shard(sid)
+        with shard.lock:
+            lease = shard.leases.get(sid)
+            if lease is not None and lease[0] == token:
+                del shard.leases[sid]
+
+    @contextmanager
+    def turn(self, sid: str) -> Iterator[int]:
+        token = self.begin_turn(sid)
+        try:
+            yield token
+        finally:
+            self.end_turn(sid, token)
+
+
+# 全域實例：英文對話的 next_turn 與串流端點共用
+session_locks = SessionLockManager()
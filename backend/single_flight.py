@@ -0,0 +1,45 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+
+class SingleFlight:
+    """合併同時進行中的相同請求（single-flight）。
+
+    第一個呼叫者（leader）以背景 task 執行上游呼叫，之後帶相同鍵的呼叫者（follower）
+    直接等待同一個 task 的結果或例外；task 完成後鍵即移除，之後的請求會重新呼叫上游
+    （通常已由快取命中）。任一等待者被取消都不會中斷 task，其他等待者仍可取得結果。
+    鍵應包含所有影響結果的參數（文字、模型、提示詞版本等）。
+    """
+
+    def __init__(self):
+        self._calls: Dict[Hashable, asyncio.Task] = {}
+        self.leaders = 0
+        self.followers = 0
+
+    async def do(self, key: Hashable, fn: Callable[..., Awaitable[Any]], *args: Any, **kwargs: Any) -> Any:
+        task = self._calls.get(key)
+        if task is None:
+            self.leaders += 1
+            task = asyncio.ensure_future(fn(*args, **kwargs))
+            self._calls[key] = task
+            task.add_done_callback(lambda t, key=key: self._done(key, t))
+        else:
+            self.followers += 1
+        return await asyncio.shield(task)
+
+    def _done(self, key: Hashable, task: asyncio.Task) -> None:
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        # 所有等待者都已取消時，避免出現 "exception was never retrieved" 警告
+        if not task.cancelled():
+            task.exception()
+
+    def in_flight(self) -> int:
+        return len(self._calls)
+
+    def stats(self) -> Dict[str, int]:
+        return {"in_flight": len(self._calls), "leaders": self.leaders, "followers": self.followers}
+
+
+# 全域實例：英文 TTS / 查詢與數學解題共用，以鍵的第一個元素區分功能
+single_flight = SingleFlight()
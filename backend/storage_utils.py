@@ -0,0 +1,80 @@
+import os
+import json
+import time
+import threading
+from typing import Any, Callable, Optional
+
+
+def atomic_write_json(path: str, data: Any) -> None:
+    """先寫入暫存檔再改名，避免讀取端看到寫到一半的檔案"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, separators=(",", ":"))
+    os.replace(tmp_path, path)
+
+
+def atomic_write_bytes(path: str, data: bytes) -> None:
+    """atomic_write_json 的二進位版本"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+class DebouncedFlusher:
+    """去抖動的背景寫入：多次 schedule() 合併成一次 flush_fn。
+
+    靜止 delay 秒後寫入；持續有變更時最晚在第一次變更後 max_delay 秒也會寫入，
+    不會因為變更頻繁而一直延後。所有等待由同一條常駐的背景執行緒負責（第一次 schedule 時啟動）。
+    """
+
+    def __init__(self, flush_fn: Callable[[], None], delay: float = 1.0, max_delay: Optional[float] = None):
+        self._flush_fn = flush_fn
+        self.delay = delay
+        self.max_delay = max_delay if max_delay is not None else delay * 2
+        self._cond = threading.Condition()
+        # 尚未寫入的第一次 / 最後一次變更時間（monotonic）；None 表示沒有待寫入的變更
+        self._first_change: Optional[float] = None
+        self._last_change: Optional[float] = None
+        self._thread: Optional[threading.Thread] = None
+        # 確保同一時間只有一個寫入在進行
+        self._flush_lock = threading.Lock()
+
+    def schedule(self) -> None:
+        with self._cond:
+            now = time.monotonic()
+            if self._first_change is None:
+                self._first_change = now
+            self._last_change = now
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="debounced-flusher", daemon=True)
+                self._thread.start()
+            self._cond.notify()
+
+    def _due(self) -> Optional[float]:
+        if self._first_change is None:
+            return None
+        return min(self._last_change + self.delay, self._first_change + self.max_delay)
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                due = self._due()
+                while due is None or time.monotonic() < due:
+                    self._cond.wait(None if due is None else due - time.monotonic())
+                    due = self._due()
+                self._first_change = self._last_change = None
+            self._write()
+
+    def _write(self) -> None:
+        with self._flush_lock:
+            try:
+                self._flush_fn()
+            except Exception as e:
+                print(f"背景寫入失敗: {e}")
+
+    def flush(self) -> None:
+        """立即寫入（供關閉流程與測試使用）"""
+        with self._cond:
+            self._first_change = self._last_change = None
+        self._write()
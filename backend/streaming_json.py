@@ -0,0 +1,171 @@
+import json
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+# 已完成的值：(路徑, 值)；路徑由物件鍵與陣列索引組成，例如 ("steps", 0)
+Completed = Tuple[Tuple[Any, ...], Any]
+# 解析事件：("value", 路徑, 值) 或 ("delta", 路徑, 新增的字串內容)
+Event = Tuple[str, Tuple[Any, ...], Any]
+
+_WHITESPACE = " \t\r\n"
+
+
+class IncrementalJSONParser:
+    """逐段餵入 JSON 文字，在每個值（字串、數字、物件、陣列……）完整時立即回報。
+
+    只解析結構位置，不等待整份文件；路徑深度不超過 max_depth 的值完成時才會 json.loads
+    （例如 max_depth=2 時回報頂層欄位與頂層陣列的每個元素），根節點完成時以路徑 () 回報。
+    stream_paths 中的字串欄位另外以 feed_events 回報逐段解碼後的新增內容（delta），
+    不會在跳脫序列或 UTF-16 代理對的中間切開。
+    輸入不是合法 JSON 時行為未定義，呼叫端應以最後的 json.loads 結果為準。
+    """
+
+    def __init__(self, max_depth: int = 2, stream_paths: Iterable[Tuple[Any, ...]] = ()):
+        self.max_depth = max_depth
+        self.stream_paths = set(stream_paths)
+        self._text = ""
+        self._pos = 0
+        # 容器堆疊：{"kind": "object" | "array", "start", "path", "key", "expect", "index"}
+        self._stack: List[Dict[str, Any]] = []
+        self._string_start: Optional[int] = None
+        self._string_is_key = False
+        self._escape = False
+        self._scalar_start: Optional[int] = None
+        # 串流字串欄位：目前的路徑、已送出的原始位置、未完成跳脫序列的起點
+        self._delta_path: Optional[Tuple[Any, ...]] = None
+        self._delta_from = 0
+        self._escape_start: Optional[int] = None
+        self._unicode_left = 0
+        self._in_surrogate = False
+
+    @property
+    def text(self) -> str:
+        return self._text
+
+    def _child_path(self) -> Tuple[Any, ...]:
+        if not self._stack:
+            return ()
+        top = self._stack[-1]
+        if top["kind"] == "object":
+            return top["path"] + (top["key"],)
+        return top["path"] + (top["index"],)
+
+    def _complete(self, path: Tuple[Any, ...], start: int, end: int, out: List[Event]) -> None:
+        if len(path) <= self.max_depth:
+            out.append(("value", path, json.loads(self._text[start:end])))
+
+    def _emit_delta(self, end: int, out: List[Event]) -> None:
+        """送出串流字串欄位從上次位置到 end（原始文字位置）的解碼內容"""
+        if end > self._delta_from:
+            out.append(("delta", self._delta_path, json.loads('"' + self._text[self._delta_from:end] + '"')))
+            self._delta_from = end
+
+    def _scan_string_char(self, c: str, i: int) -> None:
+        """追蹤字串內的跳脫序列，讓 delta 只在完整的字元邊界切開"""
+        if self._unicode_left:
+            self._unicode_left -= 1
+            if self._unicode_left == 0:
+                code = int(self._text[i - 3:i + 1], 16)
+                if 0xD800 <= code <= 0xDBFF and not self._in_surrogate:
+                    # 高位代理：等待下一個 \u 低位代理再一起送出
+                    self._in_surrogate = True
+                else:
+                    self._in_surrogate = False
+                    self._escape_start = None
+        elif self._escape:
+            self._escape = False
+            if c == "u":
+                self._unicode_left = 4
+            else:
+                self._in_surrogate = False
+                self._escape_start = None
+        elif c == "\\":
+            self._escape = True
+            if self._escape_start is None:
+                self._escape_start = i
+        else:
+            self._in_surrogate = False
+            self._escape_start = None
+
+    def feed(self, chunk: str) -> List[Completed]:
+        """加入一段文字，回傳這段文字中完成的值"""
+        return [(path, value) for kind, path, value in self.feed_events(chunk) if kind == "value"]
+
+    def feed_events(self, chunk: str) -> List[Event]:
+        """加入一段文字，依序回傳完成的值與串流字串欄位的 delta"""
+        self._text += chunk
+        text = self._text
+        out: List[Event] = []
+        i = self._pos
+        n = len(text)
+        while i < n:
+            c = text[i]
+            if self._string_start is not None:
+                if c == '"' and not self._escape and not self._unicode_left:
+                    start = self._string_start
+                    self._string_start = None
+                    self._in_surrogate = False
+                    self._escape_start = None
+                    if self._string_is_key:
+                        self._stack[-1]["key"] = json.loads(text[start:i + 1])
+                    else:
+                        if self._delta_path is not None:
+                            self._emit_delta(i, out)
+                            self._delta_path = None
+                        self._complete(self._child_path(), start, i + 1, out)
+                else:
+                    self._scan_string_char(c, i)
+                i += 1
+                continue
+
+            if self._scalar_start is not None:
+                if c not in _WHITESPACE and c not in ",]}":
+                    i += 1
+                    continue
+                self._complete(self._child_path(), self._scalar_start, i, out)
+                self._scalar_start = None
+
+            if c in _WHITESPACE:
+                pass
+            elif c == '"':
+                self._string_start = i
+                top = self._stack[-1] if self._stack else None
+                self._string_is_key = top is not None and top["kind"] == "object" and top["expect"] == "key"
+                if not self._string_is_key and self._child_path() in self.stream_paths:
+                    self._delta_path = self._child_path()
+                    self._delta_from = i + 1
+            elif c in "{[":
+                self._stack.append({
+                    "kind": "object" if c == "{" else "array",
+                    "start": i,
+                    "path": self._child_path(),
+                    "key": None,
+                    "expect": "key",
+                    "index": 0,
+                })
+            elif c in "}]":
+                frame = self._stack.pop()
+                self._complete(frame["path"], frame["start"], i + 1, out)
+            elif c == ":":
+                self._stack[-1]["expect"] = "value"
+            elif c == ",":
+                top = self._stack[-1]
+                if top["kind"] == "object":
+                    top["expect"] = "key"
+                else:
+                    top["index"] += 1
+            else:
+                self._scalar_start = i
+            i += 1
+        self._pos = i
+        # 串流中的字串欄位：送出到目前為止完整的內容
+        if self._delta_path is not None and self._string_start is not None:
+            self._emit_delta(self._escape_start if self._escape_start is not None else n, out)
+        return out
+
+    def close(self) -> List[Completed]:
+        """輸入結束：完成最後一個未以分隔符號結束的純量（僅根節點為純量時會發生）"""
+        out: List[Event] = []
+        if self._scalar_start is not None:
+            self._complete(self._child_path(), self._scalar_start, len(self._text), out)
+            self._scalar_start = None
+        return [(path, value) for _, path, value in out]
@@ -0,0 +1,91 @@
+import os
+import sys
+import json
+import asyncio
+import tempfile
+from types import SimpleNamespace
+
+import httpx
+import pytest
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+os.environ.setdefault("OPENAI_API_KEY", "test-key")
+# 後端模組在匯入時以相對路徑建立資料目錄（conversation_data、cache…），測試一律在暫存目錄中執行
+os.chdir(tempfile.mkdtemp(prefix="ai-learning-tool-tests-"))
+
+
+class FakeStream:
+    """模擬 Responses API 的串流：把 JSON 文字切成小段，以 output_text.delta 事件送出"""
+
+    def __init__(self, text: str, chunk_size: int = 7):
+        self.chunks = [text[i:i + chunk_size] for i in range(0, len(text), chunk_size)]
+        self.closed = False
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        self.closed = True
+
+    async def __aiter__(self):
+        yield SimpleNamespace(type="response.created", response=SimpleNamespace(id="resp_stream"))
+        for chunk in self.chunks:
+            await asyncio.sleep(0)
+            yield SimpleNamespace(type="response.output_text.delta", delta=chunk)
+        yield SimpleNamespace(type="response.completed")
+
+
+class FakeLLM:
+    """取代 llm_clients.for_model 回傳的客戶端；英文對話的回覆會引用本輪使用者的訊息"""
+
+    def __init__(self, delay: float = 0.01):
+        self.delay = delay
+        self.calls = 0
+        self.responses = SimpleNamespace(create=self.create)
+
+    @staticmethod
+    def _last_user_text(payload) -> str:
+        for item in reversed(payload):
+            if item.get("role") == "user":
+                return "".join(part.get("text", "") for part in item.get("content", []))
+        return ""
+
+    async def create(self, **kwargs):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        user_text = self._last_user_text(kwargs.get("input") or [])
+        text = json.dumps({
+            "ai_response": f"reply to: {user_text}",
+            "hint": "Say more.",
+            "translation": "回覆",
+        }, ensure_ascii=False)
+        if kwargs.get("stream"):
+            return FakeStream(text)
+        return SimpleNamespace(id=f"resp_{self.calls}", output_text=text, output=[])
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture
+def fake_llm(monkeypatch):
+    from llm_clients import llm_clients
+    fake = FakeLLM()
+    monkeypatch.setattr(llm_clients, "for_model", lambda *args, **kwargs: fake)
+    return fake
+
+
+@pytest.fixture
+def app():
+    from main import create_app
+    return create_app()
+
+
+@pytest.fixture
+async def client(app):
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test", timeout=60) as c:
+        yield c
@@ -0,0 +1,30 @@
+import json
+
+import pytest
+
+from english_solver import store
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_app_starts_without_event_handlers(app):
+    """關閉時的寫回走 lifespan；新版 Starlette 已沒有 add_event_handler"""
+    async with app.router.lifespan_context(app):
+        pass
+
+
+async def test_shutdown_flushes_pending_index(fake_llm, app, client):
+    backend = store.backend
+    if backend.name != "file":
+        pytest.skip("只有檔案後端有 index.json")
+    # 拉長去抖動時間，確保只有關閉流程會寫入索引
+    backend.index._flusher.delay = backend.index._flusher.max_delay = 3600
+
+    async with app.router.lifespan_context(app):
+        resp = await client.post("/api/v1/conversation", json={"topic": "lifecycle", "level": "B1"})
+        assert resp.status_code == 200
+        sid = resp.json()["sid"]
+
+    with open(backend.index_file, "r", encoding="utf-8") as f:
+        index = json.load(f)
+    assert sid in index["active"] or sid in index["archived"]
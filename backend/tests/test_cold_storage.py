@@ -0,0 +1,92 @@
+import os
+
+from cold_storage import ColdStore
+from english_storage import FileBackend
+
+
+def _payload(i: int):
+    return {"messages": [{"role": "user", "content": f"message {i} " + "x" * 200}], "metadata": {"title": f"T{i}"}}
+
+
+def _segment_file(store: ColdStore, key: str) -> str:
+    return store._segment_path(store._index[key][0])
+
+
+def test_put_many_get_round_trip(tmp_path):
+    store = ColdStore(str(tmp_path))
+    assert store.put_many([(f"k{i}", _payload(i), {"updated_at": f"2026-01-0{i + 1}"}) for i in range(3)]) == 3
+    assert store.put_many([]) == 0
+    assert store.get("k1") == _payload(1)
+    assert store.get("missing") is None
+
+    # 重新開啟後由 index.json 找回位置
+    reopened = ColdStore(str(tmp_path))
+    assert len(reopened) == 3 and "k2" in reopened
+    assert [reopened.get(f"k{i}") for i in range(3)] == [_payload(i) for i in range(3)]
+    assert dict(reopened.items())["k0"] == {"updated_at": "2026-01-01"}
+
+    assert reopened.delete("k0") and not reopened.delete("k0")
+    assert ColdStore(str(tmp_path)).get("k0") is None
+
+
+def test_vacuum_rewrites_sparse_segments(tmp_path):
+    store = ColdStore(str(tmp_path), max_segment_bytes=1)
+    # max_segment_bytes=1：每次 put_many 都寫入新的 segment
+    store.put_many([(f"a{i}", _payload(i), {}) for i in range(4)])
+    store.put_many([("b0", _payload(9), {})])
+    old_segment = _segment_file(store, "a0")
+    for i in range(3):
+        store.delete(f"a{i}")
+
+    assert store.vacuum() > 0
+    assert not os.path.exists(old_segment)
+    assert store.get("a3") == _payload(3)
+    assert store.get("b0") == _payload(9)
+
+
+def test_vacuum_keeps_segment_with_unreadable_data(tmp_path):
+    store = ColdStore(str(tmp_path), max_segment_bytes=1)
+    store.put_many([(f"a{i}", _payload(i), {}) for i in range(4)])
+    store.put_many([("b0", _payload(9), {})])
+    old_segment = _segment_file(store, "a0")
+    for i in range(2):
+        store.delete(f"a{i}")
+    # 破壞 a3 的資料
+    segment, offset, length = store._index["a3"][:3]
+    with open(store._segment_path(segment), "r+b") as f:
+        f.seek(offset)
+        f.write(b"\0" * length)
+
+    store.vacuum(min_live_ratio=0.9)
+    # 可讀的 a2 已搬到新 segment，但舊 segment 仍保留（a3 唯一的副本）
+    assert os.path.exists(old_segment)
+    assert store._index["a2"][0] != segment
+    assert store.get("a2") == _payload(2)
+    assert store._index["a3"][0] == segment
+
+
+def test_archive_cold_then_load(tmp_path):
+    backend = FileBackend(str(tmp_path))
+    conversations = {}
+    for i in range(3):
+        messages = [{"role": "user", "content": f"hello {i}"}, {"role": "assistant", "content": f"hi {i}"}]
+        metadata = {"title": f"Talk {i}", "updated_at": f"2026-01-0{i + 1}T00:00:00"}
+        backend.save(f"s{i}", messages, metadata, True)
+        conversations[f"s{i}"] = (messages, metadata)
+
+    # s2 比界線新，s1 正在使用中（skip），只有 s0 移入冷儲存
+    assert backend.archive_cold("2026-01-03T00:00:00", batch=10, skip={"s1"}) == 1
+    assert not backend.journal.exists("s0")
+    assert backend.journal.exists("s1") and backend.journal.exists("s2")
+    assert "s0" in backend.cold
+
+    assert backend.load("s0") == conversations["s0"]
+    assert backend.exists("s0", True)
+    assert backend.get_entry("s0")[0]["title"] == "Talk 0"
+    assert FileBackend(str(tmp_path)).load("s0") == conversations["s0"]
+
+    # 再次保存後回到日誌並從冷儲存移除
+    messages, metadata = conversations["s0"]
+    backend.save("s0", messages + [{"role": "user", "content": "back"}], metadata, True)
+    assert "s0" not in backend.cold
+    assert backend.load("s0")[0][-1]["content"] == "back"
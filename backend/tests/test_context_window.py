@@ -0,0 +1,153 @@
+import uuid
+import asyncio
+from datetime import datetime
+from types import SimpleNamespace
+
+import pytest
+
+from context_window import ContextWindow, SUMMARY_KEY, estimate_tokens
+from english_solver import store, english_core
+from llm_clients import llm_clients
+from write_behind import write_queue
+
+SYSTEM = {"role": "system", "content": "You are a friendly English partner."}
+
+
+def _history(turns: int, words: int = 5):
+    messages = [SYSTEM, {"role": "assistant", "content": {"ai_response": "Hi! Where shall we start?", "hint": "h", "translation": "t"}}]
+    for i in range(turns):
+        messages.append({"role": "user", "content": f"user {i} " + "word " * words})
+        messages.append({"role": "assistant", "content": {"ai_response": f"reply {i} " + "word " * words, "hint": "h", "translation": "t"}})
+    return messages
+
+
+# --- token 預算與輪數限制 ---
+def test_window_keeps_recent_turns_within_max_turns():
+    window = ContextWindow(token_budget=10_000, max_turns=3, summary_batch=0)
+    messages = _history(10)
+    context = window.build(messages, {})
+    assert context[0] == SYSTEM
+    assert [m["content"] for m in context[1:]] == [m["content"]["ai_response"] if isinstance(m["content"], dict) else m["content"]
+                                                    for m in messages[-6:]]
+
+
+def test_window_trims_to_token_budget():
+    window = ContextWindow(token_budget=60, max_turns=50, summary_batch=0)
+    messages = _history(20, words=20)
+    context = window.build(messages, {})
+    history = context[1:]
+    assert 0 < len(history) < len(messages) - 1
+    assert sum(estimate_tokens(m["content"]) for m in history) <= 60
+    # 只送出 ai_response，hint 與 translation 不重送
+    assert all("translation" not in m["content"] for m in history)
+
+
+def test_oversized_last_message_is_clipped():
+    window = ContextWindow(token_budget=20, max_turns=6, summary_batch=0)
+    messages = [SYSTEM, {"role": "user", "content": "word " * 500}]
+    context = window.build(messages, {})
+    assert len(context) == 2
+    assert context[-1]["content"].startswith("…")
+    assert estimate_tokens(context[-1]["content"]) <= 22
+
+
+# --- 滾動摘要 ---
+def test_summary_replaces_summarized_messages():
+    window = ContextWindow(token_budget=10_000, max_turns=2, summary_batch=4)
+    messages = _history(8)
+    upto = len(messages) - 4
+    context = window.build(messages, {SUMMARY_KEY: {"text": "They talked about travel.", "upto": upto}})
+    assert context[0] == SYSTEM
+    assert context[1]["role"] == "system"
+    assert context[1]["content"].endswith("They talked about travel.")
+    # 已摘要的訊息不再送出原文
+    assert len(context) == 2 + 4
+
+
+def test_unsummarized_overflow_is_bounded_by_summary_batch():
+    window = ContextWindow(token_budget=10_000, max_turns=2, summary_batch=4)
+    messages = _history(8)
+    context = window.build(messages, {})
+    # 視窗內 4 則 + 最多 summary_batch 則尚未摘要的訊息
+    assert len(context) == 1 + 4 + 4
+    assert window.pending_summary(messages, {}) == (1, len(messages) - 4)
+    assert window.pending_summary(messages, {SUMMARY_KEY: {"text": "s", "upto": len(messages) - 4}}) is None
+
+
+# --- 背景摘要的保存 ---
+def _new_conversation(turns: int) -> str:
+    sid = f"ctx-{uuid.uuid4()}"
+    metadata = {"topic": "travel", "level": "B1", "created_at": datetime.now().isoformat(), "version": 1}
+    store.save_conversation(sid, _history(turns), metadata, is_archived=True)
+    return sid
+
+
+def test_touch_false_keeps_updated_at():
+    sid = _new_conversation(1)
+    messages, metadata = store.get_conversation(sid)
+    before = store.backend.get_entry(sid)[0]["updated_at"]
+    assert metadata["updated_at"] == before
+
+    metadata[SUMMARY_KEY] = {"text": "summary", "upto": 1}
+    store.save_conversation(sid, messages, metadata, is_archived=True, touch=False)
+    assert store.backend.get_entry(sid)[0]["updated_at"] == before
+
+    store.save_conversation(sid, messages, metadata, is_archived=True)
+    assert store.backend.get_entry(sid)[0]["updated_at"] > before
+
+    # 重新從存儲載入後仍保留摘要
+    write_queue.flush()
+    store.uncache_conversation(sid)
+    _, reloaded = store.get_conversation(sid)
+    assert reloaded[SUMMARY_KEY]["text"] == "summary"
+
+
+class GatedSummaryLLM:
+    """摘要呼叫在 release 之前不會完成，讓測試在期間插入新的一輪"""
+
+    def __init__(self):
+        self.started = asyncio.Event()
+        self.release = asyncio.Event()
+        self.responses = SimpleNamespace(create=self.create)
+
+    async def create(self, **kwargs):
+        self.started.set()
+        await self.release.wait()
+        return SimpleNamespace(id="resp_summary", output_text="The learner described a trip to Japan.", output=[])
+
+
+@pytest.mark.anyio
+async def test_summary_save_races_concurrent_append(monkeypatch):
+    llm = GatedSummaryLLM()
+    monkeypatch.setattr(llm_clients, "for_model", lambda *args, **kwargs: llm)
+    monkeypatch.setattr(english_core, "context_window", ContextWindow(token_budget=10_000, max_turns=2, summary_batch=4))
+    sid = _new_conversation(8)
+    messages, metadata = store.get_conversation(sid)
+    count_before = len(messages)
+    pending = english_core.context_window.pending_summary(messages, metadata)
+    assert pending is not None
+
+    task = asyncio.ensure_future(english_core._summarize_context(sid))
+    await llm.started.wait()
+    # 摘要產生期間完成新的一輪（在 sid 的分片鎖內追加並遞增版本）
+    version = store.append_messages(sid, [
+        {"role": "user", "content": "I went to Japan."},
+        {"role": "assistant", "content": {"ai_response": "How was it?", "hint": "h", "translation": "t"}},
+    ], expected_version=store.get_version(metadata))
+    updated_at = store.backend.get_entry(sid)[0]["updated_at"]
+    llm.release.set()
+    await task
+
+    messages, metadata = store.get_conversation(sid)
+    assert len(messages) == count_before + 2
+    assert store.get_version(metadata) == version
+    assert metadata[SUMMARY_KEY]["upto"] == pending[1]
+    assert metadata[SUMMARY_KEY]["text"] == "The learner described a trip to Japan."
+    assert store.backend.get_entry(sid)[0]["updated_at"] == updated_at
+
+    # 落盤後重新載入：新的一輪與摘要都在
+    write_queue.flush()
+    store.uncache_conversation(sid)
+    messages, metadata = store.get_conversation(sid)
+    assert messages[-2]["content"] == "I went to Japan."
+    assert metadata[SUMMARY_KEY]["upto"] == pending[1]
@@ -0,0 +1,112 @@
+import json
+
+from journal import ConversationJournal
+
+
+def _messages(count: int, start: int = 0):
+    return [{"role": "user" if i % 2 == 0 else "assistant", "content": f"m{i}"} for i in range(start, start + count)]
+
+
+def _lines(journal: ConversationJournal, key: str):
+    with open(journal._get_path(key), "rb") as f:
+        return f.read().splitlines(keepends=True)
+
+
+def test_replay_skips_partial_tail(tmp_path):
+    journal = ConversationJournal(str(tmp_path))
+    journal.save("s1", _messages(2), {"version": 1})
+    journal.save("s1", _messages(4), {"version": 2})
+    # 寫到一半中斷：最後一筆紀錄沒有寫完，也沒有換行
+    with open(journal._get_path("s1"), "a", encoding="utf-8") as f:
+        f.write('{"t": "msg", "d": {"role": "user", "con')
+
+    messages, metadata = ConversationJournal(str(tmp_path)).replay("s1")
+    assert messages == _messages(4)
+    assert metadata == {"version": 2}
+
+
+def test_replay_skips_corrupt_line(tmp_path):
+    journal = ConversationJournal(str(tmp_path))
+    journal.save("s1", _messages(2), {"version": 1})
+    with open(journal._get_path("s1"), "a", encoding="utf-8") as f:
+        f.write("not json\n")
+    journal.append("s1", _messages(2, start=2), {"version": 2})
+
+    messages, metadata = ConversationJournal(str(tmp_path)).replay("s1")
+    assert messages == _messages(4)
+    assert metadata == {"version": 2}
+
+
+def test_append_after_partial_tail_keeps_new_records(tmp_path):
+    journal = ConversationJournal(str(tmp_path))
+    journal.save("s1", _messages(2), {"version": 1})
+    with open(journal._get_path("s1"), "a", encoding="utf-8") as f:
+        f.write('{"t": "meta", "d": {"vers')
+
+    # 新紀錄不可接在半行後面（否則整行解析失敗，新訊息一起遺失）
+    journal.append("s1", _messages(2, start=2), {"version": 2})
+    assert all(line.endswith(b"\n") for line in _lines(journal, "s1"))
+    assert ConversationJournal(str(tmp_path)).replay("s1") == (_messages(4), {"version": 2})
+
+
+def test_truncate_partial_tail(tmp_path):
+    path = tmp_path / "s1.jsonl"
+    complete = '{"t": "msg", "d": {"content": "a"}}\n'
+
+    # 完整的檔案不變
+    path.write_text(complete)
+    ConversationJournal._truncate_partial_tail(str(path))
+    assert path.read_text() == complete
+
+    # 截到最後一個換行
+    path.write_text(complete + '{"t": "msg"')
+    ConversationJournal._truncate_partial_tail(str(path))
+    assert path.read_text() == complete
+
+    # 半行比讀取區塊長：需要往回讀多個區塊
+    path.write_text(complete + "x" * 10_000)
+    ConversationJournal._truncate_partial_tail(str(path))
+    assert path.read_text() == complete
+
+    # 整個檔案只有半行
+    path.write_text('{"t": "ms')
+    ConversationJournal._truncate_partial_tail(str(path))
+    assert path.read_text() == ""
+
+    # 不存在的檔案直接略過
+    ConversationJournal._truncate_partial_tail(str(tmp_path / "missing.jsonl"))
+
+
+def test_compact_matches_write_snapshot(tmp_path):
+    journal = ConversationJournal(str(tmp_path / "appended"), compact_threshold=1000)
+    journal.save("s1", _messages(2), {"version": 1})
+    for version in range(2, 6):
+        journal.append("s1", _messages(2, start=2 * (version - 1)), {"version": version})
+    assert len(_lines(journal, "s1")) == 10 + 5
+    replayed = journal.replay("s1")
+
+    journal.compact("s1")
+    snapshot = ConversationJournal(str(tmp_path / "snapshot"))
+    snapshot.write_snapshot("s1", *replayed)
+    assert _lines(journal, "s1") == _lines(snapshot, "s1")
+    assert [json.loads(line)["t"] for line in _lines(journal, "s1")] == ["msg"] * 10 + ["meta"]
+    assert journal.replay("s1") == replayed == (_messages(10), {"version": 5})
+
+
+def test_append_compacts_past_threshold(tmp_path):
+    journal = ConversationJournal(str(tmp_path), compact_threshold=3)
+    journal.save("s1", _messages(1), {"version": 1})
+    for version in range(2, 6):
+        journal.append("s1", _messages(1, start=version - 1), {"version": version})
+    # 超過門檻後壓縮為單一 metadata 紀錄，內容不變
+    metas = [line for line in _lines(journal, "s1") if json.loads(line)["t"] == "meta"]
+    assert len(metas) <= 3
+    assert ConversationJournal(str(tmp_path)).replay("s1") == (_messages(5), {"version": 5})
+
+
+def test_save_with_truncated_history_rewrites_snapshot(tmp_path):
+    journal = ConversationJournal(str(tmp_path))
+    journal.save("s1", _messages(6), {"version": 1})
+    journal.save("s1", _messages(3), {"version": 2})
+    assert ConversationJournal(str(tmp_path)).replay("s1") == (_messages(3), {"version": 2})
+    assert len(_lines(journal, "s1")) == 4
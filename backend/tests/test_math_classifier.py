@@ -0,0 +1,122 @@
+import json
+import uuid
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from fastapi import HTTPException
+
+from conftest import FakeLLM
+from latency_metrics import LatencyMetrics
+from llm_clients import llm_clients
+from math_model import MathProblem
+from math_solver import math_solver
+
+pytestmark = pytest.mark.anyio
+
+
+SOLUTION = {
+    "is_math_question": True,
+    "problem": "3x = 9",
+    "domain": "algebra",
+    "relevant_concepts": ["linear equations"],
+    "solution_approach": "Divide both sides by 3.",
+    "steps": [{"step_number": 1, "description": "Divide by 3", "calculation": "x = 9 / 3", "reasoning": "Isolate x."}],
+    "final_answer": "x = 3",
+    "verification": "3 * 3 = 9",
+    "alternative_methods": [],
+}
+
+
+class ClassifyingLLM(FakeLLM):
+    """分類與解題各自可控制完成時機；記錄兩者的開始順序與解題是否被取消"""
+
+    def __init__(self, is_math: bool, classify_delay: float = 0.05, solve_delay: float = 0.0):
+        super().__init__()
+        self.is_math = is_math
+        self.classify_delay = classify_delay
+        self.solve_delay = solve_delay
+        self.events = []
+        self.solve_cancelled = False
+
+    async def create(self, **kwargs):
+        name = kwargs.get("text", {}).get("format", {}).get("name")
+        if name == "reasonable_math_check":
+            self.events.append("classify:start")
+            await asyncio.sleep(self.classify_delay)
+            self.events.append("classify:end")
+            verdict = {"is_reasonable_math_question": self.is_math, "reason": "test"}
+            return SimpleNamespace(id="resp_classify", output_text=json.dumps(verdict))
+        self.events.append("solve:start")
+        try:
+            await asyncio.sleep(self.solve_delay)
+        except asyncio.CancelledError:
+            self.solve_cancelled = True
+            raise
+        self.events.append("solve:end")
+        return SimpleNamespace(id="resp_solve", output_text=json.dumps(SOLUTION))
+
+
+@pytest.fixture
+def classifier(monkeypatch):
+    metrics = LatencyMetrics()
+    monkeypatch.setattr(math_solver, "classifier_metrics", metrics)
+    monkeypatch.setattr(math_solver, "classifier_mode", math_solver.classifier_mode)
+
+    def install(mode: str, **kwargs):
+        llm = ClassifyingLLM(**kwargs)
+        monkeypatch.setattr(llm_clients, "for_model", lambda *args, **kw: llm)
+        math_solver.set_classifier_mode(mode)
+        return llm, metrics
+    return install
+
+
+def _problem() -> MathProblem:
+    # 每個測試用不同的題目，避免命中解答快取
+    return MathProblem(problem=f"Solve 3x = 9 ({uuid.uuid4().hex})")
+
+
+async def test_speculative_cancels_solve_when_classifier_rejects(classifier):
+    llm, metrics = classifier("speculative", is_math=False, classify_delay=0.01, solve_delay=5)
+
+    with pytest.raises(HTTPException) as exc:
+        await math_solver.solve_problem(_problem())
+    assert exc.value.status_code == 400
+    await asyncio.sleep(0)
+
+    # 分類與解題同時開始
+    assert set(llm.events[:2]) == {"solve:start", "classify:start"}
+    assert llm.solve_cancelled
+    assert "solve:end" not in llm.events
+    stats = metrics.snapshot()["speculative"]
+    assert stats["outcomes"] == {"rejected": 1}
+    assert stats["max_ms"] < 1000, "拒絕後不應等待解題完成"
+
+
+async def test_speculative_overlaps_solve_with_classification(classifier):
+    llm, metrics = classifier("speculative", is_math=True, classify_delay=0.05)
+
+    response = await math_solver.solve_problem(_problem())
+    assert response.solution.final_answer == "x = 3"
+    # 解題在分類完成前就已開始（並完成），但結果等到分類通過才回傳
+    assert llm.events.index("solve:start") < llm.events.index("classify:end")
+    assert not llm.solve_cancelled
+    assert metrics.snapshot()["speculative"]["outcomes"] == {"ok": 1}
+
+
+async def test_serial_mode_solves_after_classification(classifier):
+    llm, metrics = classifier("serial", is_math=True, classify_delay=0.01)
+
+    await math_solver.solve_problem(_problem())
+    assert llm.events == ["classify:start", "classify:end", "solve:start", "solve:end"]
+    assert metrics.snapshot()["serial"]["outcomes"] == {"ok": 1}
+
+
+async def test_serial_mode_rejects_without_solving(classifier):
+    llm, metrics = classifier("serial", is_math=False, classify_delay=0.01)
+
+    with pytest.raises(HTTPException):
+        await math_solver.solve_problem(_problem())
+    assert "solve:start" not in llm.events
+    assert metrics.snapshot()["serial"]["outcomes"] == {"rejected": 1}
+    assert math_solver.classifier_stats()["latency"] == metrics.snapshot()
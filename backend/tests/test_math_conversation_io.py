@@ -0,0 +1,48 @@
+import threading
+
+from conversation import ConversationManager
+from write_behind import write_queue
+
+
+def _messages(text: str):
+    return [{"role": "user", "content": text}, {"role": "assistant", "content": f"answer to {text}"}]
+
+
+def test_flush_io_does_not_block_other_sessions(tmp_path):
+    manager = ConversationManager(str(tmp_path))
+    writing = threading.Event()
+    release = threading.Event()
+    write_snapshot = manager.journal.write_snapshot
+
+    def slow_write_snapshot(*args, **kwargs):
+        writing.set()
+        assert release.wait(10)
+        return write_snapshot(*args, **kwargs)
+
+    manager.journal.write_snapshot = slow_write_snapshot
+    try:
+        manager.add_messages("slow", _messages("first"), title="slow")
+        assert writing.wait(5)
+
+        # 寫入執行緒卡在 "slow" 的檔案 I/O 時，其他 session 的請求不應等待
+        results = {}
+
+        def other_session():
+            manager.add_messages("other", _messages("second"), title="other")
+            results["history"] = manager.get_history("other")
+            results["summaries"] = manager.list_summaries()[0]
+
+        worker = threading.Thread(target=other_session)
+        worker.start()
+        worker.join(2)
+        assert not worker.is_alive(), "其他 session 的請求被落盤中的檔案 I/O 擋住"
+        assert [m["content"] for m in results["history"]] == ["second", "answer to second"]
+        assert {s["session_id"] for s in results["summaries"]} == {"slow", "other"}
+    finally:
+        release.set()
+        write_queue.flush()
+
+    assert len(manager.get_history("slow")) == 2
+    reloaded = ConversationManager(str(tmp_path))
+    assert [m["content"] for m in reloaded.get_history("slow")] == ["first", "answer to first"]
+    assert len(reloaded.get_history("other")) == 2
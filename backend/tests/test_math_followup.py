@@ -0,0 +1,137 @@
+import json
+import uuid
+from types import SimpleNamespace
+
+import httpx
+import openai
+import pytest
+
+from llm_clients import llm_clients
+from math_model import MathProblem, QuestionRequest
+from math_solver import math_solver, conversation_manager
+from response_cache import response_cache, collapse_whitespace
+
+pytestmark = pytest.mark.anyio
+
+
+SOLUTION = {
+    "is_math_question": True,
+    "problem": "3x = 9",
+    "domain": "algebra",
+    "relevant_concepts": ["linear equations"],
+    "solution_approach": "Divide both sides by 3.",
+    "steps": [{"step_number": 1, "description": "Divide by 3", "calculation": "x = 9 / 3", "reasoning": "Isolate x."}],
+    "final_answer": "x = 3",
+    "verification": "3 * 3 = 9",
+    "alternative_methods": [],
+}
+
+
+class RecordingLLM:
+    """記錄每次 responses.create 的參數；reject_previous 時拒絕 previous_response_id（例如已過期）"""
+
+    def __init__(self, reject_previous: bool = False):
+        self.reject_previous = reject_previous
+        self.calls = []
+        self.responses = SimpleNamespace(create=self.create)
+
+    async def create(self, **kwargs):
+        self.calls.append(kwargs)
+        if self.reject_previous and kwargs.get("previous_response_id"):
+            request = httpx.Request("POST", "http://test/v1/responses")
+            raise openai.BadRequestError("previous response expired", response=httpx.Response(400, request=request), body=None)
+        if kwargs.get("text", {}).get("format", {}).get("name") == "math_solution":
+            return SimpleNamespace(id=f"resp_solve_{len(self.calls)}", output_text=json.dumps(SOLUTION))
+        return SimpleNamespace(id=f"resp_answer_{len(self.calls)}", output_text="Because both sides were divided by 2.")
+
+
+def _session(response_id=None) -> str:
+    session_id = f"followup-{uuid.uuid4()}"
+    conversation_manager.add_messages(session_id, [
+        {"role": "user", "content": {"problem": "2x = 4"}},
+        {"role": "assistant", "content": {"answer": "x = 2"}, "response_id": response_id},
+    ], title="2x = 4")
+    return session_id
+
+
+@pytest.fixture
+def recording_llm(monkeypatch):
+    def install(**kwargs):
+        llm = RecordingLLM(**kwargs)
+        monkeypatch.setattr(llm_clients, "for_model", lambda *args, **kw: llm)
+        return llm
+    return install
+
+
+async def test_followup_chains_previous_response_id(recording_llm):
+    llm = recording_llm()
+    session_id = _session(response_id="resp_solution")
+
+    answer = await math_solver.answer_question(QuestionRequest(session_id=session_id, question="Why divide?"))
+
+    assert answer == "Because both sides were divided by 2."
+    assert len(llm.calls) == 1
+    call = llm.calls[0]
+    assert call["previous_response_id"] == "resp_solution"
+    assert [m["role"] for m in call["input"]] == ["user"]
+    assert conversation_manager.get_last_response_id(session_id) == "resp_answer_1"
+
+
+async def test_followup_without_response_id_uses_local_history(recording_llm):
+    llm = recording_llm()
+    session_id = _session(response_id=None)
+
+    await math_solver.answer_question(QuestionRequest(session_id=session_id, question="Why divide?"))
+
+    assert len(llm.calls) == 1
+    call = llm.calls[0]
+    assert "previous_response_id" not in call
+    assert call["input"][0]["role"] == "developer"
+    assert call["input"][-1]["content"][0]["text"] == "Why divide?"
+    assert len(call["input"]) > 2
+
+
+async def test_rejected_response_id_falls_back_to_local_history(recording_llm):
+    llm = recording_llm(reject_previous=True)
+    session_id = _session(response_id="resp_expired")
+
+    answer = await math_solver.answer_question(QuestionRequest(session_id=session_id, question="Why divide?"))
+
+    assert answer == "Because both sides were divided by 2."
+    assert [call.get("previous_response_id") for call in llm.calls] == ["resp_expired", None]
+    assert llm.calls[1]["input"][0]["role"] == "developer"
+
+
+async def test_resolve_in_session_chains_and_skips_shared_cache(recording_llm, monkeypatch):
+    monkeypatch.setattr(math_solver, "classifier_mode", "off")
+    llm = recording_llm()
+    session_id = _session(response_id="resp_solution")
+    problem = MathProblem(problem="3x = 9", session_id=session_id)
+
+    response = await math_solver.solve_problem(problem)
+
+    assert response.solution.final_answer == "x = 3"
+    assert len(llm.calls) == 1
+    call = llm.calls[0]
+    assert call["previous_response_id"] == "resp_solution"
+    assert call["instructions"]
+    assert [m["role"] for m in call["input"]] == ["user"]
+    assert conversation_manager.get_last_response_id(session_id) == "resp_solve_1"
+    # 依賴對話內容的解答不寫入跨對話共用的快取
+    cache_key = math_solver._solution_cache_key("text", collapse_whitespace(problem.problem), problem)
+    assert response_cache.get(cache_key) is None
+
+
+async def test_rejected_resolve_falls_back_to_local_history(recording_llm, monkeypatch):
+    monkeypatch.setattr(math_solver, "classifier_mode", "off")
+    llm = recording_llm(reject_previous=True)
+    session_id = _session(response_id="resp_expired")
+
+    response = await math_solver.solve_problem(MathProblem(problem="3x = 9", session_id=session_id))
+
+    assert response.solution.final_answer == "x = 3"
+    assert [call.get("previous_response_id") for call in llm.calls] == ["resp_expired", None]
+    fallback = llm.calls[1]
+    assert "instructions" not in fallback
+    assert [m["role"] for m in fallback["input"]] == ["developer", "user", "assistant", "user"]
+    assert conversation_manager.get_last_response_id(session_id) == "resp_solve_2"
@@ -0,0 +1,22 @@
+import json
+import os
+
+import prompt_loader
+
+
+def test_prompt_version_is_cached_until_prompts_change(tmp_path, monkeypatch):
+    path = tmp_path / "prompts.json"
+    path.write_text(json.dumps({"math": {"solver_system": "v1"}}), encoding="utf-8")
+    monkeypatch.setattr(prompt_loader, "_get_prompts_path", lambda: str(path))
+    monkeypatch.setattr(prompt_loader, "_PROMPTS_CACHE", {})
+    monkeypatch.setattr(prompt_loader, "_PROMPTS_MTIME", None)
+    monkeypatch.setattr(prompt_loader, "_PROMPT_VERSIONS", {})
+
+    first = prompt_loader.get_prompt_version("math")
+    assert prompt_loader.get_prompt_version("math") == first
+    assert prompt_loader._PROMPT_VERSIONS == {"math": first}
+
+    path.write_text(json.dumps({"math": {"solver_system": "v2"}}), encoding="utf-8")
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+    assert prompt_loader.get_prompt_version("math") != first
@@ -0,0 +1,34 @@
+import threading
+
+import pytest
+
+from response_cache import ResponseCache
+from write_behind import write_queue
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_aget_reads_sqlite_off_the_event_loop(tmp_path):
+    cache = ResponseCache(db_path=str(tmp_path / "cache.db"), memory_entries=1)
+    cache.set("ns:a", {"answer": 1})
+    cache.set("ns:b", {"answer": 2})  # 把 ns:a 擠出記憶體層
+    write_queue.flush()
+
+    loop_thread = threading.get_ident()
+    threads = []
+    get_stored = cache._get_stored
+
+    def recording_get_stored(*args):
+        threads.append(threading.get_ident())
+        return get_stored(*args)
+
+    cache._get_stored = recording_get_stored
+    assert await cache.aget("ns:a") == {"answer": 1}
+    assert threads and loop_thread not in threads
+    assert cache.stats()["counters"]["ns"]["disk_hits"] == 1
+
+    # 提升到記憶體後不再查詢 SQLite
+    threads.clear()
+    assert await cache.aget("ns:a") == {"answer": 1}
+    assert threads == []
+    assert await cache.aget("ns:missing") is None
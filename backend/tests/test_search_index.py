@@ -0,0 +1,59 @@
+from search_index import SearchIndex
+
+
+def _index(tmp_path):
+    index = SearchIndex(str(tmp_path / "search_index.bin"))
+    index.update("s1", [{"role": "user", "content": "I would like a table for two."}],
+                 {"title": "Restaurant ordering practice", "topic": "food"})
+    index.update("s2", [{"role": "user", "content": "Where is the train station?"}],
+                 {"title": "Travel directions", "topic": "travel"})
+    return index
+
+
+def test_whole_words_match(tmp_path):
+    index = _index(tmp_path)
+    assert [sid for sid, _ in index.search("restaurant")] == ["s1"]
+    assert [sid for sid, _ in index.search("ordering practice")] == ["s1"]
+
+
+def test_partial_words_match_by_prefix(tmp_path):
+    index = _index(tmp_path)
+    assert [sid for sid, _ in index.search("rest")] == ["s1"]
+    assert [sid for sid, _ in index.search("order")] == ["s1"]
+    assert [sid for sid, _ in index.search("rest order")] == ["s1"]
+    assert [sid for sid, _ in index.search("tra")] == ["s2"]
+    assert index.search("rest travel") == []
+
+
+def test_prefix_terms_follow_updates(tmp_path):
+    index = _index(tmp_path)
+    assert [sid for sid, _ in index.search("order")] == ["s1"]
+    index.update("s1", [{"role": "user", "content": "I would like a table for two."}],
+                 {"title": "Dinner", "topic": "food"})
+    assert index.search("order") == []
+    index.remove("s2")
+    assert index.search("tra") == []
+
+
+def test_interleaved_saves_and_searches_keep_sorted_terms(tmp_path):
+    index = SearchIndex(str(tmp_path / "search_index.bin"))
+    messages = []
+    for i in range(60):
+        messages.append({"role": "user", "content": f"word{i} shared"})
+        index.update("s1", messages, {"title": f"Title {i}"})
+        assert [sid for sid, _ in index.search(f"word{i}")] == ["s1"]
+        assert [sid for sid, _ in index.search("wor")] == ["s1"]
+        # 標題每次替換：舊詞離開詞表、新詞加入，詞表必須與倒排列表一致且保持排序
+        assert index._sorted_terms == sorted(index._postings)
+        if i:
+            assert index.search(f"{i - 1}") == []
+
+    index.remove("s1")
+    assert index._sorted_terms == []
+    assert index.search("wor") == []
+
+    index.update("s2", [{"role": "user", "content": "restaurant"}], {"title": "Food"})
+    index.flush()
+    reloaded = SearchIndex(str(tmp_path / "search_index.bin"))
+    assert reloaded._sorted_terms == sorted(reloaded._postings)
+    assert [sid for sid, _ in reloaded.search("rest")] == ["s2"]
@@ -0,0 +1,81 @@
+import json
+import asyncio
+
+import pytest
+
+from english_solver import store
+from write_behind import write_queue
+
+pytestmark = pytest.mark.anyio
+
+PARALLEL_TURNS = 300
+
+
+async def _start(client) -> str:
+    resp = await client.post("/api/v1/conversation", json={"topic": "travel", "level": "B1"})
+    assert resp.status_code == 200
+    return resp.json()["sid"]
+
+
+async def _turn(client, sid: str, text: str, stream: bool):
+    """送出一輪；回傳 (HTTP 狀態, 這輪是否完成)"""
+    if not stream:
+        resp = await client.post(f"/api/v1/conversation/{sid}", json={"user": text})
+        return resp.status_code, resp.status_code == 200
+    resp = await client.post(f"/api/v1/conversation/{sid}/stream", json={"user": text})
+    if resp.status_code != 200:
+        return resp.status_code, False
+    events = [json.loads(line[len("data: "):]) for line in resp.text.splitlines()
+              if line.startswith("data: ") and line != "data: [DONE]"]
+    return resp.status_code, any(e.get("type") == "complete" for e in events)
+
+
+def _assert_paired(messages, completed_texts):
+    """開場之後的訊息嚴格以 使用者 → AI 成對出現，且每則 AI 回覆對應緊接在前的使用者訊息"""
+    history = [m for m in messages if m.get("role") != "system"]
+    assert history[0]["role"] == "assistant"
+    turns = history[1:]
+    assert len(turns) % 2 == 0
+    users = turns[0::2]
+    assistants = turns[1::2]
+    assert all(m["role"] == "user" for m in users)
+    assert all(m["role"] == "assistant" for m in assistants)
+    for user, assistant in zip(users, assistants):
+        assert assistant["content"]["ai_response"] == f"reply to: {user['content']}"
+    assert sorted(m["content"] for m in users) == sorted(completed_texts)
+
+
+async def test_parallel_turns_on_one_session(fake_llm, client):
+    sid = await _start(client)
+
+    texts = [f"message {i}" for i in range(PARALLEL_TURNS)]
+    results = await asyncio.gather(*(
+        _turn(client, sid, text, stream=i % 2 == 1) for i, text in enumerate(texts)
+    ))
+
+    statuses = {status for status, _ in results}
+    assert statuses <= {200, 409}
+    assert 409 in statuses, "同時送出的輪次應該有被拒絕的"
+    completed = [text for text, (_, done) in zip(texts, results) if done]
+    assert completed, "至少要有一輪完成"
+    assert all(status == 200 for status, done in results if done)
+
+    messages, metadata = store.get_conversation(sid)
+    _assert_paired(messages, completed)
+    # 串流先提交使用者訊息、再提交 AI 回覆，各遞增一次版本；一般輪次一次提交兩則
+    stream_completed = sum(1 for i, (_, done) in enumerate(results) if done and i % 2 == 1)
+    expected_version = len(completed) + stream_completed
+    assert metadata["version"] == expected_version
+
+    # 競爭結束後，依序送出的輪次都應成功，版本逐一遞增
+    for i in range(3):
+        status, done = await _turn(client, sid, f"after {i}", stream=False)
+        assert (status, done) == (200, True)
+        assert store.get_conversation(sid)[1]["version"] == expected_version + i + 1
+    completed += [f"after {i}" for i in range(3)]
+
+    # 落盤後重新載入的內容與記憶體一致
+    write_queue.flush()
+    persisted_messages, persisted_metadata = store.backend.load(sid, True)
+    _assert_paired(persisted_messages, completed)
+    assert persisted_metadata["version"] == expected_version + 3
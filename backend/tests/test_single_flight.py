@@ -0,0 +1,85 @@
+import uuid
+import asyncio
+
+import pytest
+
+from single_flight import SingleFlight
+from english_solver import english_core
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_concurrent_calls_share_one_upstream_call(fake_llm):
+    flight = SingleFlight()
+
+    async def upstream(text):
+        resp = await fake_llm.responses.create(input=[{"role": "user", "content": [{"text": text}]}])
+        return resp.output_text
+
+    results = await asyncio.gather(*(flight.do(("k", "same"), upstream, "same") for _ in range(20)))
+    assert fake_llm.calls == 1
+    assert len(set(results)) == 1 and "reply to: same" in results[0]
+    assert flight.stats() == {"in_flight": 0, "leaders": 1, "followers": 19}
+
+    # 完成後鍵即移除，之後的呼叫重新執行；不同鍵互不合併
+    await asyncio.gather(flight.do(("k", "same"), upstream, "same"), flight.do(("k", "other"), upstream, "other"))
+    assert fake_llm.calls == 3
+
+
+async def test_exception_reaches_every_waiter(fake_llm):
+    flight = SingleFlight()
+    started = asyncio.Event()
+
+    async def failing():
+        started.set()
+        await fake_llm.responses.create(input=[])
+        raise RuntimeError("upstream down")
+
+    waiters = [asyncio.ensure_future(flight.do("k", failing)) for _ in range(5)]
+    await started.wait()
+    results = await asyncio.gather(*waiters, return_exceptions=True)
+    assert fake_llm.calls == 1
+    assert all(isinstance(r, RuntimeError) and str(r) == "upstream down" for r in results)
+    assert results.count(results[0]) == 5, "所有等待者收到同一個例外"
+    assert flight.in_flight() == 0
+
+    # 失敗不會留在鍵上，下一次呼叫重新執行
+    async def ok():
+        return "ok"
+
+    assert await flight.do("k", ok) == "ok"
+
+
+async def test_cancelled_leader_does_not_poison_followers(fake_llm):
+    flight = SingleFlight()
+    release = asyncio.Event()
+
+    async def upstream():
+        await release.wait()
+        resp = await fake_llm.responses.create(input=[])
+        return resp.id
+
+    leader = asyncio.ensure_future(flight.do("k", upstream))
+    await asyncio.sleep(0)
+    followers = [asyncio.ensure_future(flight.do("k", upstream)) for _ in range(3)]
+    await asyncio.sleep(0)
+    # leader 的請求被取消（例如用戶端中斷連線），上游呼叫仍繼續
+    leader.cancel()
+    await asyncio.sleep(0)
+    assert flight.in_flight() == 1
+    release.set()
+
+    assert await asyncio.gather(*followers) == ["resp_1"] * 3
+    assert leader.cancelled()
+    assert fake_llm.calls == 1
+    assert flight.in_flight() == 0
+
+
+async def test_concurrent_smart_queries_coalesce(fake_llm):
+    query = f"coalesce {uuid.uuid4().hex}"
+    results = await asyncio.gather(*(english_core.smart_query(query, level="B1") for _ in range(10)))
+    assert fake_llm.calls == 1
+    assert all(r == results[0] for r in results)
+    # 結果已寫入快取，之後的查詢不再呼叫上游
+    await english_core.smart_query(query, level="B1")
+    assert fake_llm.calls == 1
@@ -0,0 +1,136 @@
+import sqlite3
+import threading
+
+from english_storage import (
+    FileBackend, MIGRATION_MARKER, SQLiteBackend, build_index_entry, create_backend, migrate_file_store,
+)
+
+
+def _conversation(title: str, updated_at: str, count: int = 2):
+    messages = [{"role": "user" if i % 2 == 0 else "assistant", "content": f"m{i}"} for i in range(count)]
+    metadata = {"title": title, "topic": "travel", "level": "B1", "created_at": updated_at, "updated_at": updated_at}
+    return messages, metadata
+
+
+def test_update_index_stays_in_memory_until_written(tmp_path):
+    backend = SQLiteBackend(str(tmp_path / "english.db"))
+    messages, metadata = _conversation("Pending", "2026-01-02T00:00:00")
+
+    # 寫入執行緒持有寫入鎖（例如進行中的交易）時，請求端的索引更新與查詢都不應等待
+    done = threading.Event()
+    with backend._lock:
+        def request_path():
+            backend.update_index("s1", messages, metadata, True)
+            entry, is_archived = backend.get_entry("s1")
+            assert entry["title"] == "Pending" and is_archived
+            assert [r["sid"] for r in backend.search(topic="travel")] == ["s1"]
+            assert [a["sid"] for a in backend.list_archived()] == ["s1"]
+            assert backend.exists("s1", True)
+            done.set()
+
+        worker = threading.Thread(target=request_path)
+        worker.start()
+        worker.join(2)
+    assert done.is_set(), "索引更新或查詢被寫入鎖擋住"
+    # 尚未落盤前資料庫中沒有這一列
+    assert backend._read("SELECT * FROM conversations") == []
+
+    backend.write("s1", messages, metadata, True)
+    assert backend._pending == {}
+    entry, is_archived = backend.get_entry("s1")
+    assert entry["title"] == "Pending" and is_archived
+
+
+def test_pending_entries_merge_into_keyset_pages(tmp_path):
+    backend = SQLiteBackend(str(tmp_path / "english.db"))
+    for i in range(4):
+        messages, metadata = _conversation(f"Saved {i}", f"2026-01-0{i + 1}T00:00:00")
+        backend.write(f"s{i}", messages, metadata, True)
+    # s1 有較新的未落盤更新，s2 已刪除但尚未落盤，s9 是新的未落盤對話
+    messages, metadata = _conversation("Updated 1", "2026-02-01T00:00:00")
+    backend.update_index("s1", messages, metadata, True)
+    backend.remove_index("s2")
+    messages, metadata = _conversation("New", "2026-01-05T00:00:00")
+    backend.update_index("s9", messages, metadata, True)
+
+    assert [a["sid"] for a in backend.list_archived()] == ["s1", "s9", "s3", "s0"]
+    first = backend.list_archived(limit=2)
+    assert [a["sid"] for a in first] == ["s1", "s9"]
+    after = (first[-1]["updated_at"], first[-1]["sid"])
+    assert [a["sid"] for a in backend.list_archived(limit=2, after=after)] == ["s3", "s0"]
+    assert [r["sid"] for r in backend.search(query="updated")] == ["s1"]
+    assert backend.get_entry("s2") == (None, False)
+    assert not backend.exists("s2", False)
+
+
+def _file_store(data_dir):
+    source = FileBackend(str(data_dir))
+    for i in range(5):
+        messages, metadata = _conversation(f"Talk {i}", f"2026-03-0{i + 1}T00:00:00", count=6)
+        # s0、s1 在使用中，其餘已歸檔
+        source.save(f"s{i}", messages, metadata, i >= 2)
+    source.flush()
+    return source
+
+
+def test_file_store_round_trip_into_sqlite(tmp_path, monkeypatch):
+    data_dir = tmp_path / "conversation_data"
+    source = _file_store(data_dir)
+    monkeypatch.setenv("ENGLISH_STORE_BACKEND", "sqlite")
+    monkeypatch.setenv("ENGLISH_STORE_DB", str(tmp_path / "english.db"))
+    backend = create_backend(str(data_dir))
+    assert backend.get_meta(MIGRATION_MARKER) is not None
+
+    for sid in ("s0", "s3"):
+        assert backend.load(sid) == source.load(sid)
+    index = backend.load_index()
+    assert set(index["active"]) == {"s0", "s1"}
+    assert set(index["archived"]) == {"s2", "s3", "s4"}
+    assert backend.list_archived() == source.list_archived()
+    # keyset 分頁與檔案後端一致
+    first = backend.list_archived(limit=2)
+    after = (first[-1]["updated_at"], first[-1]["sid"])
+    assert [a["sid"] for a in first] == ["s4", "s3"]
+    assert backend.list_archived(limit=2, after=after) == source.list_archived(limit=2, after=after)
+    assert backend.search(topic="travel", limit=3, after=after) == source.search(topic="travel", limit=3, after=after)
+
+    # 截短歷史：多出的訊息列被刪除
+    messages, metadata = backend.load("s3")
+    metadata["updated_at"] = "2026-04-01T00:00:00"
+    backend.write("s3", messages[:2], metadata, True)
+    assert backend.load("s3") == (messages[:2], metadata)
+    assert backend._read("SELECT COUNT(*) AS n FROM messages WHERE sid = ?", ("s3",))[0]["n"] == 2
+
+    # 歸檔狀態依最新的保存為準，可以回到使用中
+    backend.write("s3", messages[:2], metadata, False)
+    assert backend.get_entry("s3") == (build_index_entry(messages[:2], metadata), False)
+
+
+def test_interrupted_migration_resumes_until_marked(tmp_path, monkeypatch):
+    data_dir = tmp_path / "conversation_data"
+    source = _file_store(data_dir)
+    monkeypatch.setenv("ENGLISH_STORE_BACKEND", "sqlite")
+    monkeypatch.setenv("ENGLISH_STORE_DB", str(tmp_path / "english.db"))
+
+    original_save = SQLiteBackend.save
+
+    def failing_save(self, sid, *args):
+        if sid == "s2":
+            raise sqlite3.OperationalError("disk I/O error")
+        original_save(self, sid, *args)
+
+    monkeypatch.setattr(SQLiteBackend, "save", failing_save)
+    backend = create_backend(str(data_dir))
+    assert backend.get_meta(MIGRATION_MARKER) is None
+    assert backend.get_entry("s2") == (None, False)
+    # 部分遷移後 s0 在 SQLite 中又有新的一輪，重試不可用舊檔案覆蓋
+    messages, metadata = backend.load("s0")
+    metadata["updated_at"] = "2026-05-01T00:00:00"
+    backend.write("s0", messages + [{"role": "user", "content": "new"}], metadata, False)
+
+    monkeypatch.setattr(SQLiteBackend, "save", original_save)
+    backend = create_backend(str(data_dir))
+    assert backend.get_meta(MIGRATION_MARKER) is not None
+    assert backend.load("s2") == source.load("s2")
+    assert backend.load("s0")[0][-1]["content"] == "new"
+    assert migrate_file_store(str(data_dir), backend) == 0
@@ -0,0 +1,136 @@
+import json
+import asyncio
+import threading
+
+import pytest
+
+from english_solver import store
+from session_locks import session_locks
+
+pytestmark = pytest.mark.anyio
+
+CONCURRENT_STREAMS = 300
+
+
+def _events(body: str):
+    return [json.loads(line[len("data: "):]) for line in body.splitlines()
+            if line.startswith("data: ") and line != "data: [DONE]"]
+
+
+async def test_hundreds_of_concurrent_streams(fake_llm, client):
+    sids = []
+    for i in range(CONCURRENT_STREAMS):
+        resp = await client.post("/api/v1/conversation", json={"topic": f"topic {i}", "level": "A2"})
+        sids.append(resp.json()["sid"])
+
+    baseline_threads = threading.active_count()
+    peak_threads = baseline_threads
+    running = True
+
+    async def sample_threads():
+        nonlocal peak_threads
+        while running:
+            peak_threads = max(peak_threads, threading.active_count())
+            await asyncio.sleep(0.005)
+
+    async def stream(sid: str, text: str):
+        resp = await client.post(f"/api/v1/conversation/{sid}/stream", json={"user": text})
+        return resp.status_code, resp.text
+
+    sampler = asyncio.ensure_future(sample_threads())
+    results = await asyncio.gather(*(stream(sid, f"hello {i}") for i, sid in enumerate(sids)))
+    running = False
+    await sampler
+
+    for i, (sid, (status, body)) in enumerate(zip(sids, results)):
+        assert status == 200
+        assert body.rstrip().endswith("data: [DONE]")
+        events = _events(body)
+        complete = [e for e in events if e["type"] == "complete"]
+        assert len(complete) == 1
+        expected = f"reply to: hello {i}"
+        assert complete[0]["data"]["ai_response"] == expected
+        # 逐段送出的 delta 串起來就是完整的欄位內容
+        deltas = "".join(e["content"] for e in events if e["type"] == "ai_response.delta")
+        assert deltas == expected
+        messages, metadata = store.get_conversation(sid)
+        assert [m["role"] for m in messages[-2:]] == ["user", "assistant"]
+        # 串流結束後租約已釋放
+        session_locks.end_turn(sid, session_locks.begin_turn(sid))
+
+    # 串流在事件迴圈上進行，不會為每個連線佔用一條執行緒
+    assert peak_threads - baseline_threads < 10
+
+
+async def test_lease_released_when_body_never_sent(fake_llm, app, client):
+    resp = await client.post("/api/v1/conversation", json={"topic": "food", "level": "A1"})
+    sid = resp.json()["sid"]
+
+    body = json.dumps({"user": "hi"}).encode()
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0", "spec_version": "2.4"},
+        "http_version": "1.1",
+        "method": "POST",
+        "scheme": "http",
+        "path": f"/api/v1/conversation/{sid}/stream",
+        "raw_path": f"/api/v1/conversation/{sid}/stream".encode(),
+        "query_string": b"",
+        "root_path": "",
+        "headers": [(b"host", b"test"), (b"content-type", b"application/json")],
+        "client": ("127.0.0.1", 1234),
+        "server": ("test", 80),
+    }
+    received = False
+
+    async def receive():
+        nonlocal received
+        if not received:
+            received = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        # 用戶端在回應標頭送出前就斷線
+        if message["type"] == "http.response.start":
+            raise OSError("client went away")
+
+    with pytest.raises(Exception):
+        await app(scope, receive, send)
+
+    # 內容從未開始迭代，租約仍須釋放；下一輪可以立即開始
+    session_locks.end_turn(sid, session_locks.begin_turn(sid))
+
+
+async def test_failed_stream_commits_nothing(fake_llm, monkeypatch, client):
+    resp = await client.post("/api/v1/conversation", json={"topic": "work", "level": "B1"})
+    sid = resp.json()["sid"]
+    before, metadata = store.get_conversation(sid)
+    version = store.get_version(metadata)
+
+    async def failing_create(**kwargs):
+        raise RuntimeError("upstream reset")
+
+    monkeypatch.setattr(fake_llm.responses, "create", failing_create)
+    resp = await client.post(f"/api/v1/conversation/{sid}/stream", json={"user": "lost turn"})
+    assert [e["type"] for e in _events(resp.text)] == ["error"]
+
+    # 上游失敗時使用者訊息也不寫入，版本不變
+    messages, metadata = store.get_conversation(sid)
+    assert messages == before
+    assert store.get_version(metadata) == version
+
+
+async def test_stream_commits_user_and_reply_together(fake_llm, client):
+    resp = await client.post("/api/v1/conversation", json={"topic": "work", "level": "B1"})
+    sid = resp.json()["sid"]
+    _, metadata = store.get_conversation(sid)
+    version = store.get_version(metadata)
+
+    resp = await client.post(f"/api/v1/conversation/{sid}/stream", json={"user": "hello"})
+    assert _events(resp.text)[-1]["type"] == "complete"
+    messages, metadata = store.get_conversation(sid)
+    assert messages[-2] == {"role": "user", "content": "hello"}
+    assert messages[-1]["content"]["ai_response"] == "reply to: hello"
+    # 一輪只提交一次
+    assert store.get_version(metadata) == version + 1
@@ -0,0 +1,143 @@
+import json
+
+import pytest
+
+from streaming_json import IncrementalJSONParser
+
+DOCUMENTS = [
+    # 數學解答的形狀：頂層欄位與陣列元素
+    {"problem_type": "algebra", "steps": [{"step": 1, "reasoning": "x + 1 = 2"}, {"step": 2, "reasoning": "x = 1"}],
+     "final_answer": "x = 1", "confidence": 0.95, "verified": True, "notes": None},
+    # 巢狀物件與空容器
+    {"outer": {"inner": {"deep": [1, [2, 3], {"k": "v"}]}, "empty": {}}, "list": [], "n": -1.5e3},
+    # 跳脫字元、\uXXXX、代理對（😀）與非 ASCII 字元
+    {"text": "line\nbreak \"quoted\" back\\slash tab\t", "unicode": "café 中文 😀", "raw": "直接的中文"},
+]
+
+
+def _splits(text: str):
+    """每個切點切成兩段，再加上逐字餵入"""
+    for i in range(len(text) + 1):
+        yield [text[:i], text[i:]]
+    yield list(text)
+
+
+def _feed(parser: IncrementalJSONParser, chunks):
+    values = []
+    for chunk in chunks:
+        values.extend(parser.feed(chunk))
+    values.extend(parser.close())
+    return values
+
+
+def _expected_values(value, max_depth=2, path=()):
+    """依完成順序（子節點先於父節點）列出深度不超過 max_depth 的 (路徑, 值)"""
+    expected = []
+    if isinstance(value, dict):
+        for key, item in value.items():
+            expected.extend(_expected_values(item, max_depth, path + (key,)))
+    elif isinstance(value, list):
+        for i, item in enumerate(value):
+            expected.extend(_expected_values(item, max_depth, path + (i,)))
+    if len(path) <= max_depth:
+        expected.append((path, value))
+    return expected
+
+
+@pytest.mark.parametrize("document", DOCUMENTS)
+@pytest.mark.parametrize("ensure_ascii", [True, False])
+def test_values_complete_at_every_split_point(document, ensure_ascii):
+    text = json.dumps(document, ensure_ascii=ensure_ascii)
+    for chunks in _splits(text):
+        values = _feed(IncrementalJSONParser(max_depth=2), chunks)
+        assert values == _expected_values(document), chunks
+
+
+def test_values_are_reported_as_soon_as_they_complete():
+    parser = IncrementalJSONParser()
+    assert parser.feed('{"problem_type": "alg') == []
+    assert parser.feed('ebra", "steps": [{"step": 1}') == [(("problem_type",), "algebra"), (("steps", 0), {"step": 1})]
+    assert parser.feed(', {"step": 2}], "confidence": 0.9') == [(("steps", 1), {"step": 2}), (("steps",), [{"step": 1}, {"step": 2}])]
+    # 數字在分隔符號出現時才完成
+    assert parser.feed("}") == [(("confidence",), 0.9), ((), {"problem_type": "algebra", "steps": [{"step": 1}, {"step": 2}], "confidence": 0.9})]
+
+
+def test_max_depth_limits_reported_paths():
+    text = json.dumps(DOCUMENTS[1])
+    values = _feed(IncrementalJSONParser(max_depth=1), [text])
+    assert [path for path, _ in values] == [("outer",), ("list",), ("n",), ()]
+    deep = _feed(IncrementalJSONParser(max_depth=4), [text])
+    assert deep == _expected_values(DOCUMENTS[1], max_depth=4)
+    assert (("outer", "inner", "deep", 1), [2, 3]) in deep
+
+
+@pytest.mark.parametrize("text, value", [("42", 42), ("-0.5", -0.5), ("true", True), ("null", None), ('"s"', "s")])
+def test_root_scalar_completes_on_close(text, value):
+    for chunks in _splits(text):
+        assert _feed(IncrementalJSONParser(), chunks) == [((), value)]
+
+
+# --- 串流字串欄位的 delta ---
+STREAM_PATHS = [("ai_response",), ("hint",), ("translation",)]
+REPLIES = [
+    {"ai_response": "Hello! How was your trip?", "hint": "Try the past tense.", "translation": "你好！旅行怎麼樣？"},
+    {"ai_response": "He said \"hi\"\nthen left\\", "hint": "", "translation": "tab\there"},
+    # 代理對（😀、𝄞）會被 ensure_ascii 寫成兩個 \uXXXX，切點可能落在兩者之間
+    {"ai_response": "Great 😀𝄞!", "hint": "é ü", "translation": "好 😀"},
+    # 非串流欄位中的巢狀物件不影響 delta
+    {"meta": {"ai_response": "not streamed", "list": [{"hint": "x"}]}, "ai_response": "streamed"},
+]
+
+
+def _feed_events(chunks):
+    parser = IncrementalJSONParser(stream_paths=STREAM_PATHS)
+    events = []
+    for chunk in chunks:
+        events.extend(parser.feed_events(chunk))
+    return events
+
+
+@pytest.mark.parametrize("reply", REPLIES)
+@pytest.mark.parametrize("ensure_ascii", [True, False])
+def test_deltas_rebuild_fields_at_every_split_point(reply, ensure_ascii):
+    text = json.dumps(reply, ensure_ascii=ensure_ascii)
+    streamed = {path for path in STREAM_PATHS if path[0] in reply}
+    for chunks in _splits(text):
+        events = _feed_events(chunks)
+        deltas = {}
+        for kind, path, value in events:
+            if kind == "delta":
+                assert path in streamed
+                assert value, "空的 delta"
+                # 不會把代理對或跳脫序列切成兩半
+                assert not any(0xD800 <= ord(ch) <= 0xDFFF for ch in value), (chunks, value)
+                deltas[path] = deltas.get(path, "") + value
+        assert deltas == {path: reply[path[0]] for path in streamed if reply[path[0]]}, chunks
+        values = [(path, value) for kind, path, value in events if kind == "value"]
+        assert values == _expected_values(reply)
+
+
+def test_field_delta_precedes_its_value():
+    events = _feed_events(['{"ai_response": "Hel', 'lo", "hint": "h', 'i"}'])
+    assert events == [
+        ("delta", ("ai_response",), "Hel"),
+        ("delta", ("ai_response",), "lo"),
+        ("value", ("ai_response",), "Hello"),
+        ("delta", ("hint",), "h"),
+        ("delta", ("hint",), "i"),
+        ("value", ("hint",), "hi"),
+        ("value", (), {"ai_response": "Hello", "hint": "hi"}),
+    ]
+
+
+@pytest.mark.parametrize("chunks, deltas", [
+    # 跳脫序列切在 "\\" 之後：等到下一段才送出換行
+    (['{"hint": "a\\', 'nb"}'], ["a", "\nb"]),
+    # \uXXXX 切在中間
+    (['{"hint": "caf\\u00', 'e9!"}'], ["caf", "é!"]),
+    # 高位代理完整、低位代理在下一段：兩者一起送出
+    (['{"hint": "x\\ud83d', '\\ude00y"}'], ["x", "😀y"]),
+    (['{"hint": "x\\ud83d\\u', 'de00"}'], ["x", "😀"]),
+])
+def test_escapes_split_between_chunks(chunks, deltas):
+    assert [value for kind, _, value in _feed_events(chunks) if kind == "delta"] == deltas
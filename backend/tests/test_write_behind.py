@@ -0,0 +1,36 @@
+import threading
+
+import pytest
+
+from write_behind import WriteBehindQueue
+
+
+def test_run_calls_with_same_key_are_not_coalesced():
+    queue = WriteBehindQueue(name="test-write-behind")
+    gate = threading.Event()
+    queue.submit("blocker", gate.wait, 5)
+
+    results = {}
+
+    def runner(n):
+        results[n] = queue.run(("cold", "math"), lambda: n, timeout=5)
+
+    threads = [threading.Thread(target=runner, args=(n,)) for n in range(3)]
+    for thread in threads:
+        thread.start()
+    gate.set()
+    for thread in threads:
+        thread.join(5)
+    assert results == {0: 0, 1: 1, 2: 2}
+
+
+def test_run_times_out_with_clear_error():
+    queue = WriteBehindQueue(name="test-write-behind")
+    gate = threading.Event()
+    queue.submit("blocker", gate.wait, 5)
+    try:
+        with pytest.raises(TimeoutError):
+            queue.run(("cold", "english"), lambda: None, timeout=0.05)
+    finally:
+        gate.set()
+        assert queue.flush(5)
@@ -0,0 +1,125 @@
+import os
+import atexit
+import asyncio
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+
+# run() 等待寫入執行緒完成工作的上限（秒）
+WRITE_RUN_TIMEOUT = float(os.getenv("WRITE_RUN_TIMEOUT", "600"))
+
+class WriteBehindQueue:
+    """延後寫入佇列：由專用執行緒執行阻塞的檔案 I/O，請求處理只需更新記憶體狀態。
+
+    - submit(key, fn, *args)：登記一次寫入；同一 key 尚未執行的寫入會被合併，只保留最新一筆
+    - run(key, fn, *args)：在寫入執行緒上執行並等待結果；不與其他工作合併
+    - peek(key)：讀取尚未落盤（等待中或執行中）的最新參數，讓讀取端看到最新狀態
+    - flush()：阻塞直到所有寫入完成（供關閉流程與測試使用）
+    """
+
+    def __init__(self, name: str = "write-behind"):
+        self.name = name
+        self._pending: "OrderedDict[Hashable, Tuple[Callable[..., Any], Tuple[Any, ...]]]" = OrderedDict()
+        self._inflight: Dict[Hashable, Tuple[Any, ...]] = {}
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self._closed = False
+
+    def _ensure_worker(self) -> None:
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+            self._thread.start()
+
+    def submit(self, key: Hashable, fn: Callable[..., Any], *args: Any) -> None:
+        with self._cond:
+            if self._closed:
+                # 已關閉時直接同步寫入，避免資料遺失
+                fn(*args)
+                return
+            # 覆蓋同一 key 尚未執行的寫入（保留原本的排隊位置）
+            self._pending[key] = (fn, args)
+            self._ensure_worker()
+            self._cond.notify_all()
+
+    def run(self, key: Hashable, fn: Callable[..., Any], *args: Any, timeout: Optional[float] = None) -> Any:
+        """在寫入執行緒上執行 fn 並等待結果，與其他寫入序列化（例如搬移檔案的維護工作）。
+
+        每次呼叫各自排隊，不會被同一 key 的後續呼叫合併掉；
+        超過 timeout 秒（預設 WRITE_RUN_TIMEOUT）仍未完成時拋出 TimeoutError，工作仍留在佇列中。
+        """
+        done = threading.Event()
+        outcome: Dict[str, Any] = {}
+
+        def call(*call_args: Any) -> None:
+            try:
+                outcome["result"] = fn(*call_args)
+            except Exception as e:
+                outcome["error"] = e
+            finally:
+                done.set()
+
+        # 加上唯一的識別物件，避免覆蓋另一個等待中的 run（被覆蓋的呼叫端會永遠等不到結果）
+        self.submit((key, object()), call, *args)
+        wait = WRITE_RUN_TIMEOUT if timeout is None else timeout
+        if not done.wait(wait):
+            raise TimeoutError(f"背景寫入 {key!r} 在 {wait} 秒內未完成")
+        if "error" in outcome:
+            raise outcome["error"]
+        return outcome.get("result")
+
+    def discard(self, key: Hashable) -> None:
+        """取消尚未執行的寫入（執行中的不受影響）"""
+        with self._cond:
+            self._pending.pop(key, None)
+            self._cond.notify_all()
+
+    def peek(self, key: Hashable) -> Optional[Tuple[Any, ...]]:
+        with self._cond:
+            item = self._pending.get(key)
+            if item is not None:
+                return item[1]
+            return self._inflight.get(key)
+
+    def pending_items(self, prefix: Any = None):
+        """列出尚未落盤的 (key, args)；prefix 用於過濾 tuple key 的第一個元素"""
+        with self._cond:
+            items = [(k, v[1]) for k, v in self._pending.items()]
+            items.extend((k, v) for k, v in self._inflight.items() if k not in self._pending)
+        if prefix is None:
+            return items
+        return [(k, v) for k, v in items if isinstance(k, tuple) and k and k[0] == prefix]
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                key, (fn, args) = self._pending.popitem(last=False)
+                self._inflight[key] = args
+            try:
+                fn(*args)
+            except Exception as e:
+                print(f"❌ 背景寫入 {key} 失敗: {e}")
+            finally:
+                with self._cond:
+                    self._inflight.pop(key, None)
+                    self._cond.notify_all()
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """等待所有寫入完成；逾時回傳 False"""
+        with self._cond:
+            return self._cond.wait_for(lambda: not self._pending and not self._inflight, timeout=timeout)
+
+    async def aflush(self, timeout: Optional[float] = None) -> bool:
+        return await asyncio.to_thread(self.flush, timeout)
+
+    def close(self) -> None:
+        self.flush()
+        with self._cond:
+            self._closed = True
+
+
+# 全域實例：英文與數學對話共用同一個寫入執行緒
+write_queue = WriteBehindQueue()
+atexit.register(write_queue.close)